@@ -0,0 +1,110 @@
+# cart/batch.py
+"""
+Batched cart changes for ``cart:batch_update``.
+
+The cart drawer and the checkout modal queue the shopper's quantity edits
+and removals in the browser and post them together once the shopper
+pauses, as ``{"operations": [{"op": "update", "item_id": 3, "quantity": 2},
+{"op": "remove", "item_id": 5}, {"op": "add", "variant_id": 9,
+"quantity": 1}]}``. Item ids are the ones in the rendered cart lines, as
+for ``update_cart_item``.
+
+The operations are folded, in order, into one new quantity per variant.
+Variants the batch only adds to keep their sum as an increment instead,
+which ``add_quantities`` adds in the database, so an add that lands
+between reading the cart and applying the batch (another tab, a retried
+request) still counts. The stock holds (``stock.reserve_many``) and the
+cart lines then change in one transaction, in a fixed number of
+statements however many operations came in. A batch applies entirely or
+not at all.
+"""
+import json
+
+from django.db import transaction
+
+from store import stock
+from store.models import ProductVariant
+
+MAX_OPERATIONS = 100
+
+
+class Rejected(Exception):
+    """The batch was not applied; the message is for the shopper."""
+
+
+def parse(body):
+    """``[(op, id, quantity)]`` from a request body; ``ValueError`` when it is malformed."""
+    try:
+        operations = json.loads(body)["operations"]
+        if not isinstance(operations, list) or not 0 < len(operations) <= MAX_OPERATIONS:
+            raise ValueError("Expected a list of 1 to %d operations" % MAX_OPERATIONS)
+        parsed = []
+        for operation in operations:
+            op = operation["op"]
+            if op == "add":
+                parsed.append((op, int(operation["variant_id"]), int(operation.get("quantity", 1))))
+                if parsed[-1][2] <= 0:
+                    raise ValueError("Added quantities must be positive")
+            elif op == "update":
+                parsed.append((op, int(operation["item_id"]), int(operation["quantity"])))
+            elif op == "remove":
+                parsed.append((op, int(operation["item_id"]), 0))
+            else:
+                raise ValueError(f"Unknown operation {op!r}")
+    except (TypeError, KeyError) as e:
+        raise ValueError(e) from e
+    return parsed
+
+
+def plan(lines, operations):
+    """
+    ``(changes, increments)`` for ``operations``, given ``lines`` as
+    ``{item_id: (variant_id, quantity)}``: the new ``{variant_id: quantity}``
+    of every line an update or remove sets (0 removes), adds after them
+    included, and ``{variant_id: quantity}`` to add to the lines that are
+    only added to.
+    """
+    variant_of = {item_id: variant_id for item_id, (variant_id, _) in lines.items()}
+    current = dict(lines.values())
+    targets, increments = {}, {}
+    for op, key, quantity in operations:
+        if op == "add":
+            if key in targets:
+                targets[key] += quantity
+            else:
+                increments[key] = increments.get(key, 0) + quantity
+            continue
+        variant_id = variant_of.get(key)
+        if variant_id is None:
+            if op == "remove":
+                continue  # already gone: removed in another tab, or a retried batch
+            raise Rejected("Item not found")
+        targets[variant_id] = max(quantity, 0)
+        increments.pop(variant_id, None)  # the quantity set replaces what was added before it
+    changes = {pk: quantity for pk, quantity in targets.items() if quantity != current.get(pk, 0)}
+    return changes, increments
+
+
+def apply(request, storage, operations):
+    """Apply ``operations`` to the request's cart; raises ``Rejected`` and changes nothing otherwise."""
+    lines = storage.line_quantities()
+    changes, increments = plan(lines, operations)
+    current = dict(lines.values())
+    added = {key for op, key, _ in operations if op == "add"}
+    if added:
+        orderable = ProductVariant.objects.filter(pk__in=added, is_active=True, in_stock=True)
+        if len(added) != orderable.count():
+            raise Rejected("This variant is out of stock.")
+    if not changes and not increments:
+        return
+
+    with transaction.atomic():
+        holds = {**changes, **{pk: current.get(pk, 0) + quantity for pk, quantity in increments.items()}}
+        try:
+            stock.reserve_many(stock.holder(request), holds)
+        except stock.NotEnoughStock as e:
+            raise Rejected(f"Sorry, only {e.available} available.")
+        if increments:
+            storage.add_quantities(increments)
+        if changes:
+            storage.set_quantities(changes)
@@ -0,0 +1,87 @@
+# cart/maintenance.py
+"""
+Housekeeping for abandoned guest carts, expired sessions and expired
+checkout tokens (``order.idempotency``).
+
+Everything here deletes in small primary-key batches, each in its own
+short transaction, so the cart and session tables are never locked for
+long. ``purge_guest_carts`` is the hook for schedulers (the
+``purge_guest_carts`` management command, cron, the compose ``maintenance``
+service).
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.db import transaction
+from django.utils import timezone
+
+from cart.models import Cart, CartItem
+from order.idempotency import token_ttl
+from order.models import CheckoutToken
+
+DB_SESSION_ENGINES = (
+    "django.contrib.sessions.backends.db",
+    "django.contrib.sessions.backends.cached_db",
+)
+
+
+def _delete_in_batches(queryset, batch_size, pause):
+    """Delete ``queryset`` batch by batch; returns ``{model_label: rows}``."""
+    removed = {}
+    while True:
+        batch = list(queryset.values_list("pk", flat=True)[:batch_size])
+        if not batch:
+            return removed
+        with transaction.atomic():
+            _, per_model = queryset.model.objects.filter(pk__in=batch).delete()
+        for label, rows in per_model.items():
+            removed[label] = removed.get(label, 0) + rows
+        if pause:
+            time.sleep(pause)
+
+
+def purge_guest_carts(ttl=None, batch_size=500, dry_run=False, sessions=True, checkout_tokens=True, pause=0):
+    """
+    Delete guest carts (and their items) untouched for ``ttl``, checkout
+    tokens older than ``CHECKOUT_TOKEN_TTL`` and, when the session engine is
+    database backed, expired ``django_session`` rows.
+
+    Returns a summary dict with per-table row counts and rows per second.
+    """
+    if ttl is None:
+        ttl = timedelta(days=settings.GUEST_CART_TTL_DAYS)
+    now = timezone.now()
+    started = time.perf_counter()
+
+    stale_carts = Cart.objects.filter(is_guest=True, user__isnull=True, updated_at__lt=now - ttl)
+    expired_sessions = Session.objects.filter(expire_date__lt=now)
+    purge_sessions = sessions and settings.SESSION_ENGINE in DB_SESSION_ENGINES
+    expired_tokens = CheckoutToken.objects.filter(created_at__lt=now - timedelta(seconds=token_ttl()))
+
+    if dry_run:
+        removed = {
+            Cart._meta.label: stale_carts.count(),
+            CartItem._meta.label: CartItem.objects.filter(cart__in=stale_carts).count(),
+        }
+        if purge_sessions:
+            removed[Session._meta.label] = expired_sessions.count()
+        if checkout_tokens:
+            removed[CheckoutToken._meta.label] = expired_tokens.count()
+    else:
+        removed = _delete_in_batches(stale_carts, batch_size, pause)
+        if purge_sessions:
+            removed.update(_delete_in_batches(expired_sessions, batch_size, pause))
+        if checkout_tokens:
+            removed.update(_delete_in_batches(expired_tokens, batch_size, pause))
+
+    elapsed = time.perf_counter() - started
+    total = sum(removed.values())
+    return {
+        "dry_run": dry_run,
+        "removed": removed,
+        "total": total,
+        "seconds": elapsed,
+        "rows_per_second": total / elapsed if elapsed else 0.0,
+    }
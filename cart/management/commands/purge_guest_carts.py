@@ -0,0 +1,41 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from cart.maintenance import purge_guest_carts
+
+
+class Command(BaseCommand):
+    help = "Delete abandoned guest carts, expired database sessions and expired checkout tokens in small batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ttl-days", type=float, default=settings.GUEST_CART_TTL_DAYS,
+                            help="Guest carts not updated for this many days are removed.")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--pause", type=float, default=0.0,
+                            help="Seconds to sleep between batches to give other writers room.")
+        parser.add_argument("--skip-sessions", action="store_true",
+                            help="Leave expired django_session rows alone.")
+        parser.add_argument("--skip-checkout-tokens", action="store_true",
+                            help="Leave checkout tokens older than CHECKOUT_TOKEN_TTL alone.")
+        parser.add_argument("--dry-run", action="store_true",
+                            help="Only count what would be removed.")
+
+    def handle(self, *args, **options):
+        result = purge_guest_carts(
+            ttl=timedelta(days=options["ttl_days"]),
+            batch_size=options["batch_size"],
+            dry_run=options["dry_run"],
+            sessions=not options["skip_sessions"],
+            checkout_tokens=not options["skip_checkout_tokens"],
+            pause=options["pause"],
+        )
+
+        verb = "Would remove" if result["dry_run"] else "Removed"
+        for label, rows in sorted(result["removed"].items()):
+            self.stdout.write(f"{verb} {rows} {label} rows")
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {result['total']} rows in {result['seconds']:.2f}s "
+            f"({result['rows_per_second']:.0f} rows/s)"
+        ))
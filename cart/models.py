@@ -1,5 +1,6 @@
-from django.db import models
+from django.db import connections, models, router, transaction
 from django.conf import settings
+from django.utils import timezone
 
 
 class Cart(models.Model):
@@ -10,7 +11,7 @@ class Cart(models.Model):
         blank=True,
         related_name="carts"
     )
-    session_key = models.CharField(max_length=40, null=True, blank=True)
+    session_key = models.CharField(max_length=40, null=True, blank=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_guest = models.BooleanField(default=False)
@@ -18,23 +19,48 @@ class Cart(models.Model):
     class Meta:
         verbose_name = "Cart"
         verbose_name_plural = "Carts"
+        indexes = [
+            # cart.maintenance.purge_guest_carts scans guest carts by age
+            models.Index(fields=["is_guest", "updated_at"], name="cart_guest_updated_idx"),
+        ]
 
     def __str__(self):
         if self.user:
             return f"Cart for {self.user.email}"
         return f"Guest cart ({self.session_key})"
 
-    def merge_with(self, other_cart):
-        """Merge items from another cart into this one"""
-        for item in other_cart.items.all():
-            existing_item, created = self.items.get_or_create(
-                product=item.product,
-                defaults={"quantity": item.quantity}
+    def add_quantities(self, quantities):
+        """
+        Add ``{variant_id: quantity}`` to this cart with one upsert, however
+        many lines there are.
+
+        The sum happens in the conflict clause, so two adds to the same line
+        that race each other both count. ``ON CONFLICT ... DO UPDATE`` is the
+        SQLite and PostgreSQL syntax.
+        """
+        if not quantities:
+            return
+        connection = connections[router.db_for_write(CartItem, instance=self)]
+        table = connection.ops.quote_name(CartItem._meta.db_table)
+        fields = [CartItem._meta.get_field(name) for name in ("cart", "product", "quantity", "added_at")]
+        cart, product, quantity, added_at = (connection.ops.quote_name(field.column) for field in fields)
+        added = connection.ops.adapt_datetimefield_value(timezone.now())
+        params = []
+        for variant_id, amount in quantities.items():
+            params += [self.pk, variant_id, amount, added]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} ({cart}, {product}, {quantity}, {added_at}) "
+                f"VALUES {', '.join(['(%s, %s, %s, %s)'] * len(quantities))} "
+                f"ON CONFLICT ({cart}, {product}) DO UPDATE SET {quantity} = {table}.{quantity} + EXCLUDED.{quantity}",
+                params,
             )
-            if not created:
-                existing_item.quantity += item.quantity
-                existing_item.save()
-        other_cart.delete()
+
+    def merge_with(self, other_cart):
+        """Merge items from another cart into this one, then delete it"""
+        with transaction.atomic():
+            self.add_quantities(dict(other_cart.items.values_list("product_id", "quantity")))
+            other_cart.delete()
 
 
 class CartItem(models.Model):
@@ -0,0 +1,524 @@
+# cart/storage.py
+"""
+Cart storage engines.
+
+Signed-in customers always keep their cart in the ``Cart``/``CartItem``
+tables. Anonymous visitors (and ``is_guest`` accounts) use the engine named
+by ``settings.CART_GUEST_STORAGE``:
+
+* ``cart.storage.DatabaseCartStorage`` - one ``Cart`` row per session key.
+* ``cart.storage.SessionCartStorage`` - a compact ``{variant_id: quantity}``
+  dict kept in the session. Nothing is written to the cart tables until the
+  visitor logs in (``store.signals.merge_carts``) or checks out.
+
+Views should only talk to the object returned by ``get_cart_storage`` (or,
+in async views, ``aget_cart_storage``). Every operation has an ``a``-prefixed
+coroutine twin built on the async ORM and session API.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from cart.models import Cart, CartItem
+from store.models import ProductVariant
+
+DEFAULT_GUEST_STORAGE = "cart.storage.SessionCartStorage"  # keep in step with settings.CART_GUEST_STORAGE
+
+
+class CartLine:
+    """A cart row that isn't backed by a ``CartItem`` (session carts)."""
+
+    def __init__(self, id, product, quantity):
+        self.id = id
+        self.product = product
+        self.quantity = quantity
+
+    @property
+    def line_total(self):
+        return self.product.price * self.quantity
+
+
+class BaseCartStorage:
+    def __init__(self, request):
+        self.request = request
+        self._lines = None
+
+    def lines(self):
+        """Cart rows with ``id``, ``product`` (the variant), ``quantity`` and ``line_total``."""
+        if self._lines is None:
+            self._lines = self._load()
+        return self._lines
+
+    def count(self):
+        return len(self.lines())
+
+    def total(self):
+        return sum(line.line_total for line in self.lines())
+
+    def quantity_of(self, variant):
+        """How many of ``variant`` are in the cart (0 when none)."""
+        raise NotImplementedError
+
+    def variant_of(self, item_id):
+        """The variant id of line ``item_id``, or None when the line is unknown."""
+        raise NotImplementedError
+
+    def line_quantities(self):
+        """``{item_id: (variant_id, quantity)}`` for every line, without loading the variants."""
+        raise NotImplementedError
+
+    def add(self, variant, quantity):
+        raise NotImplementedError
+
+    def add_quantities(self, quantities):
+        """Add ``{variant_id: quantity}`` to many lines at once, creating the missing ones."""
+        raise NotImplementedError
+
+    def update(self, item_id, quantity):
+        """Set an absolute quantity (``<= 0`` removes). Returns False if the line is unknown."""
+        raise NotImplementedError
+
+    def remove(self, item_id):
+        raise NotImplementedError
+
+    def set_quantities(self, quantities):
+        """Set absolute ``{variant_id: quantity}`` for many lines at once (``<= 0`` removes)."""
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def _load(self):
+        raise NotImplementedError
+
+    async def alines(self):
+        if self._lines is None:
+            self._lines = await self._aload()
+        return self._lines
+
+    async def aquantity_of(self, variant):
+        raise NotImplementedError
+
+    async def avariant_of(self, item_id):
+        raise NotImplementedError
+
+    async def aline_quantities(self):
+        raise NotImplementedError
+
+    async def aadd(self, variant, quantity):
+        raise NotImplementedError
+
+    async def aupdate(self, item_id, quantity):
+        raise NotImplementedError
+
+    async def aremove(self, item_id):
+        return await self.aupdate(item_id, 0)
+
+    async def aset_quantities(self, quantities):
+        raise NotImplementedError
+
+    async def _aload(self):
+        raise NotImplementedError
+
+
+class DatabaseCartStorage(BaseCartStorage):
+    # login() cycles the session key before user_logged_in fires, so the
+    # guest cart id is kept in the session for merge_carts to find it.
+    guest_cart_session_key = "guest_cart_id"
+
+    def __init__(self, request):
+        super().__init__(request)
+        self._cart = None
+
+    def _is_customer(self):
+        user = self.request.user
+        return user.is_authenticated and not user.is_guest
+
+    def get_cart(self, create=False):
+        if self._cart is not None:
+            return self._cart
+
+        if self._is_customer():
+            if create:
+                cart, _ = Cart.objects.get_or_create(user=self.request.user, defaults={"is_guest": False})
+            else:
+                cart = Cart.objects.filter(user=self.request.user).first()
+        else:
+            session = self.request.session
+            if not session.session_key:
+                if not create:
+                    return None
+                session.create()
+                if not session.session_key:
+                    raise ImproperlyConfigured(
+                        "DatabaseCartStorage needs a server-side session engine; "
+                        "use SessionCartStorage with cookie-based sessions."
+                    )
+            if create:
+                cart, _ = Cart.objects.get_or_create(
+                    session_key=session.session_key, defaults={"is_guest": True}
+                )
+                session[self.guest_cart_session_key] = cart.id
+            else:
+                cart = Cart.objects.filter(session_key=session.session_key, is_guest=True).first()
+
+        self._cart = cart
+        return cart
+
+    def _load(self):
+        cart = self.get_cart()
+        if cart is None:
+            return []
+        return list(CartItem.objects.filter(cart=cart).select_related("product"))
+
+    def quantity_of(self, variant):
+        cart = self.get_cart()
+        if cart is None:
+            return 0
+        return CartItem.objects.filter(cart=cart, product=variant).values_list("quantity", flat=True).first() or 0
+
+    def variant_of(self, item_id):
+        cart = self.get_cart()
+        if cart is None:
+            return None
+        return CartItem.objects.filter(id=item_id, cart=cart).values_list("product_id", flat=True).first()
+
+    def line_quantities(self):
+        cart = self.get_cart()
+        if cart is None:
+            return {}
+        return {pk: (variant_id, quantity) for pk, variant_id, quantity in
+                CartItem.objects.filter(cart=cart).values_list("id", "product_id", "quantity")}
+
+    def _touch(self, cart):
+        # Keeps updated_at meaningful for cart.maintenance.purge_guest_carts
+        Cart.objects.filter(pk=cart.pk).update(updated_at=timezone.now())
+
+    def add(self, variant, quantity):
+        self.add_quantities({variant.pk: quantity})
+
+    def add_quantities(self, quantities):
+        cart = self.get_cart(create=True)
+        # An upsert that adds in the database, so concurrent adds of one variant all count
+        cart.add_quantities(quantities)
+        self._touch(cart)
+        self._lines = None
+
+    def update(self, item_id, quantity):
+        cart = self.get_cart()
+        if cart is None:
+            return False
+        items = CartItem.objects.filter(id=item_id, cart=cart)
+        if quantity > 0:
+            found = items.update(quantity=quantity)
+        else:
+            found, _ = items.delete()
+        if found:
+            self._touch(cart)
+        self._lines = None
+        return bool(found)
+
+    def remove(self, item_id):
+        return self.update(item_id, 0)
+
+    @staticmethod
+    def _split(quantities):
+        """``({variant_id: quantity} to upsert, [variant_id] to delete)`` for ``set_quantities``."""
+        keep = {variant_id: quantity for variant_id, quantity in quantities.items() if quantity > 0}
+        return keep, [variant_id for variant_id in quantities if variant_id not in keep]
+
+    def set_quantities(self, quantities):
+        keep, drop = self._split(quantities)
+        cart = self.get_cart(create=bool(keep))
+        if cart is None:
+            return
+        # One upsert and one delete, however many lines changed
+        CartItem.objects.bulk_create(
+            [CartItem(cart=cart, product_id=variant_id, quantity=quantity) for variant_id, quantity in keep.items()],
+            update_conflicts=True, unique_fields=["cart", "product"], update_fields=["quantity"],
+        )
+        if drop:
+            CartItem.objects.filter(cart=cart, product_id__in=drop).delete()
+        self._touch(cart)
+        self._lines = None
+
+    def clear(self):
+        cart = self.get_cart()
+        if cart is not None:
+            cart.items.all().delete()
+        self._lines = None
+
+    async def aget_cart(self, create=False):
+        if self._cart is not None:
+            return self._cart
+
+        if self._is_customer():
+            if create:
+                cart, _ = await Cart.objects.aget_or_create(user=self.request.user, defaults={"is_guest": False})
+            else:
+                cart = await Cart.objects.filter(user=self.request.user).afirst()
+        else:
+            session = self.request.session
+            if not session.session_key:
+                if not create:
+                    return None
+                await session.acreate()
+                if not session.session_key:
+                    raise ImproperlyConfigured(
+                        "DatabaseCartStorage needs a server-side session engine; "
+                        "use SessionCartStorage with cookie-based sessions."
+                    )
+            if create:
+                cart, _ = await Cart.objects.aget_or_create(
+                    session_key=session.session_key, defaults={"is_guest": True}
+                )
+                await session.aset(self.guest_cart_session_key, cart.id)
+            else:
+                cart = await Cart.objects.filter(session_key=session.session_key, is_guest=True).afirst()
+
+        self._cart = cart
+        return cart
+
+    async def _aload(self):
+        cart = await self.aget_cart()
+        if cart is None:
+            return []
+        return [item async for item in CartItem.objects.filter(cart=cart).select_related("product")]
+
+    async def aquantity_of(self, variant):
+        cart = await self.aget_cart()
+        if cart is None:
+            return 0
+        return await CartItem.objects.filter(cart=cart, product=variant).values_list("quantity", flat=True).afirst() or 0
+
+    async def avariant_of(self, item_id):
+        cart = await self.aget_cart()
+        if cart is None:
+            return None
+        return await CartItem.objects.filter(id=item_id, cart=cart).values_list("product_id", flat=True).afirst()
+
+    async def aline_quantities(self):
+        cart = await self.aget_cart()
+        if cart is None:
+            return {}
+        return {pk: (variant_id, quantity) async for pk, variant_id, quantity in
+                CartItem.objects.filter(cart=cart).values_list("id", "product_id", "quantity")}
+
+    async def _atouch(self, cart):
+        await Cart.objects.filter(pk=cart.pk).aupdate(updated_at=timezone.now())
+
+    async def aadd(self, variant, quantity):
+        cart = await self.aget_cart(create=True)
+        await sync_to_async(cart.add_quantities)({variant.pk: quantity})
+        await self._atouch(cart)
+        self._lines = None
+
+    async def aupdate(self, item_id, quantity):
+        cart = await self.aget_cart()
+        if cart is None:
+            return False
+        items = CartItem.objects.filter(id=item_id, cart=cart)
+        if quantity > 0:
+            found = await items.aupdate(quantity=quantity)
+        else:
+            found, _ = await items.adelete()
+        if found:
+            await self._atouch(cart)
+        self._lines = None
+        return bool(found)
+
+    async def aset_quantities(self, quantities):
+        keep, drop = self._split(quantities)
+        cart = await self.aget_cart(create=bool(keep))
+        if cart is None:
+            return
+        await CartItem.objects.abulk_create(
+            [CartItem(cart=cart, product_id=variant_id, quantity=quantity) for variant_id, quantity in keep.items()],
+            update_conflicts=True, unique_fields=["cart", "product"], update_fields=["quantity"],
+        )
+        if drop:
+            await CartItem.objects.filter(cart=cart, product_id__in=drop).adelete()
+        await self._atouch(cart)
+        self._lines = None
+
+
+class SessionCartStorage(BaseCartStorage):
+    """Keeps ``{"<variant_id>": quantity}`` under ``session["cart"]``; line ids are variant ids."""
+
+    session_key = "cart"
+
+    def _data(self):
+        return self.request.session.get(self.session_key, {})
+
+    def _save(self, data):
+        if data:
+            self.request.session[self.session_key] = data
+        else:
+            self.request.session.pop(self.session_key, None)
+        self._lines = None
+
+    @staticmethod
+    def _lines_from(data, variants):
+        lines = []
+        for variant_id, quantity in data.items():
+            variant = variants.get(int(variant_id))
+            if variant is not None:
+                lines.append(CartLine(variant.id, variant, quantity))
+        return lines
+
+    @staticmethod
+    def _added(data, variant, quantity):
+        data = dict(data)
+        key = str(variant.id)
+        data[key] = data.get(key, 0) + quantity
+        return data
+
+    @staticmethod
+    def _updated(data, item_id, quantity):
+        """The new data, or None when ``item_id`` isn't in the cart."""
+        key = str(item_id)
+        if key not in data:
+            return None
+        data = dict(data)
+        if quantity > 0:
+            data[key] = quantity
+        else:
+            del data[key]
+        return data
+
+    @staticmethod
+    def _set(data, quantities):
+        data = dict(data)
+        for variant_id, quantity in quantities.items():
+            if quantity > 0:
+                data[str(variant_id)] = quantity
+            else:
+                data.pop(str(variant_id), None)
+        return data
+
+    def _load(self):
+        data = self._data()
+        if not data:
+            return []
+        return self._lines_from(data, ProductVariant.objects.in_bulk([int(variant_id) for variant_id in data]))
+
+    def quantity_of(self, variant):
+        return self._data().get(str(variant.id), 0)
+
+    def variant_of(self, item_id):
+        return int(item_id) if str(item_id) in self._data() else None
+
+    @staticmethod
+    def _line_quantities(data):
+        return {int(variant_id): (int(variant_id), quantity) for variant_id, quantity in data.items()}
+
+    def line_quantities(self):
+        return self._line_quantities(self._data())
+
+    def add(self, variant, quantity):
+        self._save(self._added(self._data(), variant, quantity))
+
+    def update(self, item_id, quantity):
+        data = self._updated(self._data(), item_id, quantity)
+        if data is None:
+            return False
+        self._save(data)
+        return True
+
+    def remove(self, item_id):
+        return self.update(item_id, 0)
+
+    def add_quantities(self, quantities):
+        data = dict(self._data())
+        for variant_id, quantity in quantities.items():
+            data[str(variant_id)] = data.get(str(variant_id), 0) + quantity
+        self._save(data)
+
+    def set_quantities(self, quantities):
+        self._save(self._set(self._data(), quantities))
+
+    def clear(self):
+        self._save({})
+
+    async def _adata(self):
+        return await self.request.session.aget(self.session_key, {})
+
+    async def _asave(self, data):
+        if data:
+            await self.request.session.aset(self.session_key, data)
+        else:
+            await self.request.session.apop(self.session_key, None)
+        self._lines = None
+
+    async def _aload(self):
+        data = await self._adata()
+        if not data:
+            return []
+        variants = await ProductVariant.objects.ain_bulk([int(variant_id) for variant_id in data])
+        return self._lines_from(data, variants)
+
+    async def aquantity_of(self, variant):
+        return (await self._adata()).get(str(variant.id), 0)
+
+    async def avariant_of(self, item_id):
+        return int(item_id) if str(item_id) in await self._adata() else None
+
+    async def aline_quantities(self):
+        return self._line_quantities(await self._adata())
+
+    async def aadd(self, variant, quantity):
+        await self._asave(self._added(await self._adata(), variant, quantity))
+
+    async def aupdate(self, item_id, quantity):
+        data = self._updated(await self._adata(), item_id, quantity)
+        if data is None:
+            return False
+        await self._asave(data)
+        return True
+
+    async def aset_quantities(self, quantities):
+        await self._asave(self._set(await self._adata(), quantities))
+
+
+def get_cart_storage(request):
+    """Return the storage engine for this request (cached on the request)."""
+    storage = getattr(request, "_cart_storage", None)
+    if storage is None:
+        user = request.user
+        if user.is_authenticated and not user.is_guest:
+            storage_class = DatabaseCartStorage
+        else:
+            storage_class = import_string(getattr(settings, "CART_GUEST_STORAGE", DEFAULT_GUEST_STORAGE))
+        storage = request._cart_storage = storage_class(request)
+    return storage
+
+
+async def aget_cart_storage(request):
+    """``get_cart_storage`` for async views."""
+    storage = getattr(request, "_cart_storage", None)
+    if storage is None:
+        # Resolves the lazy request.user in a thread: request.auser() needs
+        # aget_user() on every auth backend, and the social-auth ones lack it
+        storage = await sync_to_async(get_cart_storage)(request)
+    return storage
+
+
+def materialize_guest_cart(request, user):
+    """
+    Move a session-stored guest cart into ``user``'s database cart.
+
+    Called on login and at checkout; returns the user's ``Cart`` or ``None``
+    when the session holds nothing.
+    """
+    data = request.session.get(SessionCartStorage.session_key)
+    if not data:
+        return None
+
+    cart, _ = Cart.objects.get_or_create(user=user, defaults={"is_guest": user.is_guest})
+    cart.add_quantities({int(variant_id): quantity for variant_id, quantity in data.items()})
+
+    del request.session[SessionCartStorage.session_key]
+    request.__dict__.pop("_cart_storage", None)
+    return cart
@@ -1,3 +1,450 @@
-from django.test import TestCase
+import json
+import random
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from cart import batch
+from cart.models import Cart, CartItem
+from cart.storage import DatabaseCartStorage, SessionCartStorage
+from order.models import CheckoutToken
+from perf.query_budget import QueryBudgetMixin, seed_storefront
+from store.models import Category, SubCategory, Product, ProductVariant, StockReservation
+
+User = get_user_model()
+
+
+def make_variants(count, stock=10, price="4.50"):
+    category = Category.objects.create(name="Fish", slug="fish")
+    subcategory = SubCategory.objects.create(category=category, name="Whole", slug="whole")
+    variants = []
+    for i in range(count):
+        product = Product.objects.create(category=category, name=f"Product {i}")
+        variants.append(ProductVariant.objects.create(
+            product=product, subcategory=subcategory, name=f"Product {i} - Whole",
+            price=Decimal(price), stock=stock,
+        ))
+    return variants
+
+
+@override_settings(CART_GUEST_STORAGE="cart.storage.SessionCartStorage")
+class SessionCartStorageTests(TestCase):
+    def setUp(self):
+        self.variant, self.other = make_variants(2)
+
+    def add(self, variant, quantity=1):
+        return self.client.post(
+            reverse("cart:add_to_cart", args=[variant.product_id]),
+            {"variant_id": variant.id, "quantity": quantity},
+        ).json()
+
+    def test_guest_add_does_not_touch_cart_tables(self):
+        self.add(self.variant, 2)
+        data = self.add(self.variant, 1)
+
+        self.assertTrue(data["success"])
+        self.assertEqual(data["cart_count"], 1)
+        self.assertEqual(data["cart_total"], "13.50")
+        self.assertFalse(Cart.objects.exists())
+        self.assertEqual(self.client.session[SessionCartStorage.session_key], {str(self.variant.id): 3})
+
+    def test_update_and_remove_use_variant_ids(self):
+        self.add(self.variant)
+        self.add(self.other)
+
+        data = self.client.post(
+            reverse("cart:update_cart_item", args=[self.variant.id]),
+            json.dumps({"quantity": 5}), content_type="application/json",
+        ).json()
+        self.assertEqual(data["cart_total"], "27.00")
+
+        data = self.client.post(reverse("cart:remove_cart_item", args=[self.other.id])).json()
+        self.assertEqual(data["cart_count"], 1)
+
+        data = self.client.post(reverse("cart:remove_cart_item", args=[self.other.id])).json()
+        self.assertFalse(data["success"])
+
+    def test_login_materializes_session_cart(self):
+        user = User.objects.create_user("shopper@phoenix.test", "pw-12345!")
+        Cart.objects.create(user=user).items.create(product=self.variant, quantity=1)
+        self.add(self.variant, 2)
+        self.add(self.other, 1)
+
+        self.client.login(username="shopper@phoenix.test", password="pw-12345!")
+
+        quantities = dict(CartItem.objects.filter(cart__user=user).values_list("product_id", "quantity"))
+        self.assertEqual(quantities, {self.variant.id: 3, self.other.id: 1})
+        self.assertNotIn(SessionCartStorage.session_key, self.client.session)
+
+    @override_settings()
+    def test_session_storage_is_the_default_without_the_setting(self):
+        del settings.CART_GUEST_STORAGE
+        self.add(self.variant, 2)
+
+        self.assertFalse(Cart.objects.exists())
+        self.assertEqual(self.client.session[SessionCartStorage.session_key], {str(self.variant.id): 2})
+
+
+@override_settings(CART_GUEST_STORAGE="cart.storage.DatabaseCartStorage")
+class DatabaseCartStorageTests(TestCase):
+    def test_guest_add_creates_session_cart(self):
+        variant, = make_variants(1)
+        self.client.post(
+            reverse("cart:add_to_cart", args=[variant.product_id]),
+            {"variant_id": variant.id, "quantity": 2},
+        )
+
+        cart = Cart.objects.get()
+        self.assertTrue(cart.is_guest)
+        self.assertEqual(cart.items.get().quantity, 2)
+
+    def test_items_are_scoped_to_the_current_cart(self):
+        variant, = make_variants(1)
+        user = User.objects.create_user("owner@phoenix.test", "pw-12345!")
+        item = Cart.objects.create(user=user).items.create(product=variant, quantity=1)
+
+        data = self.client.post(reverse("cart:remove_cart_item", args=[item.id])).json()
+
+        self.assertFalse(data["success"])
+        self.assertTrue(CartItem.objects.filter(id=item.id).exists())
+
+    def test_login_merges_database_guest_cart(self):
+        variant, = make_variants(1)
+        user = User.objects.create_user("merge@phoenix.test", "pw-12345!")
+        Cart.objects.create(user=user).items.create(product=variant, quantity=1)
+        self.client.post(
+            reverse("cart:add_to_cart", args=[variant.product_id]),
+            {"variant_id": variant.id, "quantity": 2},
+        )
+
+        self.client.login(username="merge@phoenix.test", password="pw-12345!")
+
+        self.assertEqual(Cart.objects.count(), 1)
+        self.assertEqual(CartItem.objects.get(cart__user=user).quantity, 3)
+
+
+class AsyncCartViewTests(TestCase):
+    """The cart endpoints are async views; drive them natively with AsyncClient."""
+
+    async def add(self, variant, quantity):
+        response = await self.async_client.post(
+            reverse("cart:add_to_cart", args=[variant.product_id]),
+            {"variant_id": variant.id, "quantity": quantity},
+        )
+        return response.json()
+
+    @override_settings(CART_GUEST_STORAGE="cart.storage.SessionCartStorage")
+    async def test_guest_session_cart(self):
+        variant, other = await sync_to_async(make_variants)(2)
+        await self.add(variant, 2)
+        data = await self.add(other, 1)
+
+        self.assertEqual(data["cart_count"], 2)
+        self.assertEqual(data["cart_total"], "13.50")
+        data = (await self.async_client.post(reverse("cart:remove_cart_item", args=[other.id]))).json()
+        self.assertEqual(data["cart_total"], "9.00")
+        self.assertFalse(await Cart.objects.aexists())
+
+    async def test_customer_database_cart(self):
+        variant, = await sync_to_async(make_variants)(1)
+        user = await sync_to_async(User.objects.create_user)("async@phoenix.test", "pw-12345!")
+        await self.async_client.aforce_login(user)
+
+        await self.add(variant, 1)
+        item = await CartItem.objects.aget(cart__user=user)
+        data = (await self.async_client.post(
+            reverse("cart:update_cart_item", args=[item.id]),
+            json.dumps({"quantity": 4}), content_type="application/json",
+        )).json()
+        summary = (await self.async_client.get(reverse("cart:get_cart_summary"))).json()
+
+        self.assertEqual(data["cart_total"], "18.00")
+        self.assertIn("18.00", summary["summary_html"])
+
+
+class BatchCartTests(TestCase):
+    def setUp(self):
+        self.a, self.b, self.c, self.d = make_variants(4, stock=5)
+
+    def batch(self, *operations):
+        return self.client.post(
+            reverse("cart:batch_update"), json.dumps({"operations": list(operations)}), content_type="application/json"
+        ).json()
+
+    def held(self):
+        return dict(StockReservation.objects.values_list("variant_id", "quantity"))
+
+    def customer_cart(self):
+        user = User.objects.create_user("batch@phoenix.test", "pw-12345!")
+        self.client.force_login(user)
+        for variant in (self.a, self.b, self.c):
+            self.batch({"op": "add", "variant_id": variant.id})
+        items = dict(CartItem.objects.filter(cart__user=user).values_list("product_id", "id"))
+        return user, items
+
+    def test_operations_are_applied_together(self):
+        user, items = self.customer_cart()
+
+        data = self.batch(
+            {"op": "update", "item_id": items[self.a.id], "quantity": 2},
+            {"op": "update", "item_id": items[self.a.id], "quantity": 4},
+            {"op": "remove", "item_id": items[self.b.id]},
+            {"op": "add", "variant_id": self.d.id, "quantity": 2},
+            {"op": "remove", "item_id": 999999},
+        )
+
+        self.assertTrue(data["success"])
+        self.assertEqual(data["cart_count"], 3)
+        self.assertEqual(data["cart_total"], "31.50")
+        lines = dict(CartItem.objects.filter(cart__user=user).values_list("product_id", "quantity"))
+        self.assertEqual(lines, {self.a.id: 4, self.c.id: 1, self.d.id: 2})
+        self.assertEqual(self.held(), lines)
+
+    def test_rejected_batch_changes_nothing(self):
+        user, items = self.customer_cart()
+
+        data = self.batch(
+            {"op": "update", "item_id": items[self.a.id], "quantity": 3},
+            {"op": "update", "item_id": items[self.b.id], "quantity": 9},
+        )
+
+        self.assertFalse(data["success"])
+        self.assertEqual(data["message"], "Sorry, only 5 available.")
+        self.assertEqual(data["cart_count"], 3)  # the cart as it is, to put the drawer back
+        self.assertEqual(self.held(), {self.a.id: 1, self.b.id: 1, self.c.id: 1})
+        self.assertEqual(set(CartItem.objects.filter(cart__user=user).values_list("quantity", flat=True)), {1})
+
+    def test_adds_landing_between_plan_and_apply_are_kept(self):
+        user, items = self.customer_cart()
+        cart = Cart.objects.get(user=user)
+
+        def plan_then_add_elsewhere(lines, operations):
+            planned = plan(lines, operations)
+            cart.add_quantities({self.a.id: 1, self.d.id: 1})  # another tab's add_to_cart
+            return planned
+
+        plan = batch.plan
+        with mock.patch("cart.batch.plan", plan_then_add_elsewhere):
+            data = self.batch(
+                {"op": "add", "variant_id": self.a.id, "quantity": 2},
+                {"op": "add", "variant_id": self.d.id},
+                {"op": "update", "item_id": items[self.b.id], "quantity": 3},
+            )
+
+        self.assertTrue(data["success"])
+        lines = dict(CartItem.objects.filter(cart=cart).values_list("product_id", "quantity"))
+        self.assertEqual(lines, {self.a.id: 4, self.b.id: 3, self.c.id: 1, self.d.id: 2})
+
+    @override_settings(CART_GUEST_STORAGE="cart.storage.SessionCartStorage")
+    def test_guest_session_cart(self):
+        self.batch({"op": "add", "variant_id": self.a.id, "quantity": 2}, {"op": "add", "variant_id": self.b.id})
+        data = self.batch({"op": "update", "item_id": self.a.id, "quantity": 5}, {"op": "remove", "item_id": self.b.id})
+
+        self.assertTrue(data["success"])
+        self.assertEqual(self.client.session[SessionCartStorage.session_key], {str(self.a.id): 5})
+        self.assertEqual(self.held(), {self.a.id: 5})
+        self.assertFalse(Cart.objects.exists())
+
+    def test_malformed_batches_are_refused(self):
+        ProductVariant.objects.filter(pk=self.d.pk).update(in_stock=False)
+        for operations in ([], [{"op": "explode"}], [{"op": "add", "variant_id": self.a.id, "quantity": 0}]):
+            self.assertEqual(self.batch(*operations), {"success": False, "message": "Invalid cart operations."})
+        self.assertEqual(self.batch({"op": "add", "variant_id": self.d.id})["message"], "This variant is out of stock.")
+        self.assertFalse(StockReservation.objects.exists())
+
+
+class CartMergeTests(TestCase):
+    def merge(self, size):
+        variants = make_variants(size)
+        target = Cart.objects.create(session_key=f"target-{size}")
+        source = Cart.objects.create(session_key=f"source-{size}", is_guest=True)
+        CartItem.objects.bulk_create(CartItem(cart=target, product=v, quantity=1) for v in variants[::2])
+        CartItem.objects.bulk_create(CartItem(cart=source, product=v, quantity=2) for v in variants)
+        return target, source
+
+    def test_merge_sums_quantities_and_deletes_source(self):
+        target, source = self.merge(4)
+
+        target.merge_with(source)
+
+        self.assertEqual(sorted(target.items.values_list("quantity", flat=True)), [2, 2, 3, 3])
+        self.assertFalse(Cart.objects.filter(pk=source.pk).exists())
+
+    def test_merge_uses_constant_number_of_queries(self):
+        target, source = self.merge(50)
+        # SAVEPOINT, SELECT source lines, upsert, DELETE items, DELETE cart, RELEASE SAVEPOINT
+        with self.assertNumQueries(6):
+            target.merge_with(source)
+        self.assertEqual(target.items.count(), 50)
+
+
+
+class ConcurrentCartAddTests(TransactionTestCase):
+    workers, adds = 8, 5
+
+    def interleave(self, add):
+        start = threading.Barrier(self.workers)
+
+        def run():
+            start.wait()
+            try:
+                for _ in range(self.adds):
+                    while True:
+                        try:
+                            with transaction.atomic():  # a retry must not repeat a write that went through
+                                add()
+                            break
+                        except OperationalError:  # SQLite: table locked by another writer, try again
+                            time.sleep(random.uniform(0, 0.01))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_interleaved_adds_to_one_line_are_all_counted(self):
+        variant, = make_variants(1)
+        cart = Cart.objects.create(session_key="shared")
+        cart.items.create(product=variant, quantity=1)
+
+        self.interleave(lambda: Cart.objects.get(pk=cart.pk).add_quantities({variant.id: 1}))
+
+        self.assertEqual(cart.items.get().quantity, 1 + self.workers * self.adds)
+
+    def test_interleaved_storage_adds_are_all_counted(self):
+        variant, = make_variants(1)
+        user = User.objects.create_user("tabs@phoenix.test", "pw-12345!")
+        Cart.objects.create(user=user).items.create(product=variant, quantity=1)
+        request = RequestFactory().post("/")
+        request.user = user
+
+        self.interleave(lambda: DatabaseCartStorage(request).add(variant, 1))
+
+        self.assertEqual(CartItem.objects.get(cart__user=user).quantity, 1 + self.workers * self.adds)
+
+
+@override_settings(SESSION_ENGINE="django.contrib.sessions.backends.db")
+class PurgeGuestCartsTests(TestCase):
+    def setUp(self):
+        variant, = make_variants(1)
+        user = User.objects.create_user("keep@phoenix.test", "pw-12345!")
+        old = timezone.now() - timedelta(days=30)
+
+        self.stale = [Cart.objects.create(session_key=f"stale-{i}", is_guest=True) for i in range(3)]
+        for cart in self.stale:
+            cart.items.create(product=variant, quantity=1)
+        self.fresh = Cart.objects.create(session_key="fresh", is_guest=True)
+        self.customer = Cart.objects.create(user=user)
+        Cart.objects.filter(pk__in=[c.pk for c in self.stale] + [self.customer.pk]).update(updated_at=old)
+
+        Session.objects.create(session_key="expired", session_data="", expire_date=old)
+        Session.objects.create(session_key="live", session_data="", expire_date=timezone.now() + timedelta(days=1))
+
+        self.expired_token = CheckoutToken.objects.create(user=user, token="expired")
+        CheckoutToken.objects.filter(pk=self.expired_token.pk).update(created_at=old)
+        self.live_token = CheckoutToken.objects.create(user=user, token="live")
+
+    def test_removes_stale_guest_carts_and_expired_sessions_in_batches(self):
+        out = StringIO()
+        call_command("purge_guest_carts", "--ttl-days", "14", "--batch-size", "2", stdout=out)
+
+        self.assertEqual(set(Cart.objects.values_list("pk", flat=True)), {self.fresh.pk, self.customer.pk})
+        self.assertFalse(CartItem.objects.exists())
+        self.assertEqual(list(Session.objects.values_list("session_key", flat=True)), ["live"])
+        self.assertIn("Removed 3 cart.Cart rows", out.getvalue())
+        self.assertIn("rows/s", out.getvalue())
+
+    def test_removes_checkout_tokens_older_than_their_ttl(self):
+        out = StringIO()
+        call_command("purge_guest_carts", stdout=out)
+
+        self.assertEqual(list(CheckoutToken.objects.values_list("pk", flat=True)), [self.live_token.pk])
+        self.assertIn("Removed 1 order.CheckoutToken rows", out.getvalue())
+
+    def test_dry_run_only_counts(self):
+        out = StringIO()
+        call_command("purge_guest_carts", "--dry-run", stdout=out)
+
+        self.assertEqual(Cart.objects.count(), 5)
+        self.assertEqual(Session.objects.count(), 2)
+        self.assertIn("Would remove 3 cart.CartItem rows", out.getvalue())
+        self.assertIn("Would remove 1 sessions.Session rows", out.getvalue())
+        self.assertIn("Would remove 1 order.CheckoutToken rows", out.getvalue())
+        self.assertEqual(CheckoutToken.objects.count(), 2)
+
+
+class CartQueryBudgetTests(QueryBudgetMixin, TestCase):
+    def customer(self, size):
+        user = User.objects.create_user(f"budget-{size}@phoenix.test", "pw-12345!")
+        variants = seed_storefront(size, user=user)
+        self.client.force_login(user)
+        return user, variants
+
+    def test_add_to_cart(self):
+        def scenario(size):
+            _, variants = self.customer(size)
+            variant = variants[-1]
+            url = reverse("cart:add_to_cart", args=[variant.product_id])
+            return lambda: self.client.post(url, {"variant_id": variant.id, "quantity": 1})
+
+        self.assertQueriesConstant("cart:add_to_cart", scenario)
+
+    def test_update_cart_item(self):
+        def scenario(size):
+            user, _ = self.customer(size)
+            item = CartItem.objects.filter(cart__user=user).first()
+            url = reverse("cart:update_cart_item", args=[item.id])
+            return lambda: self.client.post(url, json.dumps({"quantity": 3}), content_type="application/json")
+
+        self.assertQueriesConstant("cart:update_cart_item", scenario)
+
+    def test_remove_cart_item(self):
+        def scenario(size):
+            user, _ = self.customer(size)
+            item = CartItem.objects.filter(cart__user=user).first()
+            return lambda: self.client.post(reverse("cart:remove_cart_item", args=[item.id]))
+
+        self.assertQueriesConstant("cart:remove_cart_item", scenario)
+
+    def test_batch_update(self):
+        def scenario(size):
+            user, variants = self.customer(size)
+            operations = [
+                {"op": "update", "item_id": item_id, "quantity": 2}
+                for item_id in CartItem.objects.filter(cart__user=user).values_list("id", flat=True)
+            ]
+            operations.append({"op": "add", "variant_id": variants[-1].id})
+            body = json.dumps({"operations": operations})
+            return lambda: self.client.post(reverse("cart:batch_update"), body, content_type="application/json")
+
+        self.assertQueriesConstant("cart:batch_update", scenario)
+
+    def test_get_cart_summary(self):
+        def scenario(size):
+            self.customer(size)
+            return lambda: self.client.get(reverse("cart:get_cart_summary"))
+
+        self.assertQueriesConstant("cart:get_cart_summary", scenario)
+
+    def test_cart_state(self):
+        def scenario(size):
+            self.customer(size)
+            return lambda: self.client.get(reverse("cart:cart_state"))
+
+        self.assertQueriesConstant("cart:cart_state", scenario)
@@ -8,5 +8,7 @@ urlpatterns = [
     path('add-to-cart/<int:product_id>/', views.add_to_cart, name='add_to_cart'),
     path('update/<int:item_id>/', views.update_cart_item, name='update_cart_item'),
     path('remove/<int:item_id>/', views.remove_cart_item, name='remove_cart_item'),
+    path('batch/', views.batch_update, name='batch_update'),
+    path('state/', views.cart_state, name='cart_state'),
     path('summary/', views.get_cart_summary, name='get_cart_summary'),
 ]
\ No newline at end of file
@@ -1,86 +1,110 @@
 import json
-from django.shortcuts import render, redirect, get_object_or_404
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.views.decorators.http import require_POST
-from cart.models import Cart, CartItem
+from cart import batch
+from cart.storage import aget_cart_storage
+from order.idempotency import issue_token
+from store import stock
 from store.models import Product, ProductVariant
 from django.http import JsonResponse
+from django.middleware.csrf import get_token
+from django.views.decorators.cache import never_cache
 from django.template.loader import render_to_string
+from perf import metrics
 
+# The cart endpoints are async (async ORM and session API), so under ASGI a
+# worker keeps serving them while other requests wait on the database or
+# WeasyPrint. Under WSGI Django runs them through async_to_sync unchanged.
 
 
 @require_POST
-def add_to_cart(request, product_id):
-    product = get_object_or_404(Product, id=product_id)
+async def add_to_cart(request, product_id):
+    product = await aget_object_or_404(Product, id=product_id)
     variant_id = request.POST.get("variant_id")
     
     if not variant_id:
         return JsonResponse({"success": False, "message": "Variant selection required."})
     
-    variant = get_object_or_404(ProductVariant, id=variant_id, product=product, is_active=True)
+    variant = await aget_object_or_404(ProductVariant, id=variant_id, product=product, is_active=True)
     
     if not variant.in_stock:
         return JsonResponse({"success": False, "message": "This variant is out of stock."})
     
     quantity = int(request.POST.get("quantity", 1))
 
-    # Get or create cart
-    if request.user.is_authenticated and not request.user.is_guest:
-        cart, _ = Cart.objects.get_or_create(user=request.user, defaults={"is_guest": False})
-    else:
-        if not request.session.session_key:
-            request.session.create()
-        cart, _ = Cart.objects.get_or_create(
-            session_key=request.session.session_key, defaults={"is_guest": True}
-        )
-
-    # Increment if exists, otherwise create
-    cart_item, created = CartItem.objects.get_or_create(cart=cart, product=variant)
-    if created:
-        cart_item.quantity = quantity
-    else:
-        cart_item.quantity += quantity
-    cart_item.save()
+    storage = await aget_cart_storage(request)
+    try:
+        # Hold stock for the whole line now, so a stock-out shows up here, not at checkout
+        await stock.areserve(request, variant.id, await storage.aquantity_of(variant) + quantity)
+    except stock.NotEnoughStock as e:
+        return JsonResponse({"success": False, "message": f"Sorry, only {e.available} available."})
+    await storage.aadd(variant, quantity)
+    metrics.CART_ADDS.inc()
 
-    return _cart_response(cart)
+    return await _cart_response(storage)
 
 
 @require_POST
-def update_cart_item(request, item_id):
+async def update_cart_item(request, item_id):
     try:
         data = json.loads(request.body)
         quantity = int(data.get("quantity", 1))
+    except (ValueError, TypeError, json.JSONDecodeError):
+        return JsonResponse({"success": False, "message": "Invalid quantity."})
 
-        cart_item = CartItem.objects.get(id=item_id)
-        cart = cart_item.cart
-
-        if quantity > 0:
-            cart_item.quantity = quantity  # absolute set
-            cart_item.save()
-        else:
-            cart_item.delete()
+    storage = await aget_cart_storage(request)
+    variant_id = await storage.avariant_of(item_id)
+    if variant_id is None:
+        return JsonResponse({"success": False, "message": "Item not found"})
+    try:
+        await stock.areserve(request, variant_id, max(quantity, 0))
+    except stock.NotEnoughStock as e:
+        return JsonResponse({"success": False, "message": f"Sorry, only {e.available} available."})
+    if not await storage.aupdate(item_id, quantity):  # absolute set, <= 0 removes
+        return JsonResponse({"success": False, "message": "Item not found"})
+    return await _cart_response(storage)
 
-        return _cart_response(cart)
 
-    except CartItem.DoesNotExist:
+@require_POST
+async def remove_cart_item(request, item_id):
+    storage = await aget_cart_storage(request)
+    variant_id = await storage.avariant_of(item_id)
+    if variant_id is None or not await storage.aremove(item_id):
         return JsonResponse({"success": False, "message": "Item not found"})
-    except (ValueError, TypeError, json.JSONDecodeError):
-        return JsonResponse({"success": False, "message": "Invalid quantity."})
+    await stock.arelease(request, variant_id)
+    return await _cart_response(storage)
 
 
 @require_POST
-def remove_cart_item(request, item_id):
+async def batch_update(request):
+    """Apply the drawer's queued add/update/remove operations together (cart/batch.py)."""
     try:
-        cart_item = CartItem.objects.get(id=item_id)
-        cart = cart_item.cart
-        cart_item.delete()
-        return _cart_response(cart)
-    except CartItem.DoesNotExist:
-        return JsonResponse({"success": False, "message": "Item not found"})
+        operations = batch.parse(request.body)
+    except ValueError:
+        return JsonResponse({"success": False, "message": "Invalid cart operations."})
+
+    storage = await aget_cart_storage(request)
+    try:
+        # One thread for the whole transaction; holder() may touch the session
+        await sync_to_async(batch.apply)(request, storage, operations)
+    except batch.Rejected as e:
+        # Nothing changed: the cart as it stands lets the page undo the shopper's edits
+        return await _cart_response(storage, message=str(e))
+    adds = sum(op == "add" for op, _, _ in operations)
+    if adds:
+        metrics.CART_ADDS.inc(adds)
+    return await _cart_response(storage)
 
 
-def _cart_response(cart):
-    cart_items = CartItem.objects.filter(cart=cart).select_related("product", "product__product")
+@never_cache
+async def cart_state(request):
+    """The visitor's cart and a CSRF token, for pages served from store.pagecache."""
+    storage = await aget_cart_storage(request)
+    return await _cart_response(storage, csrf_token=get_token(request))
 
+
+async def _cart_response(storage, message=None, **extra):
     cart_items_with_totals = [
         {
             "id": item.id,
@@ -90,7 +114,7 @@ def _cart_response(cart):
             "quantity": item.quantity,
             "line_total": item.line_total,
         }
-        for item in cart_items
+        for item in await storage.alines()
     ]
 
     cart_count = len(cart_items_with_totals)
@@ -101,51 +125,38 @@ def _cart_response(cart):
         {"cart_items": cart_items_with_totals},
     )
 
-    return JsonResponse({
-        "success": True,
+    data = {
+        "success": message is None,
         "cart_count": cart_count,
         "cart_total": f"{cart_total:.2f}",
         "cart_html": cart_html,
-    })
+    }
+    if message is not None:
+        data["message"] = message
+    data.update(extra)
+    return JsonResponse(data)
 
 
 
-def get_cart_summary(request):
+async def get_cart_summary(request):
     """
     Returns the updated cart summary HTML for the checkout modal.
     """
-    cart_items = []
-    cart_total = 0
-    
-    # Get the correct cart
-    if request.user.is_authenticated and not request.user.is_guest:
-        try:
-            cart = Cart.objects.get(user=request.user)
-        except Cart.DoesNotExist:
-            cart = None
-    else:
-        if request.session.session_key:
-            try:
-                cart = Cart.objects.get(session_key=request.session.session_key, is_guest=True)
-            except Cart.DoesNotExist:
-                cart = None
-
-    if cart:
-        # Create a new list to hold the items with their calculated totals
-        cart_items_with_totals = []
-        for item in cart.items.all():
-            item_data = {
-                'id': item.id,
-                'product': item.product,
-                'quantity': item.quantity,
-                'line_total': item.line_total  # Read the property
-            }
-            cart_items_with_totals.append(item_data)
-        
-        cart_total = sum(item['line_total'] for item in cart_items_with_totals)
-        cart_items = cart_items_with_totals # Use this new list
-
-    summary_html = render_to_string(
+    storage = await aget_cart_storage(request)
+    cart_items = [
+        {
+            'id': item.id,
+            'product': item.product,
+            'quantity': item.quantity,
+            'line_total': item.line_total,
+        }
+        for item in await storage.alines()
+    ]
+    cart_total = sum(item['line_total'] for item in cart_items)
+
+    # Rendering with the request runs the context processors, which may touch
+    # the session or database synchronously
+    summary_html = await sync_to_async(render_to_string)(
         'store/partials/checkout_summary.html',
         {
             'cart_items': cart_items,
@@ -156,5 +167,7 @@ def get_cart_summary(request):
     
     return JsonResponse({
         'success': True,
-        'summary_html': summary_html
+        'summary_html': summary_html,
+        # One per rendering of the modal; confirm_order answers repeat submits of it once
+        'checkout_token': issue_token(),
     })
\ No newline at end of file
@@ -0,0 +1,11 @@
+# gunicorn.conf.py - gunicorn reads this from the working directory on start
+import os
+import socket
+from pathlib import Path
+
+
+def on_starting(server):
+    # Per-worker metric files from a previous run would be summed into the new one.
+    # Only this host's: other containers (the task worker) share the directory.
+    for path in Path(os.getenv("METRICS_DIR", "/tmp/phoenix_mart_metrics")).glob(f"{socket.gethostname()}-*.db"):
+        path.unlink(missing_ok=True)
@@ -1,3 +1,53 @@
+from datetime import timedelta
+
 from django.contrib import admin
+from django.template.response import TemplateResponse
+from django.utils import timezone
+
+from .models import DailySales, OrderNotification
+from .reporting import dashboard
 
 # Register your models here.
+@admin.register(OrderNotification)
+class OrderNotificationAdmin(admin.ModelAdmin):
+    list_display = ("order", "kind", "status", "send_after", "sent_at")
+    list_filter = ("kind", "status")
+    readonly_fields = ("order", "kind", "status", "created_at", "send_after", "batch", "sent_at")
+
+
+@admin.register(DailySales)
+class SalesDashboardAdmin(admin.ModelAdmin):
+    """The changelist is a sales dashboard read from the rollups in order/reporting.py."""
+
+    RANGES = (7, 30, 90, 365)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        try:
+            days = int(request.GET.get("days", 30))
+        except ValueError:
+            days = 30
+        days = days if days in self.RANGES else 30
+        end = timezone.localdate()
+        start = end - timedelta(days=days - 1)
+
+        context = {
+            **self.admin_site.each_context(request),
+            "title": "Sales dashboard",
+            "opts": self.model._meta,
+            "ranges": self.RANGES,
+            "days": days,
+            "start": start,
+            "end": end,
+            **dashboard(start, end),
+            **(extra_context or {}),
+        }
+        return TemplateResponse(request, "admin/order/sales_dashboard.html", context)
@@ -0,0 +1,217 @@
+# order/exports.py
+"""
+Streaming CSV/XLSX exports of orders for accounting: one row per order line,
+with the order, customer and shipping address repeated on each.
+
+Orders are read with ``.iterator(chunk_size=...)``; the user and address are
+joined and the items prefetched once per chunk, so memory stays flat however
+many orders there are. Output is produced in pieces as it is read, for
+``StreamingHttpResponse`` (``OrderAdmin`` export actions) and for
+``manage.py export_orders``. XLSX is written with the standard library: a
+zip archive streamed with data descriptors, holding one worksheet of inline
+strings, so no spreadsheet package is needed. Text that a spreadsheet would
+read as a formula (customer-entered names and addresses) is prefixed with
+``'`` in both formats.
+"""
+import csv
+import io
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import OrderItem
+
+CHUNK_SIZE = 2000
+ROWS_PER_PIECE = 500  # rows joined into each piece handed to the response
+
+COLUMNS = (
+    "order_id", "created_at", "status", "cod", "customer_email", "order_total",
+    "full_name", "phone", "street", "city", "state", "zipcode", "country",
+    "variant_id", "product", "variant", "quantity", "unit_price", "line_total",
+)
+
+CONTENT_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+
+# Leading characters that make Excel/LibreOffice evaluate a cell as a formula
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def spreadsheet_text(value):
+    """``value`` as text, quoted with ``'`` if a spreadsheet would run it as a formula."""
+    text = str(value)
+    return "'" + text if text.startswith(FORMULA_PREFIXES) else text
+
+
+def export_queryset(queryset):
+    return queryset.select_related("user", "address").prefetch_related(
+        Prefetch("items", queryset=OrderItem.objects.select_related("product__product", "product__subcategory").order_by("pk"))
+    ).order_by("pk")
+
+
+def rows(queryset, chunk_size=CHUNK_SIZE):
+    """One tuple per order line (or one per order without lines), in ``COLUMNS`` order."""
+    for order in export_queryset(queryset).iterator(chunk_size=chunk_size):
+        address = getattr(order, "address", None)
+        head = (
+            order.pk, timezone.localtime(order.created_at).isoformat(timespec="seconds"), order.status,
+            order.COD, order.user.email, order.total_price,
+            *(getattr(address, field, "") for field in ("full_name", "phone", "street", "city", "state", "zipcode", "country")),
+        )
+        items = order.items.all()
+        if not items:
+            yield head + ("",) * 6
+        for item in items:
+            variant = item.product
+            yield head + (
+                variant.pk, variant.product.name, variant.subcategory.name,
+                item.quantity, item.price, item.get_total_price(),
+            )
+
+
+def _pieces(lines, size=ROWS_PER_PIECE):
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= size:
+            yield "".join(batch)
+            batch = []
+    if batch:
+        yield "".join(batch)
+
+
+class _Echo:
+    """File-like object whose ``write`` hands the formatted line back (csv docs idiom)."""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(queryset, chunk_size=CHUNK_SIZE):
+    writer = csv.writer(_Echo())
+    lines = (
+        writer.writerow([spreadsheet_text(value) if isinstance(value, str) else value for value in row])
+        for row in rows(queryset, chunk_size)
+    )
+    yield writer.writerow(COLUMNS)
+    yield from _pieces(lines)
+
+
+# --- XLSX ---
+_ILLEGAL_XML = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+_XLSX_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Orders" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+
+def _cell(value):
+    if isinstance(value, bool):
+        return f'<c t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)) or hasattr(value, "as_tuple"):  # Decimal
+        return f"<c><v>{value}</v></c>"
+    text = escape(_ILLEGAL_XML.sub("", spreadsheet_text(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _sheet_row(row):
+    return "<row>" + "".join(_cell(value) for value in row) + "</row>"
+
+
+class _Drain(io.RawIOBase):
+    """Unseekable sink: ``zipfile`` writes into it and the generator takes the bytes out."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+def stream_xlsx(queryset, chunk_size=CHUNK_SIZE):
+    sink = _Drain()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in _XLSX_PARTS.items():
+            archive.writestr(name, content)
+        yield sink.take()
+
+        with archive.open("xl/worksheets/sheet1.xml", "w") as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            sheet.write(_sheet_row(COLUMNS).encode())
+            for piece in _pieces(_sheet_row(row) for row in rows(queryset, chunk_size)):
+                sheet.write(piece.encode())
+                yield sink.take()
+            sheet.write(b"</sheetData></worksheet>")
+    yield sink.take()
+
+
+STREAMS = {"csv": stream_csv, "xlsx": stream_xlsx}
+
+
+async def _async_pieces(pieces):
+    # Each next() runs on the request's sync thread, where the DB cursor lives
+    while (piece := await sync_to_async(next)(pieces, None)) is not None:
+        yield piece
+
+
+def export_response(request, queryset, fmt="csv"):
+    """A streaming download of ``queryset`` as ``fmt`` ("csv" or "xlsx")."""
+    pieces = STREAMS[fmt](queryset)
+    if isinstance(request, ASGIRequest):
+        # Django would buffer a sync iterator in full under ASGI
+        pieces = _async_pieces(pieces)
+    response = StreamingHttpResponse(pieces, content_type=CONTENT_TYPES[fmt])
+    filename = f"orders-{timezone.localdate():%Y%m%d}.{fmt}"
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
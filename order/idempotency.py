@@ -0,0 +1,109 @@
+# order/idempotency.py
+"""
+Idempotent checkout submissions.
+
+Opening the checkout modal (``get_cart_summary`` / ``buy_now``) hands the
+page a fresh ``checkout_token``, which the form posts back to
+``confirm_order``. The first request with a token claims it by inserting a
+``CheckoutToken`` row, in the checkout's own transaction, and runs the
+checkout. The unique constraint on (user, token) lets only one request
+through, on every cache backend and across workers: a repeat submit's
+INSERT waits for the first transaction and then fails, and is answered with
+the same redirect to the order success page. No second order is made and no
+stock is taken twice.
+
+The placed order is also kept in the cache for ``CHECKOUT_TOKEN_TTL``
+seconds, so most replays are answered without touching the database, and
+``cart.maintenance.purge_guest_carts`` deletes claims older than that. If
+the database can't take the claim right now (SQLite's write lock), the
+repeat gets a 409 with ``Retry-After`` rather than waiting in the worker.
+
+A checkout that fails validation (missing address, not enough stock)
+deletes its claim in the same transaction, so the customer can correct the
+form and submit again. Requests without a token are processed as before.
+"""
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, OperationalError, transaction
+from django.http import HttpResponse
+from django.shortcuts import redirect
+
+from .models import CheckoutToken
+
+TOKEN_FIELD = "checkout_token"
+RETRY_AFTER = 2
+
+
+def token_ttl():
+    return getattr(settings, "CHECKOUT_TOKEN_TTL", 24 * 60 * 60)
+
+
+def issue_token():
+    return uuid.uuid4().hex
+
+
+def _key(user, token):
+    # Scoped to the customer, so one account can't replay another's checkout
+    return f"checkout-token:{user.pk}:{token}"
+
+
+def idempotent_checkout(view):
+    """
+    Answer repeat submissions of one ``checkout_token`` from the stored
+    outcome. Goes outside ``transaction.atomic``: it opens the transaction
+    the claim and the checkout share. The view sets
+    ``request.checkout_order`` when it places an order.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        token = request.POST.get(TOKEN_FIELD, "")[:64] if request.method == "POST" else None
+        if not token:
+            return view(request, *args, **kwargs)
+
+        key = _key(request.user, token)
+        order_id = cache.get(key)
+        if order_id is not None:
+            return redirect("order:order_success", order_id=order_id)
+
+        claim = None
+        try:
+            with transaction.atomic():
+                claim = CheckoutToken.objects.create(user=request.user, token=token)
+                response = view(request, *args, **kwargs)
+                order = getattr(request, "checkout_order", None)
+                if order is None:
+                    claim.delete()  # released: the form can be corrected and sent again
+                else:
+                    claim.order = order
+                    claim.save(update_fields=["order"])
+                    transaction.on_commit(lambda: cache.set(key, order.id, token_ttl()))
+                return response
+        except (IntegrityError, OperationalError) as exc:
+            if claim is not None:  # raised by the checkout itself, not the claim
+                raise
+            if isinstance(exc, OperationalError):
+                return still_processing()
+            return replay(request, key, token)
+
+    return wrapper
+
+
+def replay(request, key, token):
+    """The response for a token whose claim another request committed."""
+    order_id = (
+        CheckoutToken.objects.filter(user=request.user, token=token).values_list("order_id", flat=True).first()
+    )
+    if order_id is None:  # released meanwhile: that submission failed validation and showed why
+        return redirect(request.META.get('HTTP_REFERER') or "store:index")
+    cache.set(key, order_id, token_ttl())
+    return redirect("order:order_success", order_id=order_id)
+
+
+def still_processing():
+    response = HttpResponse("Your order is still being placed. Please try again in a moment.",
+                            status=409, content_type="text/plain; charset=utf-8")
+    response["Retry-After"] = str(RETRY_AFTER)
+    return response
@@ -0,0 +1,76 @@
+# order/invoices.py
+"""
+Invoice PDFs. ``order.tasks.render_invoice`` renders each new order's PDF
+in the background and keeps it under ``INVOICE_DIR``; ``generate_invoice``
+serves that file and only renders inline when it isn't there yet.
+``INVOICE_DIR`` is private storage (invoices carry addresses), never MEDIA_ROOT.
+"""
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.template.loader import render_to_string
+
+from perf import metrics
+from perf.instrumentation import timed
+
+from .models import Order
+
+
+def invoice_storage():
+    return FileSystemStorage(location=settings.INVOICE_DIR)
+
+
+def invoice_name(order_id):
+    return f"invoice_{order_id}.pdf"
+
+
+def render_invoice_pdf(order, base_url):
+    """The PDF bytes for ``order`` (fetched with ``user`` and ``address``)."""
+    context = {
+        'order': order,
+        'order_items': order.items.select_related('product__product', 'product__subcategory'),
+        'shipping_address': order.address,
+        'base_url': base_url,
+        'site_name': 'Phoenix Mart',
+    }
+    html_content = render_to_string('order/invoice_template.html', context)
+    # Imported here: WeasyPrint pulls in Pango/cairo and its CSS engine, which
+    # would otherwise load into every worker at boot (manage.py audit_imports)
+    from weasyprint import HTML
+
+    with timed("pdf"), metrics.INVOICE_RENDER.time():
+        return HTML(string=html_content, base_url=base_url).write_pdf()
+
+
+def stored_invoice(order_id):
+    """The pre-rendered PDF bytes, or None."""
+    storage, name = invoice_storage(), invoice_name(order_id)
+    if not storage.exists(name):
+        return None
+    with storage.open(name, "rb") as fh:
+        return fh.read()
+
+
+def store_invoice(order_id, base_url):
+    order = Order.objects.select_related('user', 'address').filter(id=order_id).first()
+    if order is None:  # deleted before the worker got to it
+        return
+    pdf = render_invoice_pdf(order, base_url)
+    storage = invoice_storage()
+    path = storage.path(invoice_name(order_id))
+    # Written to a temporary file beside it and renamed over it, so a download
+    # never reads a half-written PDF and rendering again (a retry, a second
+    # worker) replaces the file rather than saving a renamed copy
+    os.makedirs(storage.location, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=storage.location, prefix=".invoice-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(pdf)
+        if storage.file_permissions_mode is not None:
+            os.chmod(temp_path, storage.file_permissions_mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
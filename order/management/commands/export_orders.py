@@ -0,0 +1,41 @@
+import sys
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from order.exports import CHUNK_SIZE, STREAMS
+from order.models import Order
+
+
+class Command(BaseCommand):
+    help = "Stream orders with their addresses and line items to CSV or XLSX, in constant memory."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=sorted(STREAMS), default="csv")
+        parser.add_argument("--output", "-o", help="File to write; stdout when omitted.")
+        parser.add_argument("--since", type=date.fromisoformat, help="Orders created on or after YYYY-MM-DD.")
+        parser.add_argument("--until", type=date.fromisoformat, help="Orders created on or before YYYY-MM-DD.")
+        parser.add_argument("--status", choices=[value for value, _ in Order.STATUS_CHOICES])
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        orders = Order.objects.all()
+        if options["since"]:
+            orders = orders.filter(created_at__date__gte=options["since"])
+        if options["until"]:
+            orders = orders.filter(created_at__date__lte=options["until"])
+        if options["status"]:
+            orders = orders.filter(status=options["status"])
+
+        pieces = STREAMS[options["format"]](orders, chunk_size=options["chunk_size"])
+        if options["output"]:
+            with open(options["output"], "wb") as fh:
+                for piece in pieces:
+                    fh.write(piece.encode("utf-8") if isinstance(piece, str) else piece)
+            self.stderr.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+        elif options["format"] == "xlsx":
+            for piece in pieces:
+                sys.stdout.buffer.write(piece)
+        else:
+            for piece in pieces:
+                self.stdout.write(piece, ending="")
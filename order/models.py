@@ -20,6 +20,15 @@ class Order(models.Model):
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     COD = models.BooleanField(default=True)
+    # The status the sales rollups currently count this order under ('' = not yet counted)
+    reported_status = models.CharField(max_length=20, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # OrderAdmin changelist: newest first, optionally filtered by status or date
+            models.Index(fields=['status', '-id'], name='order_status_id_idx'),
+            models.Index(fields=['created_at'], name='order_created_at_idx'),
+        ]
 
     def __str__(self):
         return f"Order #{self.id} by {self.user.email}"
@@ -34,4 +43,103 @@ class OrderItem(models.Model):
         return f"{self.quantity}x {self.product} in Order #{self.order.id}"
 
     def get_total_price(self):
-        return self.price * self.quantity
\ No newline at end of file
+        return self.price * self.quantity
+
+class OrderNotification(models.Model):
+    """
+    One customer email waiting to go out; queued and sent in batches by
+    ``order.notifications``. Several status rows for one order are
+    coalesced into a single email with the latest status.
+    """
+    CONFIRMATION = 'confirmation'
+    STATUS = 'status'
+    KIND_CHOICES = (
+        (CONFIRMATION, 'Order confirmation'),
+        (STATUS, 'Status update'),
+    )
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='notifications')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+    send_after = models.DateTimeField()
+    batch = models.CharField(max_length=32, blank=True)  # set while a sender has claimed the row
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # order.notifications.send_due scans the unsent rows by due time
+            models.Index(fields=['send_after'], condition=models.Q(sent_at__isnull=True), name='notification_unsent_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} for Order #{self.order_id} ({self.status})"
+
+
+# --- Sales rollups (order/reporting.py) ---
+# One row per day (and per variant / status) of orders *created* that day,
+# kept up to date as orders are placed and change status. Cancelled orders
+# are taken out of the revenue and unit figures.
+
+class DailySales(models.Model):
+    date = models.DateField(unique=True)
+    orders = models.IntegerField(default=0)  # not cancelled
+    cancelled = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    units = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Sales report"
+        verbose_name_plural = "Sales reports"
+        ordering = ['-date']
+
+    def __str__(self):
+        return f"Sales on {self.date}"
+
+    @property
+    def average_basket(self):
+        return self.revenue / self.orders if self.orders else 0
+
+
+class DailyVariantSales(models.Model):
+    date = models.DateField()
+    variant = models.ForeignKey("store.ProductVariant", on_delete=models.CASCADE, related_name="daily_sales")
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ('date', 'variant')
+
+    def __str__(self):
+        return f"{self.variant} on {self.date}"
+
+
+class DailyStatusCount(models.Model):
+    date = models.DateField()
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    orders = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('date', 'status')
+
+    def __str__(self):
+        return f"{self.orders} {self.status} on {self.date}"
+
+
+class CheckoutToken(models.Model):
+    """
+    A checkout modal submission claimed by ``order.idempotency``. The unique
+    (user, token) pair lets exactly one request per token place an order.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    token = models.CharField(max_length=64)
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, null=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'token'], name='checkout_token_once'),
+        ]
+
+    def __str__(self):
+        return f"Checkout {self.token} for order #{self.order_id}"
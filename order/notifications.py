@@ -0,0 +1,151 @@
+# order/notifications.py
+"""
+Customer emails about orders: a confirmation when ``confirm_order`` succeeds
+and an update when staff change ``Order.status``.
+
+Requests never talk to the mail server. ``order_placed`` / ``status_changed``
+insert an ``OrderNotification`` row in the caller's transaction and, once it
+commits, enqueue one ``send_order_notifications`` task per
+``ORDER_EMAIL_BATCH_WINDOW`` (the idempotency key is the window). That task
+claims every due row and sends the lot over a single SMTP connection.
+
+Status updates are throttled and coalesced: an order gets at most one status
+email per ``ORDER_STATUS_EMAIL_THROTTLE``, and all changes waiting for the
+same send become one email with the latest status (none at all if staff
+changed it back to what the customer was last told).
+
+Delivery is at least once: if the connection fails mid-batch the whole batch
+is released and the task retries it.
+"""
+import math
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db.models import Prefetch
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import OrderItem, OrderNotification
+
+BATCH_SIZE = 100
+
+
+def batch_window():
+    return getattr(settings, "ORDER_EMAIL_BATCH_WINDOW", 60)
+
+
+def status_throttle():
+    return timedelta(seconds=getattr(settings, "ORDER_STATUS_EMAIL_THROTTLE", 15 * 60))
+
+
+def order_placed(order):
+    _queue(order, OrderNotification.CONFIRMATION, _window_end(timezone.now()))
+
+
+def status_changed(order):
+    previous = OrderNotification.objects.filter(order=order, kind=OrderNotification.STATUS)
+    pending = previous.filter(sent_at__isnull=True, batch="", send_after__gt=timezone.now()).order_by("send_after").first()
+    if pending is not None:
+        # Join the update that is already waiting; the email will carry the latest status
+        send_after = pending.send_after
+    else:
+        last_sent = previous.filter(sent_at__isnull=False).order_by("-sent_at").values_list("sent_at", flat=True).first()
+        earliest = timezone.now() if last_sent is None else max(timezone.now(), last_sent + status_throttle())
+        send_after = _window_end(earliest)
+    _queue(order, OrderNotification.STATUS, send_after)
+
+
+def _window_end(when):
+    """
+    The end of the batch window ``when`` falls in, at least one window away,
+    so everything queued in the same window goes out in one send.
+    """
+    window = batch_window()
+    if not window:
+        return when
+    earliest = max(when, timezone.now() + timedelta(seconds=window))
+    return datetime.fromtimestamp(math.ceil(earliest.timestamp() / window) * window, tz=dt_timezone.utc)
+
+
+def _queue(order, kind, send_after):
+    from .tasks import send_order_notifications
+
+    OrderNotification.objects.create(order=order, kind=kind, status=order.status, send_after=send_after)
+    # One send per window; without a window every notification gets its own
+    key = f"order-notifications:{send_after.timestamp():.0f}" if batch_window() else None
+    send_order_notifications.enqueue(
+        delay=max(0.0, (send_after - timezone.now()).total_seconds()), idempotency_key=key
+    )
+
+
+def send_due(batch_size=BATCH_SIZE):
+    """Send every due notification, one SMTP connection per batch; returns emails sent."""
+    sent = 0
+    while True:
+        token = uuid.uuid4().hex
+        due = OrderNotification.objects.filter(sent_at__isnull=True, batch="", send_after__lte=timezone.now())
+        ids = list(due.order_by("send_after", "id").values_list("id", flat=True)[:batch_size])
+        if not ids:
+            return sent
+        # Conditional UPDATE: a row claimed by a concurrent sender is not claimed again
+        OrderNotification.objects.filter(id__in=ids, batch="").update(batch=token)
+        claimed = list(
+            OrderNotification.objects.filter(batch=token, sent_at__isnull=True)
+            .select_related("order__user", "order__address")
+            .prefetch_related(
+                Prefetch("order__items", queryset=OrderItem.objects.select_related("product__product", "product__subcategory"))
+            )
+            .order_by("id")
+        )
+        try:
+            messages = build_messages(claimed)
+            if messages:
+                with get_connection() as connection:
+                    connection.send_messages(messages)
+        except Exception:
+            OrderNotification.objects.filter(batch=token, sent_at__isnull=True).update(batch="")
+            raise
+        OrderNotification.objects.filter(batch=token).update(sent_at=timezone.now())
+        sent += len(messages)
+
+
+def build_messages(notifications):
+    """One email per order and kind; status rows collapse to the latest status."""
+    latest = {}
+    for notification in notifications:
+        latest[notification.order_id, notification.kind] = notification
+
+    statuses = [n for n in latest.values() if n.kind == OrderNotification.STATUS]
+    told = dict(
+        OrderNotification.objects.filter(
+            order_id__in=[n.order_id for n in statuses], kind=OrderNotification.STATUS, sent_at__isnull=False
+        )
+        .order_by("order_id", "sent_at", "id")
+        .values_list("order_id", "status")
+    )  # the last status each customer was told about (the newest row of a coalesced send)
+
+    messages = []
+    for notification in latest.values():
+        if notification.kind == OrderNotification.STATUS and told.get(notification.order_id) == notification.status:
+            continue
+        messages.append(render_message(notification))
+    return messages
+
+
+def render_message(notification):
+    order = notification.order
+    template = f"order/emails/{notification.kind}"
+    context = {
+        "order": order,
+        "status": dict(order.STATUS_CHOICES).get(notification.status, notification.status),
+        "shipping_address": getattr(order, "address", None),
+        "site_name": "Phoenix Mart",
+    }
+    subject = " ".join(render_to_string(f"{template}_subject.txt", context).split())
+    message = EmailMultiAlternatives(
+        subject, render_to_string(f"{template}.txt", context), settings.DEFAULT_FROM_EMAIL, [order.user.email]
+    )
+    message.attach_alternative(render_to_string(f"{template}.html", context), "text/html")
+    return message
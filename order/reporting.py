@@ -0,0 +1,140 @@
+# order/reporting.py
+"""
+Daily sales rollups: ``DailySales``, ``DailyVariantSales`` and
+``DailyStatusCount``. The admin sales dashboard reads only these tables,
+so it costs the same at a thousand orders as at millions.
+
+Rollups are kept up to date incrementally. ``confirm_order`` and
+``OrderAdmin`` enqueue ``order.tasks.sync_sales_rollup``, which moves one
+order's contribution from its ``reported_status`` (what the rollups count
+it as) to its current status with ``F()`` increments. That makes the task
+safe to run twice or out of order. ``manage.py rebuild_sales_rollups``
+recomputes the tables from ``Order``/``OrderItem`` after bulk edits,
+deletions or a schema change.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DailySales, DailyStatusCount, DailyVariantSales, Order, OrderItem
+
+CANCELLED = 'cancelled'
+LINE_REVENUE = ExpressionWrapper(F('price') * F('quantity'), output_field=DecimalField(max_digits=14, decimal_places=2))
+
+
+def _bump(model, keys, **deltas):
+    """Add ``deltas`` to the row identified by ``keys``, creating it if needed."""
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    increments = {field: F(field) + delta for field, delta in deltas.items()}
+    if model.objects.filter(**keys).update(**increments):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**keys, **deltas)
+    except IntegrityError:  # created concurrently
+        model.objects.filter(**keys).update(**increments)
+
+
+def sync_order(order_id):
+    """Bring the rollups in line with the order's current status."""
+    with transaction.atomic():
+        order = Order.objects.select_for_update().filter(pk=order_id).first()
+        if order is None or order.reported_status == order.status:
+            return
+        old, new = order.reported_status, order.status
+        day = timezone.localdate(order.created_at)
+
+        # +1 when the order starts counting towards sales, -1 when it stops
+        sign = (new != CANCELLED) - (old not in ('', CANCELLED))
+        units = 0
+        if sign:
+            lines = order.items.values('product_id').annotate(units=Sum('quantity'), revenue=Sum(LINE_REVENUE))
+            for line in lines:
+                units += line['units']
+                _bump(DailyVariantSales, {'date': day, 'variant_id': line['product_id']},
+                      units=sign * line['units'], revenue=sign * line['revenue'])
+        _bump(DailySales, {'date': day},
+              orders=sign, revenue=sign * order.total_price, units=sign * units,
+              cancelled=(new == CANCELLED) - (old == CANCELLED))
+
+        if old:
+            _bump(DailyStatusCount, {'date': day, 'status': old}, orders=-1)
+        _bump(DailyStatusCount, {'date': day, 'status': new}, orders=1)
+        Order.objects.filter(pk=order.pk).update(reported_status=new)
+
+
+def rebuild(since=None):
+    """
+    Recompute the rollups for orders created on or after ``since`` (a date;
+    everything when None) with a few grouped queries. Returns the days rebuilt.
+    """
+    orders = Order.objects.all()
+    items = OrderItem.objects.exclude(order__status=CANCELLED)
+    if since is not None:
+        orders = orders.filter(created_at__date__gte=since)
+        items = items.filter(order__created_at__date__gte=since)
+
+    daily = defaultdict(lambda: {'orders': 0, 'cancelled': 0, 'revenue': Decimal('0.00'), 'units': 0})
+    status_rows = []
+    per_status = orders.annotate(day=TruncDate('created_at')).values('day', 'status')
+    for row in per_status.annotate(n=Count('id'), revenue=Sum('total_price')).order_by():
+        status_rows.append(DailyStatusCount(date=row['day'], status=row['status'], orders=row['n']))
+        totals = daily[row['day']]
+        if row['status'] == CANCELLED:
+            totals['cancelled'] += row['n']
+        else:
+            totals['orders'] += row['n']
+            totals['revenue'] += row['revenue']
+
+    variant_rows = []
+    per_variant = items.annotate(day=TruncDate('order__created_at')).values('day', 'product_id')
+    for row in per_variant.annotate(units=Sum('quantity'), revenue=Sum(LINE_REVENUE)).order_by():
+        variant_rows.append(DailyVariantSales(
+            date=row['day'], variant_id=row['product_id'], units=row['units'], revenue=row['revenue']
+        ))
+        daily[row['day']]['units'] += row['units']
+
+    with transaction.atomic():
+        for model in (DailySales, DailyVariantSales, DailyStatusCount):
+            stale = model.objects.all() if since is None else model.objects.filter(date__gte=since)
+            stale.delete()
+        DailySales.objects.bulk_create(
+            [DailySales(date=day, **totals) for day, totals in daily.items()], batch_size=1000
+        )
+        DailyVariantSales.objects.bulk_create(variant_rows, batch_size=1000)
+        DailyStatusCount.objects.bulk_create(status_rows, batch_size=1000)
+        orders.exclude(reported_status=F('status')).update(reported_status=F('status'))
+    return len(daily)
+
+
+def dashboard(start, end, top=10):
+    """Totals, per-day rows, best-selling variants and status counts for ``start``..``end``."""
+    days = list(DailySales.objects.filter(date__range=(start, end)).order_by('date'))
+    totals = {field: sum(getattr(day, field) for day in days) for field in ('orders', 'cancelled', 'revenue', 'units')}
+    totals['average_basket'] = totals['revenue'] / totals['orders'] if totals['orders'] else 0
+    totals['units_per_order'] = totals['units'] / totals['orders'] if totals['orders'] else 0
+
+    top_variants = (
+        DailyVariantSales.objects.filter(date__range=(start, end))
+        .values('variant_id', 'variant__product__name', 'variant__subcategory__name')
+        .annotate(units=Sum('units'), revenue=Sum('revenue'))
+        .order_by('-units', '-revenue')[:top]
+    )
+    statuses = dict(
+        DailyStatusCount.objects.filter(date__range=(start, end))
+        .values_list('status')
+        .annotate(orders=Sum('orders'))
+        .order_by()
+    )
+    return {
+        'days': days,
+        'totals': totals,
+        'top_variants': list(top_variants),
+        'statuses': [(label, statuses.get(value, 0)) for value, label in Order.STATUS_CHOICES],
+    }
@@ -0,0 +1,25 @@
+from tasks.queue import task
+
+from .invoices import store_invoice
+
+
+@task(max_attempts=3, backoff=60)
+def render_invoice(order_id, base_url):
+    """Pre-render the invoice PDF so the download link doesn't wait for WeasyPrint."""
+    store_invoice(order_id, base_url)
+
+
+@task(max_attempts=8, backoff=60)
+def send_order_notifications():
+    """Send the batch of order emails that is due (see order.notifications)."""
+    from .notifications import send_due
+
+    send_due()
+
+
+@task(max_attempts=5, backoff=30)
+def sync_sales_rollup(order_id):
+    """Move the order's contribution to the daily sales rollups to its current status."""
+    from .reporting import sync_order
+
+    sync_order(order_id)
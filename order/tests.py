@@ -1,3 +1,467 @@
-from django.test import TestCase
+import csv
+import io
+import os
+import tempfile
+import threading
+import zipfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.files.base import ContentFile
+from django.db import OperationalError, connection
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from order import exports, idempotency, notifications, reporting
+from order.invoices import invoice_storage, store_invoice, stored_invoice
+from order.models import CheckoutToken, DailySales, DailyStatusCount, DailyVariantSales, Order, OrderNotification
+from perf.loadtest import ADDRESS
+from perf.query_budget import QueryBudgetMixin, seed_order, seed_storefront
+from store.models import ProductVariant
+from store.stock import take_stock
+from tasks.models import Task
+
+User = get_user_model()
+
+
+class OrderQueryBudgetTests(QueryBudgetMixin, TestCase):
+    def customer(self, size):
+        user = User.objects.create_user(f"orders-{size}@phoenix.test", "pw-12345!")
+        variants = seed_storefront(size, user=user)
+        self.client.force_login(user)
+        return user, variants
+
+    def test_confirm_order_buy_now(self):
+        def scenario(size):
+            _, variants = self.customer(size)
+            data = {**ADDRESS, "variant_id": variants[-1].id, "quantity": 1}
+            return lambda: self.client.post(reverse("order:confirm_order"), data)
+
+        self.assertQueriesConstant("order:confirm_order", scenario)
+
+    def test_confirm_order_cart(self):
+        def scenario(size):
+            self.customer(size)
+            return lambda: self.client.post(reverse("order:confirm_order"), ADDRESS)
+
+        # The whole checkout is a fixed number of statements, up to large carts
+        self.assertQueriesConstant("order:confirm_order", scenario, sizes=(1, 20, 200))
+
+    def test_take_stock_is_all_or_nothing(self):
+        _, variants = self.customer(1)
+        plenty, scarce = variants[0], variants[1]
+        ProductVariant.objects.filter(pk=scarce.pk).update(stock=2)
+
+        self.assertEqual(take_stock({plenty.pk: 1, scarce.pk: 5}), scarce.pk)
+        self.assertEqual(ProductVariant.objects.get(pk=plenty.pk).stock, 1000)
+
+        self.assertIsNone(take_stock({plenty.pk: 1, scarce.pk: 2}))
+        plenty.refresh_from_db()
+        scarce.refresh_from_db()
+        self.assertEqual((plenty.stock, plenty.in_stock), (999, True))
+        self.assertEqual((scarce.stock, scarce.in_stock), (0, False))
+
+    def test_order_success(self):
+        def scenario(size):
+            user, variants = self.customer(size)
+            order = seed_order(user, variants[:size])
+            return lambda: self.client.get(reverse("order:order_success", args=[order.id]))
+
+        self.assertQueriesConstant("order:order_success", scenario)
+
+    def test_generate_invoice(self):
+        def scenario(size):
+            user, variants = self.customer(size)
+            order = seed_order(user, variants[:size])
+            return lambda: self.client.get(reverse("order:generate_invoice", args=[order.id]))
+
+        self.assertQueriesConstant("order:generate_invoice", scenario)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class CheckoutIdempotencyTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("retry@phoenix.test", "pw-12345!")
+        self.variants = seed_storefront(2, user=self.user)
+        self.client.force_login(self.user)
+
+    def checkout_token(self):
+        response = self.client.get(reverse("cart:get_cart_summary"))
+        return response.json()["checkout_token"]
+
+    def test_repeat_submit_places_one_order(self):
+        data = {**ADDRESS, "checkout_token": self.checkout_token()}
+        with self.captureOnCommitCallbacks(execute=True):  # the outcome is cached once the order commits
+            first = self.client.post(reverse("order:confirm_order"), data)
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.post(reverse("order:confirm_order"), data)
+
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(ProductVariant.objects.get(pk=self.variants[0].pk).stock, 999)
+        self.assertEqual(second.url, first.url)
+        self.assertEqual(first.url, reverse("order:order_success", args=[Order.objects.get().id]))
+        writes = [q["sql"] for q in queries if not q["sql"].startswith("SELECT")]
+        self.assertEqual(writes, [])
+
+    def test_new_token_places_a_new_order(self):
+        for _ in range(2):
+            self.user.carts.get().items.get_or_create(product=self.variants[0])
+            self.client.post(reverse("order:confirm_order"), {**ADDRESS, "checkout_token": self.checkout_token()})
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_failed_submit_releases_the_token(self):
+        data = {**ADDRESS, "checkout_token": self.checkout_token()}
+        self.client.post(reverse("order:confirm_order"), {**data, "phone": "12"})
+        self.assertFalse(Order.objects.exists())
+
+        self.client.post(reverse("order:confirm_order"), data)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_claim_committed_by_another_worker_is_replayed_from_the_database(self):
+        token = self.checkout_token()
+        order = seed_order(self.user, self.variants[:1])
+        CheckoutToken.objects.create(user=self.user, token=token, order=order)
+
+        response = self.client.post(reverse("order:confirm_order"), {**ADDRESS, "checkout_token": token})
+
+        self.assertEqual(response.url, reverse("order:order_success", args=[order.id]))
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(cache.get(idempotency._key(self.user, token)), order.id)
+
+    def test_claim_the_database_cannot_take_yet_gets_409(self):
+        data = {**ADDRESS, "checkout_token": self.checkout_token()}
+        with mock.patch.object(CheckoutToken.objects, "create", side_effect=OperationalError("database is locked")):
+            response = self.client.post(reverse("order:confirm_order"), data)
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response["Retry-After"], str(idempotency.RETRY_AFTER))
+        self.assertFalse(Order.objects.exists())
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class ConcurrentCheckoutTests(TransactionTestCase):
+    def test_simultaneous_submits_of_one_token_place_one_order(self):
+        user = User.objects.create_user("double@phoenix.test", "pw-12345!")
+        seed_storefront(2, user=user)
+        clients = [Client() for _ in range(4)]
+        for client in clients:
+            client.force_login(user)
+        data = {**ADDRESS, "checkout_token": idempotency.issue_token()}
+        start = threading.Barrier(len(clients))
+        responses = []
+
+        def submit(client):
+            start.wait()
+            try:
+                responses.append(client.post(reverse("order:confirm_order"), data))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=submit, args=(client,)) for client in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        order = Order.objects.get()
+        success = reverse("order:order_success", args=[order.id])
+        for response in responses:
+            self.assertTrue(response.status_code == 409 or response.url == success, response)
+        self.assertEqual(Order.objects.count(), 1)
+
+
+class InvoiceTaskTests(TestCase):
+    def setUp(self):
+        invoice_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(invoice_dir.cleanup)
+        self.enterContext(override_settings(INVOICE_DIR=invoice_dir.name, TASKS_EAGER=True))
+        self.user = User.objects.create_user("invoices@phoenix.test", "pw-12345!")
+        self.variants = seed_storefront(1, user=self.user)
+        self.client.force_login(self.user)
+
+    def test_checkout_renders_invoice_in_background(self):
+        data = {**ADDRESS, "variant_id": self.variants[0].id, "quantity": 1}
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("order:confirm_order"), data)
+
+        order = Order.objects.get()
+        self.assertEqual(Task.objects.get(name="order.tasks.render_invoice").idempotency_key, f"invoice:{order.id}")
+        self.assertTrue(invoice_storage().exists(f"invoice_{order.id}.pdf"))
+
+    def test_download_serves_stored_pdf(self):
+        order = seed_order(self.user, self.variants[:1])
+        invoice_storage().save(f"invoice_{order.id}.pdf", ContentFile(b"%PDF stored"))
+
+        response = self.client.get(reverse("order:generate_invoice", args=[order.id]))
+
+        self.assertEqual(response.content, b"%PDF stored")
+
+    def test_rendering_again_replaces_the_stored_pdf(self):
+        order = seed_order(self.user, self.variants[:1])
+        invoice_storage().save(f"invoice_{order.id}.pdf", ContentFile(b"%PDF old"))
+
+        with mock.patch("order.invoices.render_invoice_pdf", return_value=b"%PDF new"):
+            store_invoice(order.id, "http://testserver/")
+        with mock.patch("order.invoices.render_invoice_pdf", return_value=b"%PDF newer"), \
+                mock.patch("order.invoices.os.replace", side_effect=OSError("disk full")), \
+                self.assertRaises(OSError):
+            store_invoice(order.id, "http://testserver/")
+
+        self.assertEqual(os.listdir(settings.INVOICE_DIR), [f"invoice_{order.id}.pdf"])
+        self.assertEqual(stored_invoice(order.id), b"%PDF new")
+
+
+class OrderNotificationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("notify@phoenix.test", "pw-12345!")
+        self.staff = User.objects.create_user("staff@phoenix.test", "pw-12345!", is_staff=True)
+        self.variants = seed_storefront(2, user=self.user)
+
+    def change_status(self, order, status):
+        request = RequestFactory().post("/admin/")
+        request.user = self.staff
+        order.status = status
+        admin.site._registry[Order].save_model(request, order, None, change=True)
+
+    def make_due(self):
+        OrderNotification.objects.update(send_after=timezone.now())
+
+    def test_checkout_queues_confirmation_email(self):
+        self.client.force_login(self.user)
+        data = {**ADDRESS, "variant_id": self.variants[0].id, "quantity": 1}
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("order:confirm_order"), data)
+
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(notifications.send_due(), 0)  # not due until the batch window closes
+        self.make_due()
+        self.assertEqual(notifications.send_due(), 1)
+
+        email = mail.outbox[0]
+        order = Order.objects.get()
+        self.assertEqual(email.to, ["notify@phoenix.test"])
+        self.assertEqual(email.subject, f"Phoenix Mart: order #{order.id} confirmed")
+        self.assertIn(self.variants[0].product.name, email.body)
+        self.assertEqual(email.alternatives[0][1], "text/html")
+
+    def test_batch_is_sent_over_one_connection(self):
+        for variant in self.variants[:3]:
+            notifications.order_placed(seed_order(self.user, [variant]))
+        self.make_due()
+
+        with mock.patch("order.notifications.get_connection", wraps=mail.get_connection) as get_connection:
+            self.assertEqual(notifications.send_due(), 3)
+
+        get_connection.assert_called_once()
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertFalse(OrderNotification.objects.filter(sent_at__isnull=True).exists())
+
+    def test_status_changes_are_coalesced(self):
+        order = seed_order(self.user, self.variants[:1])
+        for status in ("processing", "shipped", "delivered"):
+            self.change_status(order, status)
+
+        self.assertEqual(OrderNotification.objects.values("send_after").distinct().count(), 1)
+        self.make_due()
+        self.assertEqual(notifications.send_due(), 1)
+        self.assertEqual(mail.outbox[0].subject, f"Phoenix Mart: order #{order.id} is delivered")
+
+    def test_status_emails_are_throttled(self):
+        order = seed_order(self.user, self.variants[:1])
+        self.change_status(order, "processing")
+        self.make_due()
+        notifications.send_due()
+
+        self.change_status(order, "shipped")
+        pending = OrderNotification.objects.get(sent_at__isnull=True)
+        self.assertGreaterEqual(pending.send_after, timezone.now() + timedelta(minutes=14))
+
+    def test_reverting_to_the_last_emailed_status_sends_nothing(self):
+        order = seed_order(self.user, self.variants[:1])
+        self.change_status(order, "processing")
+        self.make_due()
+        notifications.send_due()
+
+        self.change_status(order, "shipped")
+        self.change_status(order, "processing")
+        self.make_due()
+        self.assertEqual(notifications.send_due(), 0)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_failed_send_releases_the_batch(self):
+        notifications.order_placed(seed_order(self.user, self.variants[:1]))
+        self.make_due()
+
+        with mock.patch("django.core.mail.backends.locmem.EmailBackend.send_messages", side_effect=OSError):
+            with self.assertRaises(OSError):
+                notifications.send_due()
+
+        self.assertEqual(OrderNotification.objects.get().batch, "")
+        self.assertEqual(notifications.send_due(), 1)
+
+
+@override_settings(TASKS_EAGER=True)
+class SalesRollupTests(TestCase):
+    def setUp(self):
+        invoice_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(invoice_dir.cleanup)
+        self.enterContext(override_settings(INVOICE_DIR=invoice_dir.name))
+        self.user = User.objects.create_user("rollups@phoenix.test", "pw-12345!")
+        self.staff = User.objects.create_superuser("boss@phoenix.test", "pw-12345!")
+        self.variants = seed_storefront(2, user=self.user)
+        self.client.force_login(self.user)
+
+    def buy(self, variant, quantity):
+        data = {**ADDRESS, "variant_id": variant.id, "quantity": quantity}
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("order:confirm_order"), data)
+        return Order.objects.latest("id")
+
+    def cancel(self, order):
+        request = RequestFactory().post("/admin/")
+        request.user = self.staff
+        order.status = "cancelled"
+        with self.captureOnCommitCallbacks(execute=True):
+            admin.site._registry[Order].save_model(request, order, None, change=True)
+
+    def snapshot(self):
+        return (
+            list(DailySales.objects.values_list("date", "orders", "cancelled", "revenue", "units").order_by("date")),
+            list(DailyVariantSales.objects.values_list("date", "variant", "units", "revenue").order_by("variant")),
+            list(DailyStatusCount.objects.filter(orders__gt=0).values_list("date", "status", "orders").order_by("status")),
+        )
+
+    def test_checkout_and_cancellation_update_rollups(self):
+        first, second = self.variants[:2]
+        self.buy(first, 2)
+        order = self.buy(second, 1)
+
+        day = DailySales.objects.get()
+        self.assertEqual((day.orders, day.units), (2, 3))
+        self.assertEqual(day.revenue, first.price * 2 + second.price)
+        self.assertEqual(DailyStatusCount.objects.get(status="pending").orders, 2)
+
+        self.cancel(order)
+        day.refresh_from_db()
+        self.assertEqual((day.orders, day.cancelled, day.units, day.revenue), (1, 1, 2, first.price * 2))
+        self.assertEqual(DailyVariantSales.objects.get(variant=second).units, 0)
+        self.assertEqual(DailyStatusCount.objects.get(status="pending").orders, 1)
+        self.assertEqual(DailyStatusCount.objects.get(status="cancelled").orders, 1)
+
+        reporting.sync_order(order.id)  # a repeated task changes nothing
+        self.assertEqual(DailySales.objects.get().orders, 1)
+
+    def test_rebuild_matches_incremental_rollups(self):
+        self.buy(self.variants[0], 2)
+        self.cancel(self.buy(self.variants[1], 1))
+        self.buy(self.variants[1], 3)
+        incremental = self.snapshot()
+
+        DailySales.objects.update(orders=99)
+        call_command("rebuild_sales_rollups", stdout=StringIO())
+
+        self.assertEqual(self.snapshot(), incremental)
+
+    def test_dashboard_reads_only_rollups(self):
+        self.buy(self.variants[0], 2)
+        self.client.force_login(self.staff)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("admin:order_dailysales_changelist"), {"days": 7})
+
+        self.assertContains(response, "Sales dashboard")
+        self.assertContains(response, self.variants[0].product.name)
+        tables = " ".join(query["sql"] for query in queries)
+        self.assertNotIn('"order_order"', tables)
+        self.assertNotIn('"order_orderitem"', tables)
+
+
+class OrderExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("exports@phoenix.test", "pw-12345!")
+        self.variants = seed_storefront(3, user=self.user)
+        self.orders = [seed_order(self.user, self.variants[:2])] + [
+            seed_order(self.user, [variant]) for variant in self.variants[:4]
+        ]
+
+    def test_csv_has_one_row_per_line_item(self):
+        data = list(csv.reader(io.StringIO("".join(exports.stream_csv(Order.objects.all())))))
+
+        self.assertEqual(tuple(data[0]), exports.COLUMNS)
+        self.assertEqual(len(data), 1 + 6)
+        first = dict(zip(data[0], data[1]))
+        self.assertEqual(first["order_id"], str(self.orders[0].id))
+        self.assertEqual(first["customer_email"], "exports@phoenix.test")
+        self.assertEqual(first["city"], "Grimsby")
+        self.assertEqual(first["product"], self.variants[0].product.name)
+
+    def test_queries_per_chunk_not_per_order(self):
+        with self.assertNumQueries(1 + 3):  # the orders, then one item prefetch per chunk of two
+            list(exports.stream_csv(Order.objects.all(), chunk_size=2))
+
+    def test_xlsx_is_a_valid_workbook(self):
+        data = b"".join(exports.stream_xlsx(Order.objects.all()))
+
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            self.assertIsNone(archive.testzip())
+            sheet = archive.read("xl/worksheets/sheet1.xml").decode()
+        self.assertEqual(sheet.count("<row>"), 1 + 6)
+        self.assertIn(self.variants[0].product.name, sheet)
+
+    def test_formulas_in_customer_text_are_quoted(self):
+        self.orders[0].address.full_name = '=HYPERLINK("http://evil.test","x")'
+        self.orders[0].address.street = "@SUM(1+1)"
+        self.orders[0].address.save()
+        queryset = Order.objects.filter(pk=self.orders[0].pk)
+
+        row = dict(zip(exports.COLUMNS, list(csv.reader(io.StringIO("".join(exports.stream_csv(queryset)))))[1]))
+        with zipfile.ZipFile(io.BytesIO(b"".join(exports.stream_xlsx(queryset)))) as archive:
+            sheet = archive.read("xl/worksheets/sheet1.xml").decode()
+
+        self.assertEqual(row["full_name"], "'=HYPERLINK(\"http://evil.test\",\"x\")")
+        self.assertEqual(row["street"], "'@SUM(1+1)")
+        self.assertEqual(row["phone"], self.orders[0].address.phone)
+        self.assertIn("<t xml:space=\"preserve\">'=HYPERLINK(", sheet)
+        self.assertIn("<t xml:space=\"preserve\">'@SUM(1+1)</t>", sheet)
+
+    def test_admin_action_streams_selected_orders(self):
+        self.client.force_login(User.objects.create_superuser("admin@phoenix.test", "pw-12345!"))
+
+        response = self.client.post(reverse("admin:order_order_changelist"), {
+            "action": "export_csv", "_selected_action": [self.orders[0].id, self.orders[1].id],
+        })
+
+        self.assertTrue(response.streaming)
+        self.assertIn('filename="orders-', response["Content-Disposition"])
+        body = b"".join(response.streaming_content).decode()
+        self.assertEqual(len(body.strip().splitlines()), 1 + 3)
+
+    async def test_admin_action_streams_asynchronously_under_asgi(self):
+        admin_user = await sync_to_async(User.objects.create_superuser)("admin@phoenix.test", "pw-12345!")
+        await self.async_client.aforce_login(admin_user)
+
+        response = await self.async_client.post(reverse("admin:order_order_changelist"), {
+            "action": "export_csv", "_selected_action": [self.orders[0].id],
+        })
+
+        self.assertTrue(response.is_async)  # a sync iterator would be buffered whole
+        body = b"".join([piece async for piece in response.streaming_content]).decode()
+        self.assertEqual(len(body.strip().splitlines()), 1 + 2)
+
+    def test_export_orders_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = f"{directory}/orders.xlsx"
+            call_command("export_orders", "--format", "xlsx", "--output", path, "--status", "pending", stderr=StringIO())
+            with zipfile.ZipFile(path) as archive:
+                self.assertEqual(archive.read("xl/worksheets/sheet1.xml").decode().count("<row>"), 1 + 6)
@@ -4,18 +4,31 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.db import transaction
 from django.contrib.auth.decorators import login_required
 from .models import Order, OrderItem
-from django.template.loader import render_to_string
-from weasyprint import HTML, CSS 
 from store.models import Product, ProductVariant, Address
-from cart.models import Cart, CartItem
+from store.stock import available_to, holder, take_stock
+from cart.models import CartItem
+from cart.storage import materialize_guest_cart
 from decimal import Decimal # Import Decimal for precision
+from perf import metrics
+from .idempotency import idempotent_checkout
+from .invoices import render_invoice_pdf, stored_invoice
+from .notifications import order_placed
+from .tasks import render_invoice, sync_sales_rollup
+
+
+def stock_error(request, variant, available, failure_redirect_url):
+    stock_error = f"Not enough stock for {variant.name or variant}. Available: {available}"
+    sweetify.error(request, 'Stock Error', text=stock_error, timer=5000)
+    metrics.STOCK_REJECTIONS.inc()
+    return redirect(failure_redirect_url)
 
 
 @login_required
+@idempotent_checkout
 @transaction.atomic
 def confirm_order(request):
     # Determine the redirect location on failure (likely the index page where the modal lives)
-    failure_redirect_url = request.META.get('HTTP_REFERER') or redirect("store:index")
+    failure_redirect_url = request.META.get('HTTP_REFERER') or "store:index"
 
     if request.method == 'POST':
         # --- 1. Extract POST Data and Validate ---
@@ -51,10 +64,15 @@ def confirm_order(request):
             return redirect(failure_redirect_url)
         
         # --- 2. Determine Items to Process (FIXED LOGIC) ---
-        
+        # Every step below runs a fixed number of statements however many
+        # lines there are: one SELECT for the lines (variant, product and
+        # subcategory joined), one UPDATE for the stock, and one INSERT or
+        # DELETE each for the order, its items, the address and the cart.
+
         buy_now_variant_id = request.POST.get('variant_id') 
         items_to_process = []
         is_buy_now = False
+        variants = ProductVariant.objects.select_related('product', 'subcategory')
 
         if buy_now_variant_id:
             # --- BUY NOW PATH ---
@@ -65,7 +83,7 @@ def confirm_order(request):
                 if quantity <= 0:
                     raise ValueError("Quantity must be positive.")
                     
-                variant = get_object_or_404(ProductVariant, id=buy_now_variant_id) 
+                variant = get_object_or_404(variants, id=buy_now_variant_id) 
                 
                 # Use 'variant' in the dictionary for consistency
                 items_to_process.append({'variant': variant, 'quantity': quantity,})
@@ -83,21 +101,22 @@ def confirm_order(request):
 
         else:
             # --- REGULAR CART CHECKOUT PATH ---
-            try:
-                cart = Cart.objects.get(user=request.user)
-                cart_items = CartItem.objects.filter(cart=cart).select_related('product')
-                
-                if not cart_items.exists():
-                    # THIS IS THE ERROR WE ARE TRYING TO BYPASS IF BUY NOW IS ACTIVE
-                    sweetify.error(request, 'Error', text='Your cart is empty.', timer=3000)
-                    return redirect("store:index")
-
-                for item in cart_items:
-                    # CartItem.product should link to the ProductVariant object
-                    items_to_process.append({'variant': item.product, 'quantity': item.quantity,}) 
-            except Cart.DoesNotExist:
-                 sweetify.error(request, 'Error', text='Cart not found.', timer=3000)
-                 return redirect("store:index")
+            if request.user.is_guest:
+                # Guest accounts may still hold a session cart (see cart.storage)
+                materialize_guest_cart(request, request.user)
+            cart_items = list(
+                CartItem.objects.filter(cart__user=request.user)
+                .select_related('product__product', 'product__subcategory')
+                .order_by('id')
+            )
+
+            if not cart_items:
+                sweetify.error(request, 'Error', text='Your cart is empty.', timer=3000)
+                return redirect("store:index")
+
+            for item in cart_items:
+                # CartItem.product should link to the ProductVariant object
+                items_to_process.append({'variant': item.product, 'quantity': item.quantity,}) 
         
         # FINAL CHECK: If no items, something went wrong.
         if not items_to_process:
@@ -115,11 +134,7 @@ def confirm_order(request):
 
             # Check stock on the VARIANT 
             if quantity > variant.stock: 
-                # Construct a descriptive error message
-                variant_name = getattr(variant, 'name', f"{variant.product.name} ({variant.subcategory.name})")
-                stock_error = f"Not enough stock for {variant_name}. Available: {variant.stock}"
-                sweetify.error(request, 'Stock Error', text=stock_error, timer=5000)
-                return redirect(failure_redirect_url) 
+                return stock_error(request, variant, variant.stock, failure_redirect_url)
             
             item_price = variant.price * quantity
             total_price += item_price
@@ -130,46 +145,59 @@ def confirm_order(request):
                 'price': variant.price,
             })
 
+        # Reduce stock on the VARIANTS in one statement; it only applies if every
+        # line still has enough, so a concurrent checkout can't oversell. A cart
+        # checkout uses up the stock its lines hold (store/stock.py)
+        stock_holder = None if is_buy_now else holder(request)
+        short = take_stock(
+            {item['variant'].id: item['quantity'] for item in order_items_to_create}, holder=stock_holder,
+        )
+        if short is not None:
+            variant = next(item['variant'] for item in order_items_to_create if item['variant'].id == short)
+            return stock_error(request, variant, available_to(stock_holder, variant.id), failure_redirect_url)
+
         # --- 4. Create Order Object and Save (retained logic) ---
         order = Order(user=request.user, total_price=total_price)
         order.save()
+        transaction.on_commit(lambda: metrics.ORDERS_CREATED.inc(path="buy_now" if is_buy_now else "cart"))
+        render_invoice.enqueue(
+            order_id=order.id, base_url=request.build_absolute_uri('/'), idempotency_key=f"invoice:{order.id}"
+        )
         
-        # --- 5-7. Create Items, Reduce Stock, Clear Cart/Session, Create Address ---
-        order_items = []
-        for item_data in order_items_to_create:
-            variant = item_data['variant']
-            quantity = item_data['quantity']
-            
-            order_items.append(OrderItem(
-                order=order, 
-                product=variant, # OrderItem.product links to the ProductVariant
-                quantity=quantity, 
-                price=item_data['price']
-            ))
-            
-            # Reduce stock on the VARIANT
-            variant.stock -= quantity
-            variant.save(update_fields=["stock"])
-
-        OrderItem.objects.bulk_create(order_items)
+        # --- 5-7. Create Items, Clear Cart/Session, Create Address ---
+        OrderItem.objects.bulk_create(
+            OrderItem(
+                order=order,
+                product=item_data['variant'],  # OrderItem.product links to the ProductVariant
+                quantity=item_data['quantity'],
+                price=item_data['price'],
+            )
+            for item_data in order_items_to_create
+        )
 
         # Clear the cart/session only if items were successfully processed
         if is_buy_now:
             # FIX: Clear the Buy Now session data now that the order is placed
             if 'buy_now_item' in request.session:
                 del request.session['buy_now_item']
-        elif 'cart' in locals():
-            # Clear the cart only if it was a standard cart purchase
-            cart.items.all().delete()
-
-        # Create or update the Address linked to the new Order (retained logic)
-        Address.objects.update_or_create(
-            order=order,
-            defaults={'full_name': full_name, 'phone': phone, 'street': street, 
-                      'city': city, 'state': state, 'zipcode': postcode, 'country': country}
+        else:
+            # Remove exactly the lines that were ordered
+            CartItem.objects.filter(pk__in=[item.pk for item in cart_items]).delete()
+
+        # The order is brand new, so its Address can only be created
+        Address.objects.create(
+            order=order, full_name=full_name, phone=phone, street=street,
+            city=city, state=state, zipcode=postcode, country=country,
         )
+
+        # Confirmation email: queued with the order, sent in the next batch by the task worker
+        order_placed(order)
+        # Daily sales rollups for the admin dashboard (order/reporting.py)
+        sync_sales_rollup.enqueue(order_id=order.id)
         
         # --- 8. Final Redirect: Success ---
+        # Read by idempotent_checkout, which answers replays of this token from it
+        request.checkout_order = order
         return redirect('order:order_success', order_id=order.id)
 
     # --- GET Request Logic ---
@@ -196,31 +224,19 @@ def order_success_page(request, order_id):
 
 @login_required
 def generate_invoice(request, order_id):
-    order = get_object_or_404(Order, id=order_id)
+    order = get_object_or_404(Order.objects.select_related('user', 'address'), id=order_id)
     
     # Security Check: Only allow the order owner (or staff/admin) to download the invoice
     if order.user != request.user and not request.user.is_staff:
         return HttpResponse("Unauthorized to view this invoice.", status=403)
 
-    # 1. Gather all data for the template
-    context = {
-        'order': order,
-        'order_items': order.items.all(),
-        'shipping_address': order.address,  # ✅ contains phone
-        'base_url': request.build_absolute_uri('/'),
-        'site_name': 'Phoenix Mart',
-    }
-
-    # 2. Render the invoice HTML template
-    html_content = render_to_string('order/invoice_template.html', context)
-    
-    # 3. Create a WeasyPrint HTML object
-    html = HTML(string=html_content, base_url=request.build_absolute_uri())
-
-    # 4. Generate the PDF
-    pdf_file = html.write_pdf()
+    # 1. Serve the PDF the background task rendered after checkout, if it's ready
+    pdf_file = stored_invoice(order.id)
+    if pdf_file is None:
+        # 2. Not rendered yet (or the worker is behind): render it inline
+        pdf_file = render_invoice_pdf(order, request.build_absolute_uri('/'))
 
-    # 5. Prepare the HTTP response for download
+    # 3. Prepare the HTTP response for download
     response = HttpResponse(pdf_file, content_type='application/pdf')
     filename = f"invoice_{order.id}.pdf"
     response['Content-Disposition'] = f'attachment; filename="{filename}"'
@@ -0,0 +1,128 @@
+# perf/bench.py
+"""
+Helpers shared by the ``bench_*`` management commands.
+
+Benchmarks never touch the configured database: ``scratch_database`` builds
+a throwaway test database (the same way ``manage.py test`` does) and drops
+it again afterwards.
+"""
+import statistics
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from store.models import Category, SubCategory, Product, ProductVariant
+
+
+@contextmanager
+def scratch_database(keepdb=False):
+    setup_test_environment()
+    old_name = connection.settings_dict["NAME"]
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=keepdb)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+        teardown_test_environment()
+
+
+def seed_catalog(categories=2, products=10, variants=2, stock=1000):
+    """
+    Bulk-create a synthetic catalog: ``products`` per category, ``variants``
+    per product (one per subcategory). Returns the created variants.
+    """
+    for c in range(categories):
+        category = Category.objects.create(name=f"Bench category {c}", slug=f"bench-category-{c}")
+        subcategories = SubCategory.objects.bulk_create(
+            SubCategory(category=category, name=f"Cut {s}", slug=f"cut-{s}") for s in range(variants)
+        )
+        product_rows = Product.objects.bulk_create(
+            Product(category=category, name=f"Bench product {c}-{p}") for p in range(products)
+        )
+        ProductVariant.objects.bulk_create(
+            ProductVariant(
+                product=product, subcategory=subcategory,
+                name=f"{product.name} - {subcategory.name}",
+                description="Synthetic benchmark variant " * 3,
+                price=Decimal("3.50") + s, stock=stock, in_stock=stock > 0,
+            )
+            for product in product_rows
+            for s, subcategory in enumerate(subcategories)
+        )
+    return list(ProductVariant.objects.select_related("product").order_by("id"))
+
+
+class count_queries:
+    """Context manager recording the SQL statements executed on ``connection``."""
+
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def touching(self, table):
+        return sum(1 for sql in self.statements if f'"{table}"' in sql)
+
+    def __call__(self, execute, sql, params, many, context):
+        self.statements.append(sql)
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._wrapper = connection.execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._wrapper.__exit__(*exc_info)
+
+
+def time_calls(func, repeat):
+    """Run ``func`` ``repeat`` times and return the wall-clock samples in seconds."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(samples):
+    """Millisecond summary of a list of second samples."""
+    return {
+        "n": len(samples),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3) if samples else 0.0,
+        "p50_ms": round(percentile(samples, 50) * 1000, 3),
+        "p95_ms": round(percentile(samples, 95) * 1000, 3),
+        "p99_ms": round(percentile(samples, 99) * 1000, 3),
+        "max_ms": round(max(samples) * 1000, 3) if samples else 0.0,
+    }
+
+
+def process_tree_rss(pid):
+    """Resident memory in bytes of ``pid`` and all its descendants (Linux ``/proc``)."""
+    total, pending = 0, [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as fh:
+                for line in fh:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+            with open(f"/proc/{current}/task/{current}/children") as fh:
+                pending.extend(int(child) for child in fh.read().split())
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+    return total
@@ -0,0 +1,175 @@
+# perf/instrumentation.py
+"""
+Per-request performance counters used by ``perf.middleware.PerformanceMiddleware``.
+
+The middleware installs the hooks below only when ``PERF_INSTRUMENTATION``
+is on. Code elsewhere may call ``timed()`` unconditionally: outside an
+instrumented request it costs one context-variable lookup.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_current = ContextVar("perf_request_stats", default=None)
+_query_listeners = ContextVar("perf_query_listeners", default=())
+_MISS = object()
+
+
+class RequestStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.timings = {}  # extra named spans, e.g. "pdf"
+        self._rendering = False
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def add_query(self, seconds):
+        self.db_time += seconds
+        self.queries += 1
+
+    def add_timing(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+
+def current_stats():
+    return _current.get()
+
+
+def start_request():
+    stats = RequestStats()
+    return stats, _current.set(stats)
+
+
+def end_request(token):
+    _current.reset(token)
+
+
+@contextmanager
+def listen_queries(listener):
+    """Call ``listener(seconds)`` for each query run in this context (see ``install_query_hook``)."""
+    token = _query_listeners.set((*_query_listeners.get(), listener))
+    try:
+        yield
+    finally:
+        _query_listeners.reset(token)
+
+
+@contextmanager
+def timed(name):
+    """Add the duration of the block to the current request's ``name`` span."""
+    stats = _current.get()
+    if stats is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.add_timing(name, time.perf_counter() - start)
+
+
+def record_cache(hits, misses=0):
+    stats = _current.get()
+    if stats is not None:
+        stats.cache_hits += hits
+        stats.cache_misses += misses
+
+
+def install_template_timer():
+    """Time top-level ``Template.render`` calls (includes render it triggers)."""
+    from django.template.base import Template
+
+    if getattr(Template.render, "perf_wrapped", False):
+        return
+    original = Template.render
+
+    def render(self, context):
+        stats = _current.get()
+        if stats is None or stats._rendering:
+            return original(self, context)
+        stats._rendering = True
+        start = time.perf_counter()
+        try:
+            return original(self, context)
+        finally:
+            stats.template_time += time.perf_counter() - start
+            stats._rendering = False
+
+    render.perf_wrapped = True
+    Template.render = render
+
+
+def install_cache_counters(cache_classes):
+    """Count hits and misses of ``get``/``get_many`` on the given backend classes."""
+    from django.core.cache.backends.base import BaseCache
+
+    for cache_class in cache_classes:
+        if getattr(cache_class.get, "perf_wrapped", False):
+            continue
+        original_get, original_get_many = cache_class.get, cache_class.get_many
+        # BaseCache.get_many loops over get(); only wrap real multi-key implementations
+        wrap_get_many = original_get_many is not BaseCache.get_many
+
+        def get(self, key, default=None, version=None, _original=original_get):
+            value = _original(self, key, _MISS, version=version)
+            if value is _MISS:
+                record_cache(0, 1)
+                return default
+            record_cache(1)
+            return value
+
+        def get_many(self, keys, version=None, _original=original_get_many):
+            keys = list(keys)
+            found = _original(self, keys, version=version)
+            record_cache(len(found), len(keys) - len(found))
+            return found
+
+        get.perf_wrapped = True
+        cache_class.get = get
+        if wrap_get_many:
+            cache_class.get_many = get_many
+
+
+
+def install_query_hook():
+    """
+    Pass every query, on every database alias, to the ``listen_queries``
+    listeners of the request it runs for.
+
+    An async view's ORM calls run on a ``sync_to_async`` thread with its own
+    connections, so a per-connection ``execute_wrapper`` set up by the
+    middleware would miss them. The cursor methods are wrapped instead, and
+    find the request through a context variable, which asgiref carries into
+    those threads.
+    """
+    from django.db.backends.utils import CursorWrapper
+
+    if getattr(CursorWrapper.execute, "perf_wrapped", False):
+        return
+
+    def wrap(original):
+        def method(self, sql, params=None):
+            listeners = _query_listeners.get()
+            if not listeners:
+                return original(self, sql, params)
+            start = time.perf_counter()
+            try:
+                return original(self, sql, params)
+            finally:
+                seconds = time.perf_counter() - start
+                for listener in listeners:
+                    listener(seconds)
+
+        method.perf_wrapped = True
+        return method
+
+    # CursorDebugWrapper (DEBUG, assertNumQueries) calls these through super()
+    CursorWrapper.execute = wrap(CursorWrapper.execute)
+    CursorWrapper.executemany = wrap(CursorWrapper.executemany)
@@ -0,0 +1,364 @@
+# perf/loadtest.py
+"""
+Synthetic storefront traffic for ``manage.py loadtest``.
+
+Virtual customers repeatedly pick an action from a weighted mix and drive
+the real URL routes, either in-process through the Django test client
+(which also records queries per request) or over HTTP against a running
+server (gunicorn, runserver). Results are plain dicts so they can be
+written as JSON and diffed between commits.
+
+An action may take several requests. ``tap_cart`` is a burst of +/- taps
+in the cart drawer sent as one ``update_cart_item`` request per tap, as
+the drawer used to do. ``batch_cart`` is the same burst debounced into a
+single ``cart:batch_update``, as it does now. ``--mix tap_cart=1`` against
+``--mix batch_cart=1`` compares the two. ``confirm_order`` checks out one
+variant (the buy-now path); ``checkout_cart`` fills the cart with several
+lines and checks it out, which takes the stock of every line in one go.
+Latency and queries are per action, summed over its requests.
+"""
+import random
+import re
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urljoin
+
+from django.conf import settings
+from django.test import Client
+from django.urls import reverse
+
+from perf.bench import count_queries, summarize
+
+DEFAULT_MIX = {
+    "index": 50,
+    "add_to_cart": 20,
+    "batch_cart": 10,
+    "buy_now": 10,
+    "confirm_order": 3,
+    "checkout_cart": 3,
+    "generate_invoice": 4,
+}
+
+ADDRESS = {
+    "full_name": "Load Test",
+    "phone": "07123456789",
+    "street": "1 Harbour Road",
+    "city": "Grimsby",
+    "state": "Lincolnshire",
+    "postcode": "DN31 3AA",
+    "country": "UK",
+}
+
+# Valid in --mix besides the default ones
+EXTRA_ACTIONS = ("update_cart_item", "tap_cart")
+MAX_TAPS = 6
+MAX_CHECKOUT_LINES = 4
+UVICORN_WORKER = "uvicorn.workers.UvicornWorker"
+
+ITEM_ID_RE = re.compile(r'data-item-id=\\?"(\d+)')  # the cart HTML arrives inside JSON, quotes escaped
+ORDER_ID_RE = re.compile(r"/order/success/(\d+)/")
+
+
+def parse_mix(text):
+    """``"index=50,add_to_cart=20"`` -> ``{"index": 50, "add_to_cart": 20}``."""
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in DEFAULT_MIX and name not in EXTRA_ACTIONS:
+            raise ValueError(f"Unknown action {name!r}; choose from {', '.join([*DEFAULT_MIX, *EXTRA_ACTIONS])}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class Result:
+    def __init__(self, status_code, text, location):
+        self.status_code = status_code
+        self.text = text
+        self.location = location or ""
+
+
+class ClientTransport:
+    """Drives the app in-process and counts the queries of every request."""
+
+    def __init__(self, user):
+        self.client = Client()
+        self.client.force_login(user)
+
+    def request(self, method, path, data=None, json_body=None):
+        kwargs = {"data": data or {}}
+        if json_body is not None:
+            kwargs = {"data": json_body, "content_type": "application/json"}
+        with count_queries() as queries:
+            response = getattr(self.client, method)(path, **kwargs)
+        content = b"" if response.streaming else response.content
+        text = content.decode("utf-8", "replace") if response.get("Content-Type", "").startswith(("text", "application/json")) else ""
+        return Result(response.status_code, text, response.get("Location")), queries.count
+
+
+class HttpTransport:
+    """Drives a running server over HTTP, logging in through ``users:handle_auth_modal``."""
+
+    def __init__(self, base_url, email, password):
+        import requests  # only needed for HTTP runs
+
+        self.base_url = base_url
+        self.session = requests.Session()
+        self.session.get(self._url(reverse("store:index")))
+        self.request("post", reverse("users:handle_auth_modal"),
+                     {"action": "login", "username": email, "password": password})
+
+    def _url(self, path):
+        return urljoin(self.base_url, path)
+
+    def request(self, method, path, data=None, json_body=None):
+        headers = {"X-CSRFToken": self.session.cookies.get("csrftoken", ""), "Referer": self.base_url}
+        response = self.session.request(
+            method.upper(), self._url(path), data=data, json=json_body,
+            headers=headers, allow_redirects=False, timeout=60,
+        )
+        text = response.text if not response.headers.get("Content-Type", "").startswith("application/pdf") else ""
+        return Result(response.status_code, text, response.headers.get("Location")), None
+
+
+class VirtualCustomer:
+    def __init__(self, transport, variants, rng):
+        self.transport = transport
+        self.variants = variants  # [(variant_id, product_id), ...]
+        self.rng = rng
+        self.item_ids = []
+        self.order_ids = []
+        self.sent = 0
+
+    def run(self, action):
+        """Perform ``action``; returns ``(action, ok, seconds, queries, requests)``."""
+        if action in ("update_cart_item", "tap_cart", "batch_cart") and not self.item_ids:
+            action = "add_to_cart"
+        if action == "generate_invoice" and not self.order_ids:
+            action = "confirm_order"
+
+        sent = self.sent
+        start = time.perf_counter()
+        result, queries = getattr(self, action)()
+        elapsed = time.perf_counter() - start
+        return action, self._ok(action, result), elapsed, queries, self.sent - sent
+
+    def _request(self, method, path, data=None, json_body=None):
+        self.sent += 1
+        return self.transport.request(method, path, data, json_body)
+
+    def _ok(self, action, result):
+        if action in ("confirm_order", "checkout_cart"):
+            return bool(ORDER_ID_RE.search(result.location))
+        if result.status_code >= 400:
+            return False
+        return '"success": false' not in result.text
+
+    def _variant(self):
+        return self.rng.choice(self.variants)
+
+    def index(self):
+        return self._request("get", reverse("store:index"))
+
+    def add_to_cart(self):
+        variant_id, product_id = self._variant()
+        result, queries = self._request(
+            "post", reverse("cart:add_to_cart", args=[product_id]), {"variant_id": variant_id, "quantity": 1}
+        )
+        self.item_ids = ITEM_ID_RE.findall(result.text) or self.item_ids
+        return result, queries
+
+    def update_cart_item(self):
+        item_id = self.rng.choice(self.item_ids)
+        result, queries = self._request(
+            "post", reverse("cart:update_cart_item", args=[item_id]),
+            json_body={"quantity": self.rng.randint(1, 3)},
+        )
+        self.item_ids = ITEM_ID_RE.findall(result.text) or self.item_ids
+        return result, queries
+
+    def _burst(self):
+        """A cart line and the quantities one +/- tap after another takes it through."""
+        quantity = self.rng.randint(1, 3)
+        steps = []
+        for _ in range(self.rng.randint(2, MAX_TAPS)):
+            quantity = max(1, quantity + self.rng.choice((-1, 1)))
+            steps.append(quantity)
+        return self.rng.choice(self.item_ids), steps
+
+    def tap_cart(self):
+        item_id, steps = self._burst()
+        total = 0
+        for quantity in steps:
+            result, queries = self._request(
+                "post", reverse("cart:update_cart_item", args=[item_id]), json_body={"quantity": quantity}
+            )
+            total = None if queries is None else total + queries
+        self.item_ids = ITEM_ID_RE.findall(result.text) or self.item_ids
+        return result, total
+
+    def batch_cart(self):
+        item_id, steps = self._burst()
+        result, queries = self._request(
+            "post", reverse("cart:batch_update"),
+            json_body={"operations": [{"op": "update", "item_id": item_id, "quantity": steps[-1]}]},
+        )
+        self.item_ids = ITEM_ID_RE.findall(result.text) or self.item_ids
+        return result, queries
+
+    def buy_now(self):
+        variant_id, product_id = self._variant()
+        return self._request(
+            "post", reverse("store:buy_now", args=[product_id]), {"variant_id": variant_id, "quantity": 1}
+        )
+
+    def confirm_order(self):
+        variant_id, _ = self._variant()
+        result, queries = self._request(
+            "post", reverse("order:confirm_order"), {**ADDRESS, "variant_id": variant_id, "quantity": 1}
+        )
+        match = ORDER_ID_RE.search(result.location)
+        if match:
+            self.order_ids.append(int(match.group(1)))
+        return result, queries
+
+    def checkout_cart(self):
+        total = 0
+        for variant_id, product_id in self.rng.sample(self.variants, min(len(self.variants), MAX_CHECKOUT_LINES)):
+            _, queries = self._request(
+                "post", reverse("cart:add_to_cart", args=[product_id]), {"variant_id": variant_id, "quantity": 1}
+            )
+            total = None if queries is None else total + queries
+        result, queries = self._request("post", reverse("order:confirm_order"), ADDRESS)
+        match = ORDER_ID_RE.search(result.location)
+        if match:
+            self.order_ids.append(int(match.group(1)))
+            self.item_ids = []  # the cart was emptied
+        return result, None if queries is None else total + queries
+
+    def generate_invoice(self):
+        return self._request(
+            "get", reverse("order:generate_invoice", args=[self.rng.choice(self.order_ids)])
+        )
+
+
+def _drive(customer, count, actions, weights):
+    return [customer.run(customer.rng.choices(actions, weights)[0]) for _ in range(count)]
+
+
+def run_load(transports, variants, mix, requests, warmup=0, seed=0, concurrent=False):
+    """
+    Split ``requests`` weighted actions over ``transports`` (one per virtual
+    customer) and return per-endpoint statistics. With ``concurrent`` every
+    customer runs in its own thread (HTTP targets only).
+    """
+    rng = random.Random(seed)
+    customers = [VirtualCustomer(t, variants, random.Random(rng.random())) for t in transports]
+    actions, weights = zip(*mix.items())
+    shares = [requests // len(customers) + (i < requests % len(customers)) for i in range(len(customers))]
+
+    for customer in customers:
+        _drive(customer, warmup, actions, weights)
+
+    started = time.perf_counter()
+    if concurrent:
+        with ThreadPoolExecutor(max_workers=len(customers)) as pool:
+            runs = list(pool.map(_drive, customers, shares, [actions] * len(customers), [weights] * len(customers)))
+    else:
+        runs = [_drive(customer, share, actions, weights) for customer, share in zip(customers, shares)]
+    wall = time.perf_counter() - started
+
+    samples = {}
+    for action, ok, elapsed, queries, sent in (row for run in runs for row in run):
+        bucket = samples.setdefault(action, {"latencies": [], "queries": [], "requests": 0, "errors": 0})
+        bucket["latencies"].append(elapsed)
+        bucket["requests"] += sent
+        if queries is not None:
+            bucket["queries"].append(queries)
+        if not ok:
+            bucket["errors"] += 1
+
+    return {
+        "elapsed_s": round(wall, 3),
+        "throughput_rps": round(requests / wall, 2) if wall else 0.0,
+        "overall": summarize([elapsed for bucket in samples.values() for elapsed in bucket["latencies"]]),
+        "endpoints": {action: _endpoint_summary(bucket, wall) for action, bucket in sorted(samples.items())},
+    }
+
+
+def _endpoint_summary(bucket, wall):
+    summary = summarize(bucket["latencies"])
+    summary["errors"] = bucket["errors"]
+    summary["requests_per_action"] = round(bucket["requests"] / summary["n"], 2) if summary["n"] else 0.0
+    summary["rps"] = round(summary["n"] / wall, 2) if wall else 0.0
+    if bucket["queries"]:
+        summary["queries_per_request"] = round(sum(bucket["queries"]) / len(bucket["queries"]), 2)
+        summary["max_queries"] = max(bucket["queries"])
+    return summary
+
+
+class ServerNotReady(Exception):
+    pass
+
+
+@contextmanager
+def gunicorn_server(app=None, workers=2, extra_args=(), timeout=30, worker_class=UVICORN_WORKER):
+    """
+    Start a local gunicorn on a free port; yields ``(base_url, process)``.
+    By default it serves the ASGI app with uvicorn workers, as docker-compose
+    does; with any other worker class the default app is the WSGI one.
+    """
+    if app is None:
+        app = "phoenix_mart.asgi:application" if worker_class == UVICORN_WORKER else "phoenix_mart.wsgi:application"
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    command = [
+        sys.executable, "-m", "gunicorn", app,
+        "--bind", f"127.0.0.1:{port}", "--workers", str(workers), "--worker-class", worker_class, *extra_args,
+    ]
+    process = subprocess.Popen(command)
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            if process.poll() is not None:
+                raise ServerNotReady("gunicorn exited before accepting connections.")
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise ServerNotReady("Timed out waiting for gunicorn.")
+                time.sleep(0.2)
+        yield f"http://127.0.0.1:{port}/", process
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous, current):
+    """Rows of ``(endpoint, metric, before, after, change%)`` for p50/p95/p99 and queries."""
+    rows = []
+    for endpoint, after in current["endpoints"].items():
+        before = previous.get("endpoints", {}).get(endpoint)
+        if not before:
+            continue
+        for metric in ("p50_ms", "p95_ms", "p99_ms", "queries_per_request", "requests_per_action"):
+            if metric in before and metric in after:
+                change = (after[metric] - before[metric]) / before[metric] * 100 if before[metric] else 0.0
+                rows.append((endpoint, metric, before[metric], after[metric], round(change, 1)))
+    return rows
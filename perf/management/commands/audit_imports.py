@@ -0,0 +1,81 @@
+import json
+import subprocess
+import sys
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# What a gunicorn worker imports before its first request: settings, apps,
+# the middleware chain (built by the handler) and every view via the URLconf.
+BOOT = (
+    "import {app}, django.urls; "
+    "django.urls.get_resolver().url_patterns"
+)
+APPS = {"wsgi": "phoenix_mart.wsgi", "asgi": "phoenix_mart.asgi"}
+# Loaded on first use (order/invoices.py, perf/profiler.py); none should appear at boot
+LAZY_MODULES = ("weasyprint", "cProfile", "pstats")
+
+
+def parse_importtime(stderr):
+    """``(module, self_us, cumulative_us)`` for each line of ``python -X importtime`` output."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        if not self_us.strip().isdigit():  # the header line
+            continue
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+class Command(BaseCommand):
+    help = "List the slowest imports of a worker booting the site (python -X importtime)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--app", choices=APPS, default="wsgi")
+        parser.add_argument("--limit", type=int, default=20, help="Modules to list.")
+        parser.add_argument("--json", action="store_true", help="Print machine-readable results.")
+
+    def handle(self, *args, **options):
+        process = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", BOOT.format(app=APPS[options["app"]])],
+            cwd=settings.BASE_DIR, capture_output=True, text=True,
+        )
+        if process.returncode:
+            raise CommandError(f"Booting {APPS[options['app']]} failed:\n{process.stderr[-2000:]}")
+        rows = parse_importtime(process.stderr)
+        modules = {name for name, _, _ in rows}
+        packages = Counter()
+        for name, self_us, _ in rows:
+            packages[name.split(".")[0]] += self_us
+        limit = options["limit"]
+        results = {
+            "app": APPS[options["app"]],
+            "modules": len(rows),
+            "total_ms": round(sum(self_us for _, self_us, _ in rows) / 1000, 1),
+            "slowest": [
+                {"module": name, "self_ms": round(self_us / 1000, 2), "cumulative_ms": round(cumulative / 1000, 2)}
+                for name, self_us, cumulative in sorted(rows, key=lambda row: row[2], reverse=True)[:limit]
+            ],
+            "packages": [
+                {"package": name, "self_ms": round(self_us / 1000, 2)} for name, self_us in packages.most_common(limit)
+            ],
+            "lazy_loaded_at_boot": [name for name in LAZY_MODULES if name in modules],
+        }
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"{results['app']}: {results['modules']} modules, {results['total_ms']} ms importing")
+        self.stdout.write(f"\n{'module (by cumulative time)':<52}{'self ms':>9}{'cum ms':>9}")
+        for row in results["slowest"]:
+            self.stdout.write(f"{row['module']:<52}{row['self_ms']:>9}{row['cumulative_ms']:>9}")
+        self.stdout.write(f"\n{'top-level package':<52}{'self ms':>9}")
+        for row in results["packages"]:
+            self.stdout.write(f"{row['package']:<52}{row['self_ms']:>9}")
+        if results["lazy_loaded_at_boot"]:
+            self.stdout.write(self.style.WARNING(
+                f"\nImported at boot but meant to load on first use: {', '.join(results['lazy_loaded_at_boot'])}"
+            ))
@@ -0,0 +1,51 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from cart.models import Cart, CartItem
+from perf.bench import count_queries, scratch_database, seed_catalog, summarize
+
+
+class Command(BaseCommand):
+    help = "Time Cart.merge_with for a large guest cart in a scratch database."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--items", type=int, default=200, help="Lines in the guest cart.")
+        parser.add_argument("--overlap", type=float, default=0.5,
+                            help="Fraction of guest lines already in the user's cart.")
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def handle(self, *args, **options):
+        items, repeat = options["items"], options["repeat"]
+        overlap = int(items * options["overlap"])
+
+        with scratch_database():
+            variants = seed_catalog(categories=1, products=items, variants=1)
+            user = get_user_model().objects.create_user("bench@phoenix.test", "bench-password")
+            samples, query_counts = [], []
+
+            for _ in range(repeat):
+                Cart.objects.all().delete()
+                user_cart = Cart.objects.create(user=user)
+                guest_cart = Cart.objects.create(session_key="bench", is_guest=True)
+                CartItem.objects.bulk_create(
+                    CartItem(cart=user_cart, product=variant, quantity=1) for variant in variants[:overlap]
+                )
+                CartItem.objects.bulk_create(
+                    CartItem(cart=guest_cart, product=variant, quantity=2) for variant in variants
+                )
+
+                with count_queries() as queries:
+                    start = time.perf_counter()
+                    user_cart.merge_with(guest_cart)
+                    samples.append(time.perf_counter() - start)
+                query_counts.append(queries.count)
+
+                assert user_cart.items.count() == items
+
+        stats = summarize(samples)
+        self.stdout.write(
+            f"merge {items} items ({overlap} overlapping) x{repeat}: "
+            f"{max(query_counts)} queries, p50 {stats['p50_ms']} ms, p95 {stats['p95_ms']} ms"
+        )
@@ -0,0 +1,44 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from cart.models import Cart, CartItem
+from perf.bench import count_queries, scratch_database, seed_catalog, summarize, time_calls
+from perf.loadtest import ADDRESS
+
+
+class Command(BaseCommand):
+    help = "Time order:confirm_order for carts of several sizes in a scratch database."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lines", type=int, nargs="+", default=[1, 20, 200], help="Cart sizes to check out.")
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def handle(self, *args, **options):
+        with scratch_database(), override_settings(ALLOWED_HOSTS=["*"]):
+            variants = seed_catalog(categories=1, products=max(options["lines"]), variants=1, stock=10**6)
+            user = get_user_model().objects.create_user("bench@phoenix.test", "bench-password")
+            cart = Cart.objects.create(user=user)
+            client = Client()
+            client.force_login(user)
+
+            for lines in options["lines"]:
+                samples, query_counts = [], []
+                for _ in range(options["repeat"]):
+                    CartItem.objects.bulk_create(CartItem(cart=cart, product=variant, quantity=1) for variant in variants[:lines])
+                    with count_queries() as queries:
+                        start = time.perf_counter()
+                        response = client.post(reverse("order:confirm_order"), ADDRESS)
+                        samples.append(time.perf_counter() - start)
+                    assert response.status_code == 302 and "success" in response.url, response
+                    query_counts.append(queries.count)
+
+                stats = summarize(samples)
+                self.stdout.write(
+                    f"checkout {lines:4} lines x{options['repeat']}: {max(query_counts)} queries, "
+                    f"p50 {stats['p50_ms']} ms, p95 {stats['p95_ms']} ms"
+                )
@@ -0,0 +1,60 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from perf.bench import scratch_database, seed_catalog
+
+LOCMEM_CACHE = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+ENCODINGS = {"identity": "identity", "gzip": "gzip", "br": "br, gzip"}
+
+
+class Command(BaseCommand):
+    help = "Bytes on the wire per endpoint uncompressed, gzipped and brotli-compressed (phoenix_mart/middleware.py)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=10, help="Products per category in the scratch catalog.")
+        parser.add_argument("--cart-lines", type=int, default=5)
+        parser.add_argument("--json", action="store_true", help="Print machine-readable results.")
+
+    def handle(self, *args, **options):
+        results = {}
+        with scratch_database(), override_settings(CACHES=LOCMEM_CACHE):
+            variants = seed_catalog(categories=2, products=options["products"], variants=2)
+            variant = variants[0]
+            anonymous = Client()
+            customer = Client()
+            customer.force_login(get_user_model().objects.create_user("wire@phoenix.test", "bench-password"))
+            for line in variants[1:options["cart_lines"]]:
+                customer.post(reverse("cart:add_to_cart", args=[line.product_id]), {"variant_id": line.id})
+
+            add = ("post", reverse("cart:add_to_cart", args=[variant.product_id]), {"variant_id": variant.id})
+            endpoints = {
+                "store:index (anonymous)": (anonymous, "get", reverse("store:index"), {}),
+                "store:index (customer)": (customer, "get", reverse("store:index"), {}),
+                "cart:add_to_cart": (customer, *add),
+                "cart:get_cart_summary": (customer, "get", reverse("cart:get_cart_summary"), {}),
+                "cart:cart_state": (customer, "get", reverse("cart:cart_state"), {}),
+                "store:buy_now": (customer, "post", reverse("store:buy_now", args=[variant.product_id]),
+                                  {"variant_id": variant.id, "quantity": 1}),
+            }
+            for name, (client, method, url, data) in endpoints.items():
+                row = {}
+                for label, accept in ENCODINGS.items():
+                    response = getattr(client, method)(url, data, headers={"accept-encoding": accept})
+                    row[label] = len(response.content)
+                    row[f"{label}_encoding"] = response.get("Content-Encoding", "identity")
+                row["saved_pct"] = round(100 * (1 - min(row["gzip"], row["br"]) / row["identity"]), 1)
+                results[name] = row
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"{'endpoint':<26}{'identity':>9}{'gzip':>8}{'br':>8}  {'sent as':<8}{'saved':>7}")
+        for name, row in results.items():
+            self.stdout.write(
+                f"{name:<26}{row['identity']:>9}{row['gzip']:>8}{row['br']:>8}  "
+                f"{row['br_encoding']:<8}{row['saved_pct']:>6}%"
+            )
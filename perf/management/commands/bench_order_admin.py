@@ -0,0 +1,94 @@
+import time
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib import admin
+from django.contrib.admin.views.main import SEARCH_VAR
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.core.paginator import Paginator
+from django.test import Client
+from django.urls import reverse
+
+from order.models import Order
+from perf.bench import count_queries, scratch_database, seed_catalog, summarize
+from store.models import Address
+
+# What OrderAdmin looked like before the changelist work, for comparison
+NAIVE = {
+    "list_select_related": False,
+    "show_full_result_count": True,
+    "paginator": Paginator,
+    "ordering": None,
+    "sortable_by": None,
+}
+
+
+class Command(BaseCommand):
+    help = "Time the OrderAdmin changelist over a large scratch order table."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--orders", type=int, default=100_000)
+        parser.add_argument("--customers", type=int, default=5_000)
+        parser.add_argument("--repeat", type=int, default=10)
+        parser.add_argument("--naive", action="store_true",
+                            help="Also time the changelist with the old OrderAdmin options.")
+
+    def seed(self, orders, customers):
+        User = get_user_model()
+        users = User.objects.bulk_create(
+            User(email=f"customer{n}@phoenix.test", password="!") for n in range(customers)
+        )
+        variant = seed_catalog(categories=1, products=1, variants=1)[0]
+        statuses = [value for value, _ in Order.STATUS_CHOICES]
+        for start in range(0, orders, 5000):
+            batch = Order.objects.bulk_create(
+                Order(user=users[n % customers], total_price=Decimal("9.00"), status=statuses[n % len(statuses)])
+                for n in range(start, min(start + 5000, orders))
+            )
+            Address.objects.bulk_create(
+                Address(order=order, full_name="Bench", phone="07123456789", street="1 Harbour Road",
+                        city="Grimsby", state="", zipcode="DN31 3AA", country="UK")
+                for order in batch
+            )
+        return variant
+
+    def measure(self, client, label, params, repeat):
+        url = reverse("admin:order_order_changelist")
+        samples = []
+        for _ in range(repeat):
+            with count_queries() as queries:
+                start = time.perf_counter()
+                response = client.get(url, params)
+                samples.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.status_code
+        stats = summarize(samples)
+        self.stdout.write(
+            f"  {label:<22} {queries.count:>3} queries  p50 {stats['p50_ms']:>8} ms  p95 {stats['p95_ms']:>8} ms"
+        )
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            start = time.perf_counter()
+            self.seed(options["orders"], options["customers"])
+            self.stdout.write(f"Seeded {options['orders']} orders in {time.perf_counter() - start:.1f}s")
+
+            client = Client()
+            client.force_login(get_user_model().objects.create_superuser("bench-admin@phoenix.test", "bench-password"))
+            scenarios = [
+                ("first page", {}),
+                ("page 50", {"p": 49}),
+                ("status filter", {"status__exact": "shipped"}),
+                ("search email", {SEARCH_VAR: "customer42@phoenix.test"}),
+                ("search order number", {SEARCH_VAR: "#4242"}),
+            ]
+
+            model_admin = admin.site._registry[Order]
+            configurations = [("current", {})]
+            if options["naive"]:
+                configurations.append(("naive", {**NAIVE, "get_search_results": admin.ModelAdmin.get_search_results.__get__(model_admin)}))
+            for label, overrides in configurations:
+                self.stdout.write(f"{label} OrderAdmin:")
+                with mock.patch.multiple(model_admin, **overrides) if overrides else mock.patch.dict({}):
+                    for name, params in scenarios:
+                        self.measure(client, name, params, options["repeat"])
@@ -0,0 +1,67 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from perf.bench import count_queries, scratch_database, seed_catalog, summarize
+
+LOCMEM_CACHE = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "OPTIONS": {"MAX_ENTRIES": 20000}},
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Requests per second for the anonymous storefront with no caching, with cached product "
+        "cards (store/fragments.py) and with the full-page cache (store/pagecache.py)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=40, help="Products in the scratch catalog.")
+        parser.add_argument("--requests", type=int, default=200, help="Anonymous index requests per mode.")
+        parser.add_argument("--json", action="store_true", help="Print machine-readable results.")
+
+    def handle(self, *args, **options):
+        url = reverse("store:index")
+        modes = {
+            "uncached": {"PAGE_CACHE_TTL": 0, "FRAGMENT_CACHE_TTL": 0},
+            "cards": {"PAGE_CACHE_TTL": 0},  # what logged-in visitors get
+            "cached": {"PAGE_CACHE_TTL": 300},
+        }
+        results = {}
+        with scratch_database():
+            seed_catalog(categories=4, products=options["products"], variants=2)
+            for mode, overrides in modes.items():
+                with override_settings(CACHES=LOCMEM_CACHE, **overrides):
+                    client = Client()
+                    client.get(url)  # warm up (and fill the cache)
+                    samples, query_counts = [], []
+                    started = time.perf_counter()
+                    for _ in range(options["requests"]):
+                        with count_queries() as queries:
+                            start = time.perf_counter()
+                            response = client.get(url)
+                            samples.append(time.perf_counter() - start)
+                        assert response.status_code == 200
+                        query_counts.append(queries.count)
+                    elapsed = time.perf_counter() - started
+                results[mode] = {
+                    **summarize(samples),
+                    "requests_per_second": round(options["requests"] / elapsed, 1),
+                    "queries_per_request": round(sum(query_counts) / len(query_counts), 2),
+                    "bytes": len(response.content),
+                }
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"{'mode':<10}{'req/s':>9}{'q/req':>7}{'p50 ms':>9}{'p95 ms':>9}")
+        for mode, row in results.items():
+            self.stdout.write(
+                f"{mode:<10}{row['requests_per_second']:>9}{row['queries_per_request']:>7}"
+                f"{row['p50_ms']:>9}{row['p95_ms']:>9}"
+            )
+        speedup = results["cached"]["requests_per_second"] / results["uncached"]["requests_per_second"]
+        self.stdout.write(f"cached serves {speedup:.1f}x the requests per second")
@@ -0,0 +1,57 @@
+import gzip
+import json
+
+from django.contrib.auth import get_user_model
+from django.contrib.staticfiles import finders
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from perf.bench import scratch_database, seed_catalog
+from phoenix_mart.staticfiles import minify
+
+try:
+    import brotli
+except ImportError:  # optional: only gzip sizes are reported without it
+    brotli = None
+
+LOCMEM_CACHE = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+BUNDLES = ("storefront/storefront.css", "storefront/storefront.js")
+
+
+def sizes(content):
+    row = {"bytes": len(content), "gzip": len(gzip.compress(content, 9))}
+    if brotli is not None:
+        row["brotli"] = len(brotli.compress(content))
+    return row
+
+
+class Command(BaseCommand):
+    help = "Bytes of the storefront HTML per page view and of the static bundles it links (raw, gzip, brotli)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=10, help="Products in the scratch catalog.")
+        parser.add_argument("--json", action="store_true", help="Print machine-readable results.")
+
+    def handle(self, *args, **options):
+        results = {}
+        with scratch_database(), override_settings(CACHES=LOCMEM_CACHE, PAGE_CACHE_TTL=0):
+            seed_catalog(categories=2, products=options["products"], variants=2)
+            client = Client()
+            results["index (anonymous)"] = sizes(client.get(reverse("store:index")).content)
+            client.force_login(get_user_model().objects.create_user("payload@phoenix.test", "bench-password"))
+            results["index (customer)"] = sizes(client.get(reverse("store:index")).content)
+
+        for name in BUNDLES:
+            path = finders.find(name)
+            if path is None:
+                continue
+            with open(path, "rb") as fh:
+                results[f"{name} (minified)"] = sizes(minify(name, fh.read().decode()).encode())
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"{'response':<40}{'bytes':>9}{'gzip':>8}{'brotli':>8}")
+        for name, row in results.items():
+            self.stdout.write(f"{name:<40}{row['bytes']:>9}{row['gzip']:>8}{row.get('brotli', '-'):>8}")
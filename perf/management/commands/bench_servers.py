@@ -0,0 +1,104 @@
+import json
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from perf.bench import process_tree_rss, seed_catalog
+from perf.loadtest import UVICORN_WORKER, HttpTransport, ServerNotReady, gunicorn_server, parse_mix, run_load
+from store.models import ProductVariant
+
+PASSWORD = "loadtest-password"
+
+# Same worker count for every server, so memory stays roughly fixed and the
+# comparison is how much concurrency each one turns into throughput.
+SERVERS = {
+    "wsgi": ("phoenix_mart.wsgi:application", "sync", []),
+    "wsgi-gthread": ("phoenix_mart.wsgi:application", "gthread", ["--threads", "4"]),
+    "asgi": ("phoenix_mart.asgi:application", UVICORN_WORKER, []),
+}
+DEFAULT_MIX = (
+    "index=25,add_to_cart=30,update_cart_item=15,buy_now=10,confirm_order=5,checkout_cart=5,generate_invoice=10"
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Start the WSGI and ASGI deployments with the same number of gunicorn workers and "
+        "compare throughput and latency as the number of concurrent customers grows."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--servers", default="wsgi,asgi", help=f"Any of {', '.join(SERVERS)}.")
+        parser.add_argument("--workers", type=int, default=2)
+        parser.add_argument("--concurrency", default="2,8,32", help="Concurrent customers per run.")
+        parser.add_argument("--requests", type=int, default=400, help="Requests per run.")
+        parser.add_argument("--mix", default=DEFAULT_MIX)
+        parser.add_argument("--seed", action="store_true",
+                            help="Seed the configured database first (never use on production).")
+        parser.add_argument("--output", help="Write JSON results to this file.")
+
+    def handle(self, *args, **options):
+        servers = options["servers"].split(",")
+        unknown = set(servers) - set(SERVERS)
+        if unknown:
+            raise CommandError(f"Unknown server(s): {', '.join(sorted(unknown))}")
+        levels = [int(level) for level in options["concurrency"].split(",")]
+        try:
+            mix = parse_mix(options["mix"])
+        except ValueError as exc:
+            raise CommandError(exc)
+
+        if options["seed"]:
+            seed_catalog(4, 12, 3, stock=10**7)
+        variants = list(ProductVariant.objects.filter(is_active=True, in_stock=True).values_list("id", "product_id"))
+        if not variants:
+            raise CommandError("No in-stock variants to shop for; pass --seed to create a catalog.")
+        users = self._customers(max(levels))
+
+        results = []
+        self.stdout.write(f"{'server':<14}{'clients':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'err':>5}{'RSS MB':>8}")
+        for name in servers:
+            app, worker_class, extra_args = SERVERS[name]
+            try:
+                with gunicorn_server(app, options["workers"], extra_args, worker_class=worker_class) as (base_url, process):
+                    for level in levels:
+                        transports = [HttpTransport(base_url, user.email, PASSWORD) for user in users[:level]]
+                        report = run_load(transports, variants, mix, options["requests"], warmup=2, concurrent=True)
+                        row = self._row(name, level, report, process_tree_rss(process.pid))
+                        results.append(row)
+                        self.stdout.write(
+                            f"{name:<14}{level:>8}{row['throughput_rps']:>9}{row['p50_ms']:>9}{row['p95_ms']:>9}"
+                            f"{row['p99_ms']:>9}{row['errors']:>5}{row['rss_mb']:>8}"
+                        )
+            except ServerNotReady as exc:
+                raise CommandError(f"{name}: {exc}")
+
+        if options["output"]:
+            Path(options["output"]).write_text(json.dumps({"workers": options["workers"], "runs": results}, indent=2))
+            self.stdout.write(f"Wrote {options['output']}")
+
+    def _row(self, name, level, report, rss):
+        overall = report["overall"]
+        return {
+            "server": name,
+            "clients": level,
+            "throughput_rps": report["throughput_rps"],
+            "p50_ms": round(overall["p50_ms"], 1),
+            "p95_ms": round(overall["p95_ms"], 1),
+            "p99_ms": round(overall["p99_ms"], 1),
+            "errors": sum(row["errors"] for row in report["endpoints"].values()),
+            "rss_mb": round(rss / 2**20, 1),
+            "endpoints": report["endpoints"],
+        }
+
+    def _customers(self, count):
+        User = get_user_model()
+        users = []
+        for n in range(count):
+            user, created = User.objects.get_or_create(email=f"loadtest-{n}@phoenix.test")
+            if created:
+                user.set_password(PASSWORD)
+                user.save()
+            users.append(user)
+        return users
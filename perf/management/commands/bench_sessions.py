@@ -0,0 +1,73 @@
+import json
+from collections import defaultdict
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from perf.bench import count_queries, scratch_database, seed_catalog
+
+ENGINES = {
+    "db": "django.contrib.sessions.backends.db",
+    "cached_db": "django.contrib.sessions.backends.cached_db",
+    "signed_cookies": "django.contrib.sessions.backends.signed_cookies",
+    "hybrid": "phoenix_mart.sessions",
+}
+LOCMEM_CACHE = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+class Command(BaseCommand):
+    help = "Count django_session queries per request for index, add-to-cart and buy-now under each session engine."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--engines", nargs="+", choices=sorted(ENGINES), default=list(ENGINES))
+        parser.add_argument("--rounds", type=int, default=5, help="Browse/add/buy-now rounds per visitor.")
+        parser.add_argument("--json", action="store_true", help="Print machine-readable results.")
+
+    def handle(self, *args, **options):
+        results = {}
+        with scratch_database():
+            variant = seed_catalog(categories=1, products=5, variants=2)[0]
+            user = get_user_model().objects.create_user("sessions@phoenix.test", "bench-password")
+            steps = [
+                ("index", "get", reverse("store:index"), {}),
+                ("add_to_cart", "post", reverse("cart:add_to_cart", args=[variant.product_id]),
+                 {"variant_id": variant.id, "quantity": 1}),
+                ("buy_now", "post", reverse("store:buy_now", args=[variant.product_id]),
+                 {"variant_id": variant.id, "quantity": 1}),
+            ]
+
+            for name in options["engines"]:
+                with override_settings(SESSION_ENGINE=ENGINES[name], CACHES=LOCMEM_CACHE,
+                                       CART_GUEST_STORAGE="cart.storage.SessionCartStorage"):
+                    for visitor in ("anonymous", "customer"):
+                        client = Client()
+                        if visitor == "customer":
+                            client.force_login(user)
+                        totals = defaultdict(lambda: [0, 0, 0])  # requests, session queries, queries
+                        for _ in range(options["rounds"]):
+                            for path, method, url, data in steps:
+                                with count_queries() as queries:
+                                    getattr(client, method)(url, data)
+                                row = totals[path]
+                                row[0] += 1
+                                row[1] += queries.touching("django_session")
+                                row[2] += queries.count
+                        results[f"{name}/{visitor}"] = {
+                            path: {
+                                "session_queries_per_request": round(session / requests, 2),
+                                "queries_per_request": round(total / requests, 2),
+                            }
+                            for path, (requests, session, total) in totals.items()
+                        }
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"{'engine/visitor':<28}{'path':<14}{'session q/req':>14}{'all q/req':>11}")
+        for key, paths in results.items():
+            for path, row in paths.items():
+                self.stdout.write(
+                    f"{key:<28}{path:<14}{row['session_queries_per_request']:>14}{row['queries_per_request']:>11}"
+                )
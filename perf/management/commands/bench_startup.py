@@ -0,0 +1,90 @@
+import json
+import statistics
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+from django.core.management.base import BaseCommand, CommandError
+
+from perf.bench import process_tree_rss
+from perf.loadtest import ServerNotReady, gunicorn_server
+from perf.management.commands.audit_imports import LAZY_MODULES
+
+# "eager" boots workers the way they did before the heavy modules were
+# deferred: each one imports them right after loading the app.
+EAGER_CONFIG = """
+def post_worker_init(worker):
+    import {modules}
+"""
+
+
+def worker_rss(pid):
+    """Resident memory in bytes of each of the gunicorn master's workers."""
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as fh:
+            children = [int(child) for child in fh.read().split()]
+    except FileNotFoundError:
+        return []
+    return [process_tree_rss(child) for child in children]
+
+
+def first_response(url, timeout):
+    """Poll ``url`` until a worker answers (any status); returns the status code."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as response:
+                return response.status
+        except urllib.error.HTTPError as exc:
+            return exc.code
+        except OSError:
+            if time.monotonic() > deadline:
+                raise ServerNotReady(f"No response from {url}.")
+            time.sleep(0.05)
+
+
+class Command(BaseCommand):
+    help = (
+        "Time from starting gunicorn to its first response, and resident memory per worker, with "
+        "heavy modules loaded on first use (lazy) and at worker boot (eager)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=2)
+        parser.add_argument("--runs", type=int, default=3, help="Server starts per mode.")
+        parser.add_argument("--path", default="metrics", help="Path of the first request (no database needed).")
+        parser.add_argument("--settle", type=float, default=2.0,
+                            help="Seconds to let every worker finish booting before reading RSS.")
+        parser.add_argument("--json", action="store_true", help="Print machine-readable results.")
+
+    def handle(self, *args, **options):
+        results = {}
+        with tempfile.NamedTemporaryFile("w", suffix=".py") as config:
+            config.write(EAGER_CONFIG.format(modules=", ".join(LAZY_MODULES)))
+            config.flush()
+            modes = {"lazy": [], "eager": ["--config", config.name]}
+            for mode, extra_args in modes.items():
+                startups, rss, status = [], [], None
+                for _ in range(options["runs"]):
+                    started = time.perf_counter()
+                    try:
+                        with gunicorn_server(workers=options["workers"], extra_args=extra_args) as (base_url, process):
+                            status = first_response(base_url + options["path"], timeout=30)
+                            startups.append(time.perf_counter() - started)
+                            time.sleep(options["settle"])
+                            rss.extend(worker_rss(process.pid))
+                    except ServerNotReady as exc:
+                        raise CommandError(f"{mode}: {exc}")
+                results[mode] = {
+                    "first_response_ms": round(statistics.median(startups) * 1000, 1),
+                    "worker_rss_mb": round(statistics.fmean(rss) / 2**20, 1) if rss else None,
+                    "status": status,
+                }
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"{'mode':<8}{'first response ms':>19}{'RSS/worker MB':>15}")
+        for mode, row in results.items():
+            self.stdout.write(f"{mode:<8}{row['first_response_ms']:>19}{row['worker_rss_mb'] or '-':>15}")
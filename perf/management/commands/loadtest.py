@@ -0,0 +1,140 @@
+import json
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from perf.bench import scratch_database, seed_catalog
+from perf.loadtest import (
+    DEFAULT_MIX, UVICORN_WORKER, ClientTransport, HttpTransport, ServerNotReady, compare, git_commit, gunicorn_server, parse_mix,
+    run_load,
+)
+from store.models import ProductVariant
+
+PASSWORD = "loadtest-password"
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay a weighted mix of storefront traffic and report p50/p95/p99 latency, "
+        "throughput and queries per request for each endpoint."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--target", choices=["client", "http", "gunicorn"], default="client",
+                            help="client: in-process test client on a scratch database (records queries). "
+                                 "http: an already running server at --base-url. "
+                                 "gunicorn: start a local gunicorn for the run.")
+        parser.add_argument("--base-url", default="http://127.0.0.1:8000/")
+        parser.add_argument("--workers", type=int, default=2, help="gunicorn workers (--target gunicorn).")
+        parser.add_argument("--worker-class", default=UVICORN_WORKER,
+                            help="gunicorn worker class (--target gunicorn). The uvicorn worker serves the ASGI "
+                                 "app as docker-compose does; sync and gthread serve the WSGI app.")
+        parser.add_argument("--gunicorn-args", default="", help="Extra gunicorn arguments, e.g. '--threads 4'.")
+        parser.add_argument("--seed", action="store_true",
+                            help="Seed the configured database (http/gunicorn targets; never use on production).")
+        parser.add_argument("--categories", type=int, default=4)
+        parser.add_argument("--products", type=int, default=12, help="Products per category.")
+        parser.add_argument("--variants", type=int, default=3, help="Variants per product.")
+        parser.add_argument("--customers", type=int, default=4, help="Virtual customers (threads for http targets).")
+        parser.add_argument("--requests", type=int, default=500)
+        parser.add_argument("--warmup", type=int, default=5, help="Unrecorded requests per customer.")
+        parser.add_argument("--mix", default=",".join(f"{k}={v}" for k, v in DEFAULT_MIX.items()))
+        parser.add_argument("--random-seed", type=int, default=0)
+        parser.add_argument("--output", help="Write JSON results to this file.")
+        parser.add_argument("--compare", help="Previous JSON results to diff against.")
+
+    def handle(self, *args, **options):
+        try:
+            mix = parse_mix(options["mix"])
+        except ValueError as exc:
+            raise CommandError(exc)
+
+        target = options["target"]
+        database = scratch_database() if target == "client" else nullcontext()
+        with database:
+            if target == "client" or options["seed"]:
+                seed_catalog(options["categories"], options["products"], options["variants"], stock=10**7)
+            variants = list(ProductVariant.objects.filter(is_active=True, in_stock=True)
+                            .values_list("id", "product_id"))
+            if not variants:
+                raise CommandError("No in-stock variants to shop for; pass --seed to create a catalog.")
+            users = self._customers(options["customers"])
+
+            with self._server(options) as base_url:
+                if base_url:
+                    transports = [HttpTransport(base_url, user.email, PASSWORD) for user in users]
+                else:
+                    transports = [ClientTransport(user) for user in users]
+                report = run_load(
+                    transports, variants, mix, options["requests"],
+                    warmup=options["warmup"], seed=options["random_seed"], concurrent=bool(base_url),
+                )
+
+        report = {
+            "meta": {
+                "commit": git_commit(),
+                "target": target,
+                "requests": options["requests"],
+                "customers": options["customers"],
+                "mix": mix,
+                "catalog": {k: options[k] for k in ("categories", "products", "variants")},
+                "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            },
+            **report,
+        }
+        self._print(report)
+
+        if options["output"]:
+            Path(options["output"]).write_text(json.dumps(report, indent=2))
+            self.stdout.write(f"Wrote {options['output']}")
+        if options["compare"]:
+            previous = json.loads(Path(options["compare"]).read_text())
+            self.stdout.write(f"\nvs {previous['meta'].get('commit')}:")
+            for endpoint, metric, before, after, change in compare(previous, report):
+                self.stdout.write(f"  {endpoint:<18}{metric:<22}{before:>10} -> {after:<10} {change:+.1f}%")
+
+    def _customers(self, count):
+        User = get_user_model()
+        users = []
+        for n in range(count):
+            user, created = User.objects.get_or_create(email=f"loadtest-{n}@phoenix.test")
+            if created:
+                user.set_password(PASSWORD)
+                user.save()
+            users.append(user)
+        return users
+
+    @contextmanager
+    def _server(self, options):
+        if options["target"] == "client":
+            yield None
+            return
+        if options["target"] == "http":
+            yield options["base_url"]
+            return
+
+        try:
+            with gunicorn_server(workers=options["workers"], extra_args=options["gunicorn_args"].split(),
+                                 worker_class=options["worker_class"]) as (url, _):
+                yield url
+        except ServerNotReady as exc:
+            raise CommandError(exc)
+
+    def _print(self, report):
+        meta = report["meta"]
+        self.stdout.write(
+            f"{meta['requests']} requests by {meta['customers']} customers against {meta['target']} "
+            f"in {report['elapsed_s']}s ({report['throughput_rps']} req/s)"
+        )
+        self.stdout.write(
+            f"{'endpoint':<18}{'n':>6}{'err':>5}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>8}{'q/req':>7}{'http':>6}"
+        )
+        for endpoint, row in report["endpoints"].items():
+            self.stdout.write(
+                f"{endpoint:<18}{row['n']:>6}{row['errors']:>5}{row['p50_ms']:>9}{row['p95_ms']:>9}"
+                f"{row['p99_ms']:>9}{row['rps']:>8}{row.get('queries_per_request', '-'):>7}"
+                f"{row.get('requests_per_action', '-'):>6}"
+            )
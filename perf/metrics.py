@@ -0,0 +1,268 @@
+# perf/metrics.py
+"""
+Prometheus-style counters and histograms, exposed at ``/metrics``.
+
+Every process writes its own values to ``METRICS_DIR/<host>-<pid>.db``, a
+small memory-mapped file, so an increment is a dict lookup plus an 8-byte
+write and needs no lock shared between gunicorn workers. A scrape reads
+every file in the directory and sums them, so the numbers cover all
+workers, including ones that have since been recycled, and every container
+that shares the directory (the task worker records invoice render times).
+The host name keeps containers' pids apart. ``gunicorn.conf.py`` clears its
+own host's files when the master starts.
+
+With ``METRICS_ENABLED = False`` every ``inc``/``observe`` returns
+immediately and ``MetricsMiddleware`` is not loaded.
+"""
+import hmac
+import json
+import mmap
+import os
+import socket
+import struct
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+REGISTRY = {}
+
+
+def enabled():
+    return getattr(settings, "METRICS_ENABLED", False)
+
+
+def scrape_allowed(request):
+    """Staff, or a scraper sending ``Authorization: Bearer <METRICS_TOKEN>``."""
+    if request.user.is_authenticated and request.user.is_staff:
+        return True
+    token = getattr(settings, "METRICS_TOKEN", "")
+    scheme, _, credentials = request.headers.get("Authorization", "").partition(" ")
+    return bool(token) and scheme.lower() == "bearer" and hmac.compare_digest(credentials.encode(), token.encode())
+
+
+def metrics_dir():
+    return Path(getattr(settings, "METRICS_DIR", "/tmp/phoenix_mart_metrics"))
+
+
+def process_file():
+    return metrics_dir() / f"{socket.gethostname()}-{os.getpid()}.db"
+
+
+class ValueFile:
+    """
+    ``{key: float}`` in an mmap'ed file: a 4-byte "bytes used" header, then
+    entries of ``<int32 key length><key, space-padded><float64 value>`` laid
+    out so every value is 8-byte aligned.
+    """
+
+    initial_size = 64 * 1024
+
+    def __init__(self, path):
+        self._file = open(path, "a+b")
+        size = os.fstat(self._file.fileno()).st_size
+        if size == 0:
+            self._file.truncate(self.initial_size)
+            size = self.initial_size
+        self._capacity = size
+        self._map = mmap.mmap(self._file.fileno(), size)
+        self._used = struct.unpack_from("<i", self._map, 0)[0]
+        if self._used == 0:
+            self._used = 8
+            struct.pack_into("<i", self._map, 0, self._used)
+        self._positions = {key: pos for key, _, pos in read_entries(self._map, self._used)}
+
+    def _add_key(self, key):
+        encoded = key.encode("utf-8")
+        padded = encoded + b" " * (8 - (len(encoded) + 4) % 8)
+        entry = struct.pack(f"<i{len(padded)}sd", len(encoded), padded, 0.0)
+        while self._used + len(entry) > self._capacity:
+            self._capacity *= 2
+            self._file.truncate(self._capacity)
+            self._map.close()
+            self._map = mmap.mmap(self._file.fileno(), self._capacity)
+        self._map[self._used:self._used + len(entry)] = entry
+        self._positions[key] = self._used + len(entry) - 8
+        self._used += len(entry)
+        # Publish the entry only once it is fully written, for concurrent readers
+        struct.pack_into("<i", self._map, 0, self._used)
+
+    def add(self, key, amount):
+        pos = self._positions.get(key)
+        if pos is None:
+            self._add_key(key)
+            pos = self._positions[key]
+        value = struct.unpack_from("<d", self._map, pos)[0]
+        struct.pack_into("<d", self._map, pos, value + amount)
+
+
+def read_entries(data, used=None):
+    """Yield ``(key, value, value_offset)`` from the bytes of a ``ValueFile``."""
+    if used is None:
+        used = struct.unpack_from("<i", data, 0)[0]
+    pos = 8
+    while pos < used:
+        length = struct.unpack_from("<i", data, pos)[0]
+        key = bytes(data[pos + 4:pos + 4 + length]).decode("utf-8")
+        value_pos = pos + 4 + length + (8 - (length + 4) % 8)
+        yield key, struct.unpack_from("<d", data, value_pos)[0], value_pos
+        pos = value_pos + 8
+
+
+class _ProcessValues:
+    """The current process's ``ValueFile``; reopened after a fork or a ``METRICS_DIR`` change."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._path = None
+        self._file = None
+
+    def add(self, key, amount):
+        with self._lock:
+            path = process_file()
+            if path != self._path:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                self._file = ValueFile(path)
+                self._path = path
+            self._file.add(key, amount)
+
+
+_values = _ProcessValues()
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        REGISTRY[name] = self
+
+    def _key(self, sample, labels):
+        return json.dumps([sample, labels], sort_keys=True)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        if enabled():
+            _values.add(self._key(self.name, labels), amount)
+
+    def samples(self, values):
+        return [(labels, value) for (sample, labels), value in values if sample == self.name]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        if not enabled():
+            return
+        # Each observation is stored in its own bucket; render() makes them cumulative
+        bound = next((b for b in self.buckets if value <= b), "+Inf")
+        _values.add(self._key(f"{self.name}_bucket", {**labels, "le": str(bound)}), 1)
+        _values.add(self._key(f"{self.name}_sum", labels), value)
+        _values.add(self._key(f"{self.name}_count", labels), 1)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+
+# --- Request metrics (MetricsMiddleware) ---
+REQUEST_LATENCY = Histogram("http_request_duration_seconds", "Time spent in Django per request.", ["view"])
+REQUESTS = Counter("http_requests_total", "Requests by view and status class.", ["view", "status"])
+DB_QUERIES = Counter("db_queries_total", "Database queries run while serving requests.", ["view"])
+
+# --- Render caches (store/pagecache.py, store/fragments.py); hit rate = hit / (hit + miss) ---
+CACHE_LOOKUPS = Counter("render_cache_lookups_total", "Page and fragment cache lookups by result.", ["cache", "result"])
+
+# --- Business metrics ---
+ORDERS_CREATED = Counter("orders_created_total", "Orders placed through confirm_order.", ["path"])
+CART_ADDS = Counter("cart_adds_total", "Successful add-to-cart requests.")
+STOCK_REJECTIONS = Counter("checkout_stock_rejections_total", "Checkouts refused for insufficient stock.")
+INVOICE_RENDER = Histogram(
+    "invoice_render_seconds", "WeasyPrint time per invoice PDF.", buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+
+
+def collect():
+    """Sum every process's values: ``{'["<sample>", {<labels>}]': value}``."""
+    merged = defaultdict(float)
+    directory = metrics_dir()
+    if not directory.is_dir():
+        return merged
+    for path in directory.glob("*.db"):
+        with open(path, "rb") as fh:
+            data = fh.read()
+        if len(data) < 8:
+            continue
+        for key, value, _ in read_entries(data):
+            merged[key] += value
+    return merged
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in sorted(labels.items())) + "}"
+
+
+def _number(value):
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+def render():
+    """The text exposition format (version 0.0.4) of every registered metric."""
+    values = [(tuple(json.loads(key)), value) for key, value in collect().items()]
+    lines = []
+    for metric in REGISTRY.values():
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        if metric.kind == "counter":
+            for labels, value in sorted(metric.samples(values), key=lambda row: sorted(row[0].items())):
+                lines.append(f"{metric.name}{_labels(labels)} {_number(value)}")
+        else:
+            lines.extend(_histogram_lines(metric, values))
+    return "\n".join(lines) + "\n"
+
+
+def _histogram_lines(metric, values):
+    series = defaultdict(lambda: {"buckets": defaultdict(float), "sum": 0.0, "count": 0.0})
+    for (sample, labels), value in values:
+        if sample == f"{metric.name}_bucket":
+            le = labels.pop("le")
+            series[json.dumps(labels, sort_keys=True)]["buckets"][le] += value
+        elif sample == f"{metric.name}_sum":
+            series[json.dumps(labels, sort_keys=True)]["sum"] += value
+        elif sample == f"{metric.name}_count":
+            series[json.dumps(labels, sort_keys=True)]["count"] += value
+
+    lines = []
+    for key in sorted(series):
+        labels, data = json.loads(key), series[key]
+        cumulative = 0.0
+        for bound in [str(b) for b in metric.buckets] + ["+Inf"]:
+            cumulative += data["buckets"].get(bound, 0.0)
+            lines.append(f"{metric.name}_bucket{_labels({**labels, 'le': bound})} {_number(cumulative)}")
+        lines.append(f"{metric.name}_sum{_labels(labels)} {_number(data['sum'])}")
+        lines.append(f"{metric.name}_count{_labels(labels)} {_number(data['count'])}")
+    return lines
@@ -0,0 +1,231 @@
+# perf/middleware.py
+import json
+import logging
+import time
+
+from asgiref.sync import async_to_sync, iscoroutinefunction, markcoroutinefunction, sync_to_async
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+
+from perf import instrumentation, metrics, profiler
+from perf.query_budget import middleware_budgets
+
+logger = logging.getLogger("perf.requests")
+
+
+class SyncAndAsyncMiddleware:
+    """
+    Runs in the mode of the handler it is given, so under ASGI the async
+    views are reached without a ``sync_to_async`` thread hop per request.
+    Subclasses implement ``__call__`` for WSGI and ``__acall__`` for ASGI.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+
+class PerformanceMiddleware(SyncAndAsyncMiddleware):
+    """
+    Records DB queries/time, template render time, cache hits/misses and
+    named spans (``perf.instrumentation.timed``, e.g. WeasyPrint) for every
+    request and exposes them as a ``Server-Timing`` header and one JSON log
+    line on the ``perf.requests`` logger.
+
+    Requests that run more queries than ``PERF_QUERY_BUDGETS[view_name]``
+    (by default the budgets in ``perf.query_budget``) are logged as
+    warnings. With ``PERF_INSTRUMENTATION = False`` Django drops the
+    middleware at startup, so it costs nothing.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, "PERF_INSTRUMENTATION", False):
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        self.budgets = getattr(settings, "PERF_QUERY_BUDGETS", None) or middleware_budgets()
+        self.server_timing = getattr(settings, "PERF_SERVER_TIMING", True)
+        instrumentation.install_template_timer()
+        instrumentation.install_cache_counters({type(caches[alias]) for alias in settings.CACHES})
+        instrumentation.install_query_hook()
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        stats, token = instrumentation.start_request()
+        try:
+            with instrumentation.listen_queries(stats.add_query):
+                response = self.get_response(request)
+        finally:
+            instrumentation.end_request(token)
+
+        self.report(request, response, stats)
+        return response
+
+    async def __acall__(self, request):
+        stats, token = instrumentation.start_request()
+        try:
+            with instrumentation.listen_queries(stats.add_query):
+                response = await self.get_response(request)
+        finally:
+            instrumentation.end_request(token)
+
+        self.report(request, response, stats)
+        return response
+
+    def report(self, request, response, stats):
+        match = getattr(request, "resolver_match", None)
+        route = match.view_name if match else None
+        budget = self.budgets.get(route)
+        over_budget = budget is not None and stats.queries > budget
+
+        if self.server_timing:
+            parts = [
+                f'db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} queries"',
+                f"tpl;dur={stats.template_time * 1000:.1f}",
+                f'cache;desc="hit={stats.cache_hits} miss={stats.cache_misses}"',
+            ]
+            parts += [f"{name};dur={seconds * 1000:.1f}" for name, seconds in stats.timings.items()]
+            if over_budget:
+                parts.append(f'budget;desc="{stats.queries}>{budget} queries"')
+            parts.append(f"total;dur={stats.elapsed * 1000:.1f}")
+            response["Server-Timing"] = ", ".join(parts)
+
+        record = {
+            "method": request.method,
+            "path": request.path,
+            "route": route,
+            "status": response.status_code,
+            "ms": round(stats.elapsed * 1000, 2),
+            "queries": stats.queries,
+            "db_ms": round(stats.db_time * 1000, 2),
+            "template_ms": round(stats.template_time * 1000, 2),
+            "cache_hits": stats.cache_hits,
+            "cache_misses": stats.cache_misses,
+            **{f"{name}_ms": round(seconds * 1000, 2) for name, seconds in stats.timings.items()},
+        }
+        if over_budget:
+            record["query_budget"] = budget
+            logger.warning(json.dumps(record))
+        else:
+            logger.info(json.dumps(record))
+
+
+class ProfilingMiddleware(SyncAndAsyncMiddleware):
+    """
+    Runs views under ``perf.profiler`` while a staff member has a profiling
+    session open (see ``perf.views.profile``).
+
+    Only loaded when ``PERF_PROFILER`` is on. Between sessions a request
+    costs one clock comparison; the shared cache is read at most once per
+    ``profiler.POLL_INTERVAL`` per worker. Keep it last in ``MIDDLEWARE``:
+    returning a response from ``process_view`` skips the ``process_view``
+    of every middleware listed after it (CSRF included).
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, "PERF_PROFILER", False):
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        self._session = None
+        self._checked = float("-inf")
+        if self.async_mode:
+            # Django runs a sync process_view in a thread under ASGI; this one
+            # only leaves the event loop to poll the cache or to profile
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        return await self.get_response(request)
+
+    def poll_due(self):
+        now = time.monotonic()
+        if now - self._checked < profiler.POLL_INTERVAL:
+            return False
+        self._checked = now
+        return True
+
+    def wanted(self, request, session):
+        return session is not None and request.resolver_match.view_name == session["route"]
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if self.poll_due():
+            self._session = profiler.current_session()
+        session = self._session
+        if not self.wanted(request, session):
+            return None
+        if not profiler.claim(session):
+            self._session = None  # used up; don't ask the cache again until the next poll
+            return None
+        return profiler.profile_call(session, self._call_view.__code__, self._call_view, view_func, request,
+                                     view_args, view_kwargs)
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        if self.poll_due():
+            self._session = await sync_to_async(profiler.current_session)()
+        session = self._session
+        if not self.wanted(request, session):
+            return None
+        if not await sync_to_async(profiler.claim)(session):
+            self._session = None
+            return None
+        return await sync_to_async(profiler.profile_call)(
+            session, self._call_view.__code__, self._call_view, view_func, request, view_args, view_kwargs
+        )
+
+    @staticmethod
+    def _call_view(view_func, request, view_args, view_kwargs):
+        # Sampled stacks are cut at this frame, so they start at the view.
+        # Async views run their ORM and template work back on this thread
+        # (thread-sensitive sync_to_async), which is what the profilers see.
+        if iscoroutinefunction(view_func):
+            return async_to_sync(view_func)(request, *view_args, **view_kwargs)
+        return view_func(request, *view_args, **view_kwargs)
+
+
+class MetricsMiddleware(SyncAndAsyncMiddleware):
+    """
+    Feeds the request latency, status and DB query counters of
+    ``perf.metrics``. Not loaded unless ``METRICS_ENABLED`` is on.
+    """
+
+    def __init__(self, get_response):
+        if not metrics.enabled():
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        instrumentation.install_query_hook()
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        queries = []
+        start = time.perf_counter()
+        with instrumentation.listen_queries(queries.append):
+            response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - start, len(queries))
+        return response
+
+    async def __acall__(self, request):
+        queries = []
+        start = time.perf_counter()
+        with instrumentation.listen_queries(queries.append):
+            response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - start, len(queries))
+        return response
+
+    def record(self, request, response, elapsed, queries):
+        match = getattr(request, "resolver_match", None)
+        view = match.view_name if match else "unmatched"  # keeps 404 paths out of the label set
+        metrics.REQUEST_LATENCY.observe(elapsed, view=view)
+        metrics.REQUESTS.inc(view=view, status=f"{response.status_code // 100}xx")
+        metrics.DB_QUERIES.inc(queries, view=view)
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.5 on 2026-10-19 02:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfileQuota',
+            fields=[
+                ('session_id', models.CharField(max_length=12, primary_key=True, serialize=False)),
+                ('remaining', models.PositiveIntegerField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,11 @@
+from django.db import models
+
+
+class ProfileQuota(models.Model):
+    """Request slots left in a ``perf.profiler`` session, shared by every worker."""
+
+    session_id = models.CharField(max_length=12, primary_key=True)
+    remaining = models.PositiveIntegerField()
+
+    def __str__(self):
+        return f"Profile session {self.session_id} ({self.remaining} left)"
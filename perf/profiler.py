@@ -0,0 +1,181 @@
+# perf/profiler.py
+"""
+On-demand profiling of live workers, driven by ``perf.views.profile``.
+
+A staff member starts a *session*: profile the next N requests to one URL
+name, either with a statistical sampler (folded stacks, the input format of
+flamegraph.pl and speedscope) or with cProfile. The session lives in the
+shared cache so every gunicorn worker sees it; ``ProfilingMiddleware``
+re-reads it at most once a second per worker. Request slots are counted
+in the ``ProfileQuota`` table and claimed with a conditional UPDATE, so
+workers can't take more than the session allows; ``cache.decr`` is a
+read-then-write on the file and locmem backends. Each profiled request writes one file under
+``PERF_PROFILE_DIR/<session id>/``, and ``collect()`` merges them.
+"""
+import io
+import math
+import os
+import shutil
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+
+from perf.models import ProfileQuota
+
+SESSION_KEY = "perf:profile"
+MODES = ("sample", "cprofile")
+MAX_REQUESTS = 1000
+SESSION_TTL = 60 * 60
+POLL_INTERVAL = 1.0
+# Sampler period bounds: below 1 ms the sampler thread starves the request
+MIN_INTERVAL = 0.001
+MAX_INTERVAL = 1.0
+
+
+def profile_dir(session_id=None):
+    base = Path(getattr(settings, "PERF_PROFILE_DIR", "/tmp/phoenix_mart_profiles"))
+    return base / session_id if session_id else base
+
+
+def start_session(route, requests, mode="sample", interval=0.005):
+    """Profile the next ``requests`` requests to ``route``; replaces any running session."""
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {', '.join(MODES)}")
+    try:
+        interval = float(interval)
+    except (TypeError, ValueError):
+        interval = math.nan
+    if not math.isfinite(interval):
+        raise ValueError("interval must be a number of seconds")
+    session = {
+        "id": uuid.uuid4().hex[:12],
+        "route": route,
+        "requests": max(1, min(int(requests), MAX_REQUESTS)),
+        "mode": mode,
+        "interval": max(MIN_INTERVAL, min(interval, MAX_INTERVAL)),
+        "started": time.time(),
+    }
+    _prune_old_sessions()
+    profile_dir(session["id"]).mkdir(parents=True, exist_ok=True)
+    ProfileQuota.objects.all().delete()  # one session at a time
+    ProfileQuota.objects.create(session_id=session["id"], remaining=session["requests"])
+    cache.set(SESSION_KEY, session, SESSION_TTL)
+    return session
+
+
+def _prune_old_sessions():
+    base = profile_dir()
+    if not base.is_dir():
+        return
+    for child in base.iterdir():
+        if child.is_dir() and time.time() - child.stat().st_mtime > SESSION_TTL:
+            shutil.rmtree(child, ignore_errors=True)
+
+
+def current_session():
+    return cache.get(SESSION_KEY)
+
+
+def stop_session():
+    session = cache.get(SESSION_KEY)
+    if session:
+        ProfileQuota.objects.filter(session_id=session["id"]).delete()
+    cache.delete(SESSION_KEY)
+    return session
+
+
+def claim(session):
+    """Reserve one request slot of ``session``; False once all are taken (by any worker)."""
+    claimed = ProfileQuota.objects.filter(session_id=session["id"], remaining__gt=0).update(
+        remaining=F("remaining") - 1
+    )
+    return claimed == 1
+
+
+def remaining(session):
+    quota = ProfileQuota.objects.filter(session_id=session["id"]).values_list("remaining", flat=True).first()
+    return quota or 0
+
+
+class Sampler(threading.Thread):
+    """Samples one thread's Python stack every ``interval`` seconds until stopped."""
+
+    def __init__(self, thread_id, interval, root_code):
+        super().__init__(daemon=True, name="perf-sampler")
+        self.thread_id = thread_id
+        self.interval = interval
+        self.root_code = root_code  # frames above this code object are not recorded
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            stack = self._fold(sys._current_frames().get(self.thread_id))
+            if stack:
+                self.stacks[stack] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def _fold(self, frame):
+        """``"module:func;module:func"`` from the root frame down; None outside it."""
+        names = []
+        while frame is not None:
+            if frame.f_code is self.root_code:
+                return ";".join(reversed(names))
+            names.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}")
+            frame = frame.f_back
+        return None
+
+
+def profile_call(session, root_code, func, *args, **kwargs):
+    """Run ``func`` under the session's profiler and store the result for ``collect``."""
+    path = profile_dir(session["id"]) / f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    if session["mode"] == "cprofile":
+        import cProfile  # only while a session is running
+
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(func, *args, **kwargs)
+        finally:
+            profiler.dump_stats(f"{path}.pstats")
+
+    sampler = Sampler(threading.get_ident(), session["interval"], root_code)
+    sampler.start()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        sampler.stop()
+        with open(f"{path}.folded", "w") as fh:
+            fh.writelines(f"{stack} {count}\n" for stack, count in sampler.stacks.items())
+
+
+def collect(session, limit=80):
+    """Merge every worker's output: folded stacks, or a pstats report for cProfile."""
+    directory = profile_dir(session["id"])
+    if session["mode"] == "cprofile":
+        files = sorted(str(p) for p in directory.glob("*.pstats"))
+        if not files:
+            return "", 0
+        import pstats
+
+        out = io.StringIO()
+        pstats.Stats(*files, stream=out).strip_dirs().sort_stats("cumulative").print_stats(limit)
+        return out.getvalue(), len(files)
+
+    files = sorted(directory.glob("*.folded"))
+    stacks = Counter()
+    for path in files:
+        with open(path) as fh:
+            for line in fh:
+                stack, _, count = line.rstrip("\n").rpartition(" ")
+                stacks[stack] += int(count)
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common()), len(files)
@@ -0,0 +1,182 @@
+# perf/query_budget.py
+"""
+Query budgets for the storefront views and the test helpers that enforce them.
+
+``QUERY_BUDGETS`` maps a URL name to the most queries (and the most exact
+duplicate queries) one request may run. Tests use ``QueryBudgetMixin``::
+
+    class IndexQueryTests(QueryBudgetMixin, TestCase):
+        def test_index(self):
+            def scenario(size):
+                seed_storefront(size)
+                return lambda: self.client.get(reverse("store:index"))
+
+            self.assertQueriesConstant("store:index", scenario)
+
+``assertQueriesConstant`` runs the scenario once per fixture size (each in
+a rolled-back transaction) and fails when the count grows with the data,
+the usual sign of an N+1. Every failure lists the SQL with the Python and
+template lines that issued it. ``PerformanceMiddleware`` logs requests over
+the same budgets in production.
+"""
+import sys
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+from decimal import Decimal
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection, transaction
+
+Budget = namedtuple("Budget", "queries duplicates")
+
+QUERY_BUDGETS = {
+    "store:index": Budget(queries=8, duplicates=0),
+    "store:buy_now": Budget(queries=6, duplicates=0),
+    "cart:add_to_cart": Budget(queries=17, duplicates=0),
+    "cart:update_cart_item": Budget(queries=11, duplicates=0),
+    "cart:remove_cart_item": Budget(queries=9, duplicates=0),
+    "cart:batch_update": Budget(queries=16, duplicates=0),
+    "cart:get_cart_summary": Budget(queries=5, duplicates=0),
+    "cart:cart_state": Budget(queries=5, duplicates=0),
+    "order:confirm_order": Budget(queries=14, duplicates=0),
+    "order:order_success": Budget(queries=4, duplicates=0),
+    "order:generate_invoice": Budget(queries=6, duplicates=0),
+    "admin:order_order_changelist": Budget(queries=4, duplicates=0),
+}
+
+FIXTURE_SIZES = (1, 5, 20)
+
+
+def middleware_budgets():
+    """``{view_name: max_queries}`` in the shape of ``settings.PERF_QUERY_BUDGETS``."""
+    return {name: budget.queries for name, budget in QUERY_BUDGETS.items()}
+
+
+def seed_storefront(size, user=None):
+    """
+    A catalog of roughly ``size`` products (two variants each) over two
+    categories. With ``user``, also fill their cart with ``size`` lines.
+    Returns the variants.
+    """
+    from cart.models import Cart, CartItem
+    from perf.bench import seed_catalog
+
+    variants = seed_catalog(categories=2, products=max(1, size // 2 + size % 2), variants=2)
+    variants = variants[: size * 2]
+    if user is not None:
+        cart, _ = Cart.objects.get_or_create(user=user, defaults={"is_guest": False})
+        CartItem.objects.bulk_create(CartItem(cart=cart, product=variant, quantity=1) for variant in variants[:size])
+    return variants
+
+
+def seed_order(user, variants):
+    """An order for ``user`` with one line per variant, plus its shipping address."""
+    from order.models import Order, OrderItem
+    from store.models import Address
+
+    order = Order.objects.create(user=user, total_price=sum((v.price for v in variants), Decimal("0.00")))
+    OrderItem.objects.bulk_create(OrderItem(order=order, product=v, quantity=1, price=v.price) for v in variants)
+    Address.objects.create(
+        order=order, full_name="Budget Test", phone="07123456789", street="1 Harbour Road",
+        city="Grimsby", state="Lincolnshire", zipcode="DN31 3AA", country="UK",
+    )
+    return order
+
+
+class QueryRecorder:
+    """``execute_wrapper`` keeping each statement with the code that issued it."""
+
+    def __init__(self):
+        self.queries = []  # (sql, params, origin)
+        self._root = str(Path(settings.BASE_DIR).resolve())
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append((sql, params, self._origin()))
+        return execute(sql, params, many, context)
+
+    def __len__(self):
+        return len(self.queries)
+
+    def _origin(self):
+        """Innermost project frames and template line, e.g. ``store/views.py:42 in index``."""
+        code, template = [], None
+        frame = sys._getframe(2)
+        while frame is not None:
+            filename = frame.f_code.co_filename
+            if template is None and frame.f_code.co_name == "render_annotated" and filename.endswith(
+                "django/template/base.py"
+            ):
+                node = frame.f_locals.get("self")
+                token = getattr(node, "token", None)
+                if token is not None and node.origin is not None:
+                    template = f"{node.origin.template_name}:{token.lineno}"
+            elif filename.startswith(self._root) and "site-packages" not in filename and filename != __file__:
+                code.append(f"{Path(filename).relative_to(self._root)}:{frame.f_lineno} in {frame.f_code.co_name}")
+            frame = frame.f_back
+        origin = code[:3]
+        if template:
+            origin.insert(0, f"template {template}")
+        return " <- ".join(origin) or "<django internals>"
+
+    def duplicates(self):
+        """Number of statements that repeat an earlier one with the same parameters."""
+        counts = Counter((sql, repr(params)) for sql, params, _ in self.queries)
+        return sum(n - 1 for n in counts.values())
+
+    def shapes(self):
+        """``Counter`` of SQL text regardless of parameters."""
+        return Counter(sql for sql, _, _ in self.queries)
+
+    def report(self, highlight=()):
+        lines = []
+        for number, (sql, params, origin) in enumerate(self.queries, 1):
+            marker = "*" if sql in highlight else " "
+            lines.append(f"{marker}{number:3}. {sql} -- {params!r}\n        from {origin}")
+        return "\n".join(lines)
+
+
+class QueryBudgetMixin:
+    """``TestCase`` mixin asserting ``QUERY_BUDGETS`` and query-count stability."""
+
+    fixture_sizes = FIXTURE_SIZES
+
+    @contextmanager
+    def assertQueryBudget(self, view_name, budget=None):
+        budget = budget or QUERY_BUDGETS[view_name]
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            yield recorder
+
+        problems = []
+        if len(recorder) > budget.queries:
+            problems.append(f"{len(recorder)} queries (budget {budget.queries})")
+        if recorder.duplicates() > budget.duplicates:
+            problems.append(f"{recorder.duplicates()} duplicate queries (budget {budget.duplicates})")
+        if problems:
+            repeated = {sql for sql, n in recorder.shapes().items() if n > 1}
+            self.fail(f"{view_name} over budget: {', '.join(problems)}\n{recorder.report(repeated)}")
+
+    def assertQueriesConstant(self, view_name, scenario, sizes=None, budget=None):
+        """
+        ``scenario(size)`` seeds fixtures and returns a callable issuing the
+        request. The request must run the same number of queries at every size.
+        """
+        runs = []
+        for size in sizes or self.fixture_sizes:
+            with transaction.atomic():
+                make_request = scenario(size)
+                with self.assertQueryBudget(view_name, budget) as recorder:
+                    make_request()
+                runs.append((size, recorder))
+                transaction.set_rollback(True)
+
+        (small, first), (large, last) = runs[0], runs[-1]
+        counts = {size: len(recorder) for size, recorder in runs}
+        if len(set(counts.values())) > 1:
+            grown = {sql for sql, n in last.shapes().items() if n > first.shapes()[sql]}
+            self.fail(
+                f"{view_name} query count grows with fixture size {counts}; "
+                f"statements repeated more at size {large} than at size {small} are marked *\n"
+                f"{last.report(grown)}"
+            )
@@ -0,0 +1,289 @@
+import json
+import random
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.contrib.auth import get_user_model
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from cart.tests import make_variants
+from perf.middleware import MetricsMiddleware, PerformanceMiddleware
+from store.models import ProductVariant
+
+User = get_user_model()
+
+
+class LoadHarnessTests(TestCase):
+    def test_every_endpoint_in_the_mix_is_driven_without_errors(self):
+        from perf.bench import seed_catalog
+        from perf.loadtest import DEFAULT_MIX, ClientTransport, run_load
+
+        seed_catalog(categories=1, products=3, variants=2)
+        variants = list(ProductVariant.objects.values_list("id", "product_id"))
+        user = User.objects.create_user("load@phoenix.test", "pw-12345!")
+
+        report = run_load([ClientTransport(user)], variants, DEFAULT_MIX, requests=60, seed=3)
+
+        self.assertEqual(sum(row["n"] for row in report["endpoints"].values()), 60)
+        for endpoint, row in report["endpoints"].items():
+            self.assertEqual(row["errors"], 0, endpoint)
+            self.assertGreater(row["queries_per_request"], 0, endpoint)
+
+    def test_checkout_cart_places_multi_line_orders(self):
+        from order.models import Order
+        from perf.bench import seed_catalog
+        from perf.loadtest import MAX_CHECKOUT_LINES, ClientTransport, run_load
+
+        seed_catalog(categories=1, products=3, variants=2)
+        variants = list(ProductVariant.objects.values_list("id", "product_id"))
+        user = User.objects.create_user("load@phoenix.test", "pw-12345!")
+
+        report = run_load([ClientTransport(user)], variants, {"checkout_cart": 1}, requests=3)
+
+        row = report["endpoints"]["checkout_cart"]
+        self.assertEqual(row["errors"], 0)
+        self.assertEqual(row["requests_per_action"], MAX_CHECKOUT_LINES + 1)
+        self.assertEqual(
+            [order.items.count() for order in Order.objects.filter(user=user)], [MAX_CHECKOUT_LINES] * 3
+        )
+
+
+class PerformanceMiddlewareTests(TestCase):
+    def setUp(self):
+        make_variants(2)
+
+    def test_disabled_by_default(self):
+        response = self.client.get(reverse("store:index"))
+
+        self.assertNotIn("Server-Timing", response)
+
+    @override_settings(PERF_INSTRUMENTATION=True)
+    def test_server_timing_header_and_log_line(self):
+        with self.assertLogs("perf.requests", "INFO") as logs:
+            response = self.client.get(reverse("store:index"))
+
+        timing = response["Server-Timing"]
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="\d+ queries"')
+        self.assertRegex(timing, r"tpl;dur=[\d.]+")
+        self.assertIn("total;dur=", timing)
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record["route"], "store:index")
+        self.assertGreater(record["queries"], 0)
+        self.assertGreater(record["template_ms"], 0)
+
+    @override_settings(PERF_INSTRUMENTATION=True, PERF_QUERY_BUDGETS={"store:index": 1})
+    def test_requests_over_query_budget_are_flagged(self):
+        with self.assertLogs("perf.requests", "WARNING") as logs:
+            response = self.client.get(reverse("store:index"))
+
+        self.assertIn('budget;desc="', response["Server-Timing"])
+        self.assertEqual(json.loads(logs.records[0].getMessage())["query_budget"], 1)
+
+    @override_settings(PERF_INSTRUMENTATION=True)
+    async def test_async_requests_count_queries_run_on_orm_threads(self):
+        async def get_response(request):
+            return None
+
+        self.assertTrue(iscoroutinefunction(PerformanceMiddleware(get_response)))
+        with self.assertLogs("perf.requests", "INFO") as logs:
+            response = await self.async_client.get(reverse("store:index"))
+
+        self.assertRegex(response["Server-Timing"], r'db;dur=[\d.]+;desc="[1-9]\d* queries"')
+        self.assertGreater(json.loads(logs.records[0].getMessage())["queries"], 0)
+
+
+@override_settings(
+    PERF_PROFILER=True,
+    PERF_PROFILE_DIR=tempfile.mkdtemp(prefix="phoenix-profiles-"),
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+)
+@mock.patch("perf.profiler.POLL_INTERVAL", 0)
+class ProfilerTests(TestCase):
+    def setUp(self):
+        make_variants(2)
+        self.staff = User.objects.create_user("ops@phoenix.test", "pw-12345!", is_staff=True)
+
+    def start(self, **data):
+        self.client.force_login(self.staff)
+        return self.client.post(reverse("perf:profile"), {"route": "store:index", **data})
+
+    def test_only_staff_may_profile(self):
+        self.client.force_login(User.objects.create_user("shopper@phoenix.test", "pw-12345!"))
+
+        response = self.client.post(reverse("perf:profile"), {"route": "store:index", "requests": 1})
+
+        self.assertEqual(response.status_code, 403)
+
+    def test_sampler_profiles_next_requests_to_route(self):
+        self.assertTrue(self.start(requests=2, interval=0.0005).json()["success"])
+
+        for _ in range(3):
+            self.client.get(reverse("store:index"))
+        self.client.get(reverse("cart:get_cart_summary"))
+        response = self.client.get(reverse("perf:profile"))
+
+        self.assertEqual(response["X-Profile-Requests"], "2")
+        self.assertEqual(response["X-Profile-Remaining"], "0")
+        lines = response.content.decode().splitlines()
+        self.assertTrue(lines)
+        for line in lines:
+            self.assertRegex(line, r"^[\w.<>]+:[\w<>]+(;[\w.<>]+:[\w<>]+)* \d+$")
+
+    def test_cprofile_mode(self):
+        self.start(requests=1, mode="cprofile")
+
+        self.client.get(reverse("store:index"))
+        response = self.client.get(reverse("perf:profile"))
+
+        self.assertEqual(response["X-Profile-Requests"], "1")
+        self.assertIn("(render_to_string)", response.content.decode())
+
+    async def test_async_requests_are_profiled(self):
+        await sync_to_async(self.start)(requests=1, mode="cprofile")
+
+        await self.async_client.get(reverse("store:index"))
+        response = await sync_to_async(self.client.get)(reverse("perf:profile"))
+
+        self.assertEqual(response["X-Profile-Requests"], "1")
+        self.assertIn("(render_to_string)", response.content.decode())
+
+    def test_unknown_mode_is_rejected(self):
+        self.assertEqual(self.start(requests=1, mode="strace").status_code, 400)
+
+    def test_interval_is_validated_and_clamped(self):
+        from perf import profiler
+
+        for interval in ("nan", "inf", "fast", ""):
+            self.assertEqual(self.start(requests=1, interval=interval).status_code, 400, interval)
+
+        self.assertEqual(self.start(requests=1, interval="0").json()["session"]["interval"], profiler.MIN_INTERVAL)
+        self.assertEqual(self.start(requests=1, interval="60").json()["session"]["interval"], profiler.MAX_INTERVAL)
+
+
+@override_settings(
+    PERF_PROFILE_DIR=tempfile.mkdtemp(prefix="phoenix-profiles-"),
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+)
+class ProfileQuotaTests(TransactionTestCase):
+    def test_concurrent_claims_never_exceed_the_quota(self):
+        from perf import profiler
+
+        session = profiler.start_session("store:index", 5)
+        workers = 16
+        start = threading.Barrier(workers)
+        claims = []
+
+        def claim():
+            start.wait()
+            try:
+                while True:
+                    try:
+                        claims.append(profiler.claim(session))
+                        return
+                    except OperationalError:  # SQLite: table locked by another writer, try again
+                        time.sleep(random.uniform(0, 0.01))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=claim) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(claims.count(True), 5)
+        self.assertEqual(profiler.remaining(session), 0)
+
+@override_settings(METRICS_ENABLED=True, METRICS_TOKEN="scrape-secret")
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.variant, = make_variants(1)
+        directory = tempfile.mkdtemp(prefix="phoenix-metrics-")
+        self.enterContext(override_settings(METRICS_DIR=directory))
+        self.directory = directory
+
+    def scrape(self):
+        response = self.client.get(reverse("metrics"), headers={"authorization": "Bearer scrape-secret"})
+        self.assertEqual(response["Content-Type"], "text/plain; version=0.0.4; charset=utf-8")
+        return response.content.decode()
+
+    def test_request_and_business_counters(self):
+        self.client.get(reverse("store:index"))
+        self.client.get(reverse("store:index"))
+        self.client.post(
+            reverse("cart:add_to_cart", args=[self.variant.product_id]), {"variant_id": self.variant.id, "quantity": 1}
+        )
+
+        text = self.scrape()
+
+        self.assertIn('http_requests_total{status="2xx",view="store:index"} 2', text)
+        self.assertIn('http_request_duration_seconds_count{view="store:index"} 2', text)
+        self.assertIn('http_request_duration_seconds_bucket{le="+Inf",view="store:index"} 2', text)
+        self.assertRegex(text, r'db_queries_total\{view="store:index"\} [1-9]')
+        self.assertIn("cart_adds_total 1", text)
+        self.assertIn("# TYPE invoice_render_seconds histogram", text)
+
+    async def test_async_requests_are_counted_without_a_thread_hop(self):
+        async def get_response(request):
+            return None
+
+        self.assertTrue(iscoroutinefunction(MetricsMiddleware(get_response)))
+        await self.async_client.get(reverse("store:index"))
+
+        text = await sync_to_async(self.scrape)()
+        self.assertIn('http_requests_total{status="2xx",view="store:index"} 1', text)
+        self.assertRegex(text, r'db_queries_total\{view="store:index"\} [1-9]')
+
+    def test_values_from_every_worker_file_are_summed(self):
+        from perf.metrics import CART_ADDS, ValueFile
+
+        CART_ADDS.inc(2)
+        ValueFile(f"{self.directory}/99999.db").add(CART_ADDS._key("cart_adds_total", {}), 3)
+
+        self.assertIn("cart_adds_total 5", self.scrape())
+
+    def test_files_of_other_containers_with_the_same_pid_are_kept_apart(self):
+        import os
+
+        from perf.metrics import CART_ADDS, ValueFile, process_file
+
+        ValueFile(f"{self.directory}/worker-{os.getpid()}.db").add(CART_ADDS._key("cart_adds_total", {}), 3)
+        CART_ADDS.inc(2)
+
+        self.assertNotEqual(process_file().name, f"worker-{os.getpid()}.db")
+        self.assertIn("cart_adds_total 5", self.scrape())
+
+    def test_value_file_grows_past_initial_size(self):
+        from perf.metrics import ValueFile, read_entries
+
+        with mock.patch.object(ValueFile, "initial_size", 64):
+            values = ValueFile(f"{self.directory}/1.db")
+        for i in range(2000):
+            values.add(f"key-{i}", i)
+
+        with open(f"{self.directory}/1.db", "rb") as fh:
+            entries = {key: value for key, value, _ in read_entries(fh.read())}
+        self.assertEqual(len(entries), 2000)
+        self.assertEqual(entries["key-1999"], 1999)
+
+    def test_anonymous_and_wrong_token_requests_are_refused(self):
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+        response = self.client.get(reverse("metrics"), headers={"authorization": "Bearer guess"})
+        self.assertEqual(response.status_code, 403)
+        self.client.force_login(User.objects.create_user("shopper@phoenix.test", "pw-12345!"))
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+
+    @override_settings(METRICS_TOKEN="")
+    def test_staff_can_read_without_a_token(self):
+        self.assertEqual(self.client.get(reverse("metrics"), headers={"authorization": "Bearer "}).status_code, 403)
+        self.client.force_login(User.objects.create_user("ops@phoenix.test", "pw-12345!", is_staff=True))
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 200)
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_disabled_by_default(self):
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 404)
@@ -0,0 +1,8 @@
+from django.urls import path
+from perf import views
+
+app_name = 'perf'
+
+urlpatterns = [
+    path('profile/', views.profile, name='profile'),
+]
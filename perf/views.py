@@ -0,0 +1,53 @@
+from django.contrib.auth.decorators import login_required
+from django.http import Http404, HttpResponse, JsonResponse
+
+from perf import metrics, profiler
+
+
+@login_required
+def profile(request):
+    """
+    Staff-only control of ``perf.profiler`` sessions.
+
+    POST ``route=order:confirm_order&requests=50[&mode=sample|cprofile][&interval=0.005]``
+    starts a session (the sampling interval is clamped to 1 ms - 1 s) (``action=stop`` ends it); GET returns the merged output so far.
+    """
+    if not request.user.is_staff:
+        return HttpResponse("Unauthorized to profile this site.", status=403)
+
+    if request.method == "POST":
+        if request.POST.get("action") == "stop":
+            return JsonResponse({"success": True, "session": profiler.stop_session()})
+        route = request.POST.get("route", "").strip()
+        if not route:
+            return JsonResponse({"success": False, "message": "A route (URL name) is required."}, status=400)
+        try:
+            session = profiler.start_session(
+                route,
+                int(request.POST.get("requests", 20)),
+                mode=request.POST.get("mode", "sample"),
+                interval=request.POST.get("interval", 0.005),
+            )
+        except ValueError as e:
+            return JsonResponse({"success": False, "message": str(e)}, status=400)
+        return JsonResponse({"success": True, "session": session})
+
+    session = profiler.current_session()
+    if session is None:
+        return HttpResponse("No profiling session.", status=404, content_type="text/plain")
+    output, profiled = profiler.collect(session)
+    response = HttpResponse(output, content_type="text/plain; charset=utf-8")
+    response["X-Profile-Route"] = session["route"]
+    response["X-Profile-Mode"] = session["mode"]
+    response["X-Profile-Requests"] = profiled
+    response["X-Profile-Remaining"] = profiler.remaining(session)
+    return response
+
+
+def export_metrics(request):
+    """``perf.metrics`` in the Prometheus text format, summed over every worker."""
+    if not metrics.enabled():
+        raise Http404("Metrics are disabled.")
+    if not metrics.scrape_allowed(request):
+        return HttpResponse("Unauthorized to read metrics.", status=403)
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
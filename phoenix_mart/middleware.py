@@ -0,0 +1,145 @@
+# phoenix_mart/middleware.py
+"""
+Response compression for pages and JSON: brotli when the browser accepts
+it, gzip otherwise.
+
+Only text formats are compressed (``COMPRESSIBLE_TYPES``), and only
+bodies of at least ``COMPRESSION_MIN_SIZE`` bytes. Everything else goes
+out as it is: PDFs, images, responses that are already encoded
+(WhiteNoise's precompressed static files) and ``Cache-Control:
+no-transform``. Live stock (``text/event-stream``) is also skipped,
+because a compressor would hold events back in its buffer. Other
+streaming responses are compressed chunk by chunk, and every chunk is
+flushed as it is produced.
+
+BREACH: a page that carries this visitor's CSRF token is only gzipped,
+with Django's random-length gzip filename (the ``GZipMiddleware``
+mitigation), so its compressed length leaks nothing stable. The token is
+also masked differently in every response. Brotli is kept for responses
+without a token, such as the anonymous page served from
+``store.pagecache`` and the cart JSON.
+
+Place it after ``CsrfViewMiddleware``. It runs on the response first,
+while it can still tell whether the view used the token.
+"""
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+from django.utils.text import compress_sequence, compress_string
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only without it
+    brotli = None
+
+COMPRESSIBLE_TYPES = {
+    "application/javascript",
+    "application/json",
+    "application/xml",
+    "image/svg+xml",
+    "text/css",
+    "text/csv",
+    "text/html",
+    "text/javascript",
+    "text/plain",
+    "text/xml",
+}
+BROTLI_QUALITY = 5  # per response, so favour speed; static files are precompressed at 11
+
+re_accepts_br = _lazy_re_compile(r"\bbr\b")
+re_accepts_gzip = _lazy_re_compile(r"\bgzip\b")
+re_no_transform = _lazy_re_compile(r"\bno-transform\b")
+
+
+def min_size():
+    return getattr(settings, "COMPRESSION_MIN_SIZE", 512)
+
+
+def _brotli_sequence(sequence):
+    compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+    for chunk in sequence:
+        data = compressor.process(chunk) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+async def _abrotli_sequence(sequence):
+    compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+    async for chunk in sequence:
+        data = compressor.process(chunk) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+async def _agzip_sequence(sequence, max_random_bytes):
+    async for chunk in sequence:
+        yield compress_string(chunk, max_random_bytes=max_random_bytes)
+
+
+class CompressionMiddleware(GZipMiddleware):
+    async def __acall__(self, request):
+        # MiddlewareMixin would run process_response in a thread; it only
+        # touches the response, so under ASGI it runs on the event loop
+        response = await self.get_response(request)
+        return self.process_response(request, response)
+
+    def process_response(self, request, response):
+        if not self.compressible(response):
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        encoding = self.encoding(request)
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            # Read streaming_content once; it may be replaced later
+            content = response.streaming_content
+            if encoding == "br":
+                sequence = _abrotli_sequence if response.is_async else _brotli_sequence
+                response.streaming_content = sequence(content)
+            elif response.is_async:
+                response.streaming_content = _agzip_sequence(content, self.max_random_bytes)
+            else:
+                response.streaming_content = compress_sequence(content, max_random_bytes=self.max_random_bytes)
+            # The compressed size isn't known until it has been streamed
+            del response.headers["Content-Length"]
+        else:
+            if encoding == "br":
+                compressed = brotli.compress(response.content, quality=BROTLI_QUALITY)
+            else:
+                compressed = compress_string(response.content, max_random_bytes=self.max_random_bytes)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers["Content-Length"] = str(len(compressed))
+
+        # The encoded bytes differ, so a strong ETag becomes weak (RFC 9110 8.8.1)
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = "W/" + etag
+        response.headers["Content-Encoding"] = encoding
+        return response
+
+    def compressible(self, response):
+        if response.has_header("Content-Encoding"):
+            return False
+        if not response.streaming and len(response.content) < min_size():
+            return False
+        content_type = response.get("Content-Type", "").split(";")[0].strip().lower()
+        if content_type not in COMPRESSIBLE_TYPES:
+            return False
+        return not re_no_transform.search(response.get("Cache-Control", ""))
+
+    def encoding(self, request):
+        accept = request.META.get("HTTP_ACCEPT_ENCODING", "")
+        # CsrfViewMiddleware clears this flag on the way out, hence the placement after it
+        carries_token = request.META.get("CSRF_COOKIE_NEEDS_UPDATE", False)
+        if brotli is not None and not carries_token and re_accepts_br.search(accept):
+            return "br"
+        if re_accepts_gzip.search(accept):
+            return "gzip"
+        return None
@@ -0,0 +1,118 @@
+# phoenix_mart/sessions.py
+"""
+Session engine: signed cookies for anonymous visitors, ``cached_db`` once
+somebody logs in.
+
+Anonymous traffic (browsing, session guest carts, buy-now) never reads or
+writes ``django_session``: the whole session rides in a signed - not
+encrypted - cookie, exactly like
+``django.contrib.sessions.backends.signed_cookies``. When the session gains
+an authenticated user it moves to ``cached_db`` under a fresh key, so
+logged-in sessions can still be revoked server side.
+
+Enable with ``SESSION_ENGINE=phoenix_mart.sessions``. Anonymous session keys
+change on every write, so pair it with ``cart.storage.SessionCartStorage``.
+The ``a``-prefixed methods mirror the sync ones for async views.
+"""
+from django.contrib.auth import SESSION_KEY
+from django.contrib.sessions.backends import cached_db
+from django.core import signing
+
+
+class SessionStore(cached_db.SessionStore):
+    salt = "phoenix_mart.sessions"
+
+    @staticmethod
+    def _is_signed(session_key):
+        # Database keys are plain [a-z0-9]; signing.dumps() output contains ":"
+        return bool(session_key) and ":" in session_key
+
+    def _holds_user(self):
+        return SESSION_KEY in self._session
+
+    async def _aholds_user(self):
+        return SESSION_KEY in await self._aget_session()
+
+    def _load_signed(self):
+        try:
+            return signing.loads(
+                self.session_key,
+                serializer=self.serializer,
+                max_age=self.get_session_cookie_age(),
+                salt=self.salt,
+            )
+        except (signing.BadSignature, ValueError):
+            self._session_key = None
+            return {}
+
+    def _sign(self):
+        self._session_key = signing.dumps(
+            self._session, compress=True, salt=self.salt, serializer=self.serializer
+        )
+
+    def load(self):
+        if not self._is_signed(self.session_key):
+            return super().load()
+        return self._load_signed()
+
+    def exists(self, session_key):
+        if self._is_signed(session_key):
+            return False
+        return super().exists(session_key)
+
+    def create(self):
+        if self._holds_user():
+            super().create()
+        else:
+            # The key is derived from the data when the session is saved
+            self._session_key = None
+            self.modified = True
+
+    def save(self, must_create=False):
+        if self._holds_user():
+            if self._is_signed(self.session_key):
+                self._session_key = None  # first save after login: move to the database
+            return super().save(must_create=must_create)
+        self._sign()
+
+    def delete(self, session_key=None):
+        if session_key is None:
+            session_key = self.session_key
+        if self._is_signed(session_key):
+            self._session_key = None
+            self._session_cache = {}
+            return
+        super().delete(session_key)
+
+    async def aload(self):
+        if not self._is_signed(self.session_key):
+            return await super().aload()
+        return self._load_signed()
+
+    async def aexists(self, session_key):
+        if self._is_signed(session_key):
+            return False
+        return await super().aexists(session_key)
+
+    async def acreate(self):
+        if await self._aholds_user():
+            await super().acreate()
+        else:
+            self._session_key = None
+            self.modified = True
+
+    async def asave(self, must_create=False):
+        if await self._aholds_user():
+            if self._is_signed(self.session_key):
+                self._session_key = None
+            return await super().asave(must_create=must_create)
+        self._sign()
+
+    async def adelete(self, session_key=None):
+        if session_key is None:
+            session_key = self.session_key
+        if self._is_signed(session_key):
+            self._session_key = None
+            self._session_cache = {}
+            return
+        await super().adelete(session_key)
@@ -40,20 +40,26 @@ INSTALLED_APPS = [
     'order',
     'sweetify',
     'users',
+    'perf',
+    'tasks',
     'social_django',
     'django.contrib.sites',
 ]
 
 MIDDLEWARE = [
+    'perf.middleware.PerformanceMiddleware',
+    'perf.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
+    'phoenix_mart.middleware.CompressionMiddleware',  # after CSRF, see its docstring
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'social_django.middleware.SocialAuthExceptionMiddleware',
+    'perf.middleware.ProfilingMiddleware',  # keep last, see its docstring
 ]
 
 ROOT_URLCONF = 'phoenix_mart.urls'
@@ -102,6 +108,17 @@ LOGIN_REDIRECT_URL = '/'
 
 SITE_ID = 1
 
+# Where anonymous/guest carts live until login or checkout (see cart/storage.py).
+# "cart.storage.DatabaseCartStorage" keeps the old one-Cart-row-per-session behaviour.
+CART_GUEST_STORAGE = os.getenv("CART_GUEST_STORAGE", "cart.storage.SessionCartStorage")
+
+# Guest carts untouched for this long are removed by `manage.py purge_guest_carts`
+GUEST_CART_TTL_DAYS = int(os.getenv("GUEST_CART_TTL_DAYS", "14"))
+
+# Cart lines hold their stock this many seconds after they last changed (store/stock.py);
+# `manage.py release_stock_reservations` gives expired holds back
+STOCK_RESERVATION_TTL = int(os.getenv("STOCK_RESERVATION_TTL", str(15 * 60)))
+
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
@@ -120,6 +137,103 @@ DATABASES = {
     }
 }
 
+# Cache shared by every worker and container (sessions, page/fragment caches).
+# docker-compose points REDIS_URL at its redis service. Without it (local development)
+# a FileBasedCache on this host is used. Every set lists the whole cache directory to
+# decide whether to cull, so the cap stays small; raising it makes every write slower.
+if os.getenv("REDIS_URL"):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv("REDIS_URL"),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.getenv("CACHE_LOCATION", "/var/tmp/phoenix_mart_cache"),
+            # Django's default of 300 entries would cull product cards (two entries per
+            # product, store/fragments.py) and sessions of even a development catalog
+            'OPTIONS': {'MAX_ENTRIES': int(os.getenv("CACHE_MAX_ENTRIES", "2000"))},
+        }
+    }
+
+# Anonymous visitors share one cached storefront page for up to this many seconds
+# (store/pagecache.py); catalog edits retire it sooner. 0 renders every request.
+PAGE_CACHE_TTL = int(os.getenv("PAGE_CACHE_TTL", "300"))
+
+# Rendered product cards (store/fragments.py) are kept this long; editing a product or
+# one of its variants re-renders just that card sooner
+FRAGMENT_CACHE_TTL = int(os.getenv("FRAGMENT_CACHE_TTL", str(24 * 60 * 60)))
+
+# Pages and JSON smaller than this many bytes go out uncompressed (phoenix_mart/middleware.py)
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "512"))
+
+# Sessions are read through the cache and only written to django_session.
+# "phoenix_mart.sessions" keeps anonymous sessions in signed cookies instead.
+SESSION_ENGINE = os.getenv("SESSION_ENGINE", "django.contrib.sessions.backends.cached_db")
+
+# Per-request instrumentation (perf/middleware.py): Server-Timing headers and a JSON
+# log line per request. Off by default; when off the middleware is not loaded at all.
+PERF_INSTRUMENTATION = os.getenv("PERF_INSTRUMENTATION", "False") == "True"
+PERF_SERVER_TIMING = os.getenv("PERF_SERVER_TIMING", "True") == "True"
+# View name -> max queries; requests over budget are logged as warnings.
+# Empty means the budgets the test suite enforces (perf.query_budget.QUERY_BUDGETS).
+PERF_QUERY_BUDGETS = {}
+# Staff-triggered profiling of live workers (/perf/profile/). When off the
+# middleware is not loaded; output is shared between workers through this directory.
+PERF_PROFILER = os.getenv("PERF_PROFILER", "False") == "True"
+PERF_PROFILE_DIR = os.getenv("PERF_PROFILE_DIR", "/tmp/phoenix_mart_profiles")
+
+# Prometheus-style /metrics (perf/metrics.py). Each worker process writes its own
+# file in METRICS_DIR and a scrape sums them. The task worker container records
+# invoice render times, so web and worker must share METRICS_DIR (the
+# phoenix_metrics volume in docker-compose.yml); otherwise /metrics on web never
+# sees them. Scrape the web container directly; don't route /metrics through the
+# public proxy. Scrapes must send
+# "Authorization: Bearer $METRICS_TOKEN" (Prometheus: authorization.credentials);
+# staff can also read it while logged in. Without a token only staff can.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "False") == "True"
+METRICS_DIR = os.getenv("METRICS_DIR", "/tmp/phoenix_mart_metrics")
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# Background tasks (tasks/queue.py) are rows in tasks_task run by `manage.py run_tasks`.
+# Eager mode runs each task in-process as soon as the enqueuing transaction commits.
+TASKS_EAGER = os.getenv("TASKS_EAGER", "False") == "True"
+# Pre-rendered invoice PDFs; shared by the web and worker containers, not publicly served.
+INVOICE_DIR = os.getenv("INVOICE_DIR", os.path.join(BASE_DIR, 'invoices'))
+
+# Outgoing mail. Set EMAIL_BACKEND to the console or file backend in development.
+EMAIL_BACKEND = os.getenv("EMAIL_BACKEND", "django.core.mail.backends.smtp.EmailBackend")
+EMAIL_HOST = os.getenv("EMAIL_HOST", "localhost")
+EMAIL_PORT = int(os.getenv("EMAIL_PORT", "25"))
+EMAIL_HOST_USER = os.getenv("EMAIL_HOST_USER", "")
+EMAIL_HOST_PASSWORD = os.getenv("EMAIL_HOST_PASSWORD", "")
+EMAIL_USE_TLS = os.getenv("EMAIL_USE_TLS", "False") == "True"
+EMAIL_FILE_PATH = os.getenv("EMAIL_FILE_PATH", "/tmp/phoenix_mart_mail")
+DEFAULT_FROM_EMAIL = os.getenv("DEFAULT_FROM_EMAIL", "Phoenix Mart <orders@phoenixmart.local>")
+# Order emails (order/notifications.py) go out in batches every this many seconds;
+# an order gets at most one status email per throttle period, with the latest status.
+ORDER_EMAIL_BATCH_WINDOW = int(os.getenv("ORDER_EMAIL_BATCH_WINDOW", "60"))
+ORDER_STATUS_EMAIL_THROTTLE = int(os.getenv("ORDER_STATUS_EMAIL_THROTTLE", "900"))
+# How long a used checkout token is honoured (order/idempotency.py): the cache keeps
+# its order so repeat submits are answered without a query, and the CheckoutToken row
+# that holds the claim is deleted after this by purge_guest_carts (compose maintenance)
+CHECKOUT_TOKEN_TTL = int(os.getenv("CHECKOUT_TOKEN_TTL", str(24 * 60 * 60)))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'perf': {'handlers': ['console'], 'level': os.getenv("PERF_LOG_LEVEL", "INFO"), 'propagate': False},
+        'tasks': {'handlers': ['console'], 'level': os.getenv("TASKS_LOG_LEVEL", "INFO"), 'propagate': False},
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -160,6 +274,13 @@ STATICFILES_DIRS = [
 ]
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
+# `manage.py collectstatic` minifies the storefront bundles, hashes every file name and
+# writes .gz/.br copies (phoenix_mart/staticfiles.py); WhiteNoise or nginx serves them
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "phoenix_mart.staticfiles.StorefrontStaticFilesStorage"},
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -0,0 +1,186 @@
+# phoenix_mart/staticfiles.py
+"""
+Static files storage for deployment: minified, content-hashed and
+precompressed storefront bundles.
+
+The storefront's CSS and JavaScript are kept readable in
+``static/storefront/``. ``manage.py collectstatic`` is the build step:
+
+1. ``StorefrontStaticFilesStorage`` minifies the bundles in ``MINIFIED``.
+2. It names every file after its content (``storefront.3f2a9c1b.js``).
+3. WhiteNoise writes ``.gz`` and ``.br`` copies of each.
+
+WhiteNoise (and nginx with ``gzip_static``/``brotli_static`` on
+``STATIC_ROOT``) serves the precompressed copy the browser accepts, and
+serves hashed names with a far-future ``Cache-Control: immutable``. A
+page view then only re-sends the HTML.
+
+Until ``collectstatic`` has run there is no manifest. ``{% static %}``
+then links the unminified sources as they are, which is what local
+development and the test suite use.
+
+The minifiers are deliberately conservative. They drop comments and the
+whitespace that carries no meaning, and leave strings, template literals
+and regular expressions untouched. JavaScript keeps its line breaks, so
+automatic semicolon insertion sees the same code.
+"""
+import re
+
+from django.core.files.base import ContentFile
+from whitenoise.storage import CompressedManifestStaticFilesStorage
+
+MINIFIED = ("storefront/",)
+
+_CSS_TOKENS = re.compile(
+    r"""("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|(/\*.*?\*/)|(\s*([{};,>])\s*)|(:\s+)|(\s+)""", re.S
+)
+# After these, a "/" starts a regular expression rather than a division
+_REGEX_PRECEDERS = set("(,=:[!&|?{};+-*%<>~^") | {""}
+_KEYWORD_BEFORE_REGEX = re.compile(r"(?:^|[^\w$])(?:return|typeof|case|do|else|in|of|void)$")
+
+
+def minify_css(text):
+    def token(match):
+        string, comment, punctuation, char, colon, space = match.groups()
+        if string:
+            return string
+        if comment:
+            return ""
+        if punctuation:
+            return char
+        if colon:
+            return ":"
+        return " "
+
+    return _CSS_TOKENS.sub(token, text).replace(";}", "}").strip()
+
+
+def minify_js(text):
+    out = []  # output lines
+    line = []
+    i, n = 0, len(text)
+    braces = []  # for each open "${", the brace depth it was opened at
+    depth = 0
+
+    def last_significant():
+        current = "".join(line).rstrip()
+        if current:
+            return current
+        for previous in reversed(out):
+            if previous:
+                return previous
+        return ""
+
+    def regex_allowed():
+        previous = last_significant()
+        if not previous:
+            return True
+        return previous[-1] in _REGEX_PRECEDERS or _KEYWORD_BEFORE_REGEX.search(previous) is not None
+
+    def read_template(start):
+        """Copy a template literal from ``start`` (after the backtick) up to the end or a ``${``."""
+        j = start
+        while j < n:
+            char = text[j]
+            if char == "\\":
+                j += 2
+                continue
+            if char == "`":
+                return j + 1, False
+            if char == "$" and text.startswith("${", j):
+                return j + 2, True
+            j += 1
+        return n, False
+
+    while i < n:
+        char = text[i]
+        if char == "\n":
+            out.append("".join(line).strip())
+            line = []
+            i += 1
+        elif char in " \t\r":
+            j = i
+            while j < n and text[j] in " \t\r":
+                j += 1
+            if line and j < n and text[j] != "\n":
+                line.append(" ")
+            i = j
+        elif text.startswith("//", i):
+            while i < n and text[i] != "\n":
+                i += 1
+        elif text.startswith("/*", i):
+            end = text.find("*/", i + 2)
+            end = n if end < 0 else end + 2
+            if "\n" in text[i:end]:
+                out.append("".join(line).strip())
+                line = []
+            i = end
+        elif char in "'\"":
+            j = i + 1
+            while j < n and text[j] != char:
+                j += 2 if text[j] == "\\" else 1
+            line.append(text[i:j + 1])
+            i = j + 1
+        elif char == "`" or (char == "}" and braces and braces[-1] == depth):
+            if char == "}":
+                braces.pop()
+            end, interpolation = read_template(i + 1)
+            line.append(text[i:end])
+            if interpolation:
+                braces.append(depth)
+            i = end
+        elif char == "/" and regex_allowed():
+            j, in_class = i + 1, False
+            while j < n and text[j] != "\n":
+                if text[j] == "\\":
+                    j += 2
+                    continue
+                if text[j] == "[":
+                    in_class = True
+                elif text[j] == "]":
+                    in_class = False
+                elif text[j] == "/" and not in_class:
+                    break
+                j += 1
+            j += 1
+            while j < n and (text[j].isalnum() or text[j] == "_"):
+                j += 1  # flags
+            line.append(text[i:j])
+            i = j
+        else:
+            if char == "{":
+                depth += 1
+            elif char == "}":
+                depth -= 1
+            line.append(char)
+            i += 1
+    out.append("".join(line).strip())
+    return "\n".join(part for part in out if part) + "\n"
+
+
+def minify(name, text):
+    if name.endswith(".css"):
+        return minify_css(text)
+    if name.endswith(".js"):
+        return minify_js(text)
+    return text
+
+
+class StorefrontStaticFilesStorage(CompressedManifestStaticFilesStorage):
+    def stored_name(self, name):
+        if not self.hashed_files:  # collectstatic hasn't run: link the sources
+            return name
+        return super().stored_name(name)
+
+    def post_process(self, paths, dry_run=False, **options):
+        if not dry_run:
+            for name in list(paths):
+                if name.startswith(MINIFIED) and name.endswith((".css", ".js")):
+                    source_storage, path = paths[name]
+                    with source_storage.open(path) as source:
+                        minified = minify(name, source.read().decode())
+                    self.delete(name)
+                    self._save(name, ContentFile(minified.encode()))
+                    # Hash and compress the minified copy rather than the source
+                    paths[name] = (self, name)
+        yield from super().post_process(paths, dry_run=dry_run, **options)
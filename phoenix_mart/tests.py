@@ -0,0 +1,213 @@
+import gzip
+import json
+import shutil
+import tempfile
+import threading
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+import brotli
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.core.management import call_command
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+
+from cart.tests import make_variants
+from phoenix_mart.middleware import CompressionMiddleware
+from phoenix_mart.staticfiles import minify_css, minify_js
+
+User = get_user_model()
+
+
+@override_settings(
+    SESSION_ENGINE="phoenix_mart.sessions",
+    CART_GUEST_STORAGE="cart.storage.SessionCartStorage",
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+)
+class HybridSessionEngineTests(TestCase):
+    def setUp(self):
+        self.variant, = make_variants(1)
+
+    def add_to_cart(self):
+        return self.client.post(
+            reverse("cart:add_to_cart", args=[self.variant.product_id]),
+            {"variant_id": self.variant.id, "quantity": 2},
+        ).json()
+
+    def test_anonymous_sessions_stay_in_signed_cookie(self):
+        self.add_to_cart()
+        data = self.add_to_cart()
+
+        self.assertEqual(data["cart_total"], "18.00")
+        self.assertIn(":", self.client.cookies["sessionid"].value)
+        self.assertFalse(Session.objects.exists())
+
+    def test_login_moves_session_to_database(self):
+        User.objects.create_user("hybrid@phoenix.test", "pw-12345!")
+        self.add_to_cart()
+
+        self.client.login(username="hybrid@phoenix.test", password="pw-12345!")
+
+        session_key = self.client.cookies["sessionid"].value
+        self.assertNotIn(":", session_key)
+        self.assertTrue(Session.objects.filter(session_key=session_key).exists())
+        self.assertEqual(self.client.get(reverse("cart:get_cart_summary")).status_code, 200)
+        self.assertEqual(self.client.session["_auth_user_id"], str(User.objects.get().pk))
+
+    async def test_async_views_use_signed_cookie_too(self):
+        url = reverse("cart:add_to_cart", args=[self.variant.product_id])
+        await self.async_client.post(url, {"variant_id": self.variant.id, "quantity": 1})
+        data = (await self.async_client.post(url, {"variant_id": self.variant.id, "quantity": 1})).json()
+
+        self.assertEqual(data["cart_total"], "9.00")
+        self.assertIn(":", self.async_client.cookies["sessionid"].value)
+        self.assertFalse(await Session.objects.aexists())
+
+    def test_tampered_cookie_starts_empty_session(self):
+        self.add_to_cart()
+        self.client.cookies["sessionid"] = self.client.cookies["sessionid"].value + "x"
+
+        data = self.add_to_cart()
+
+        self.assertEqual(data["cart_total"], "9.00")
+
+
+class StaticBundleTests(TestCase):
+    def test_minify_css(self):
+        css = '/* note */\n.a > .b ,\n.c:hover {\n  content: "x  /* y */";\n  margin: 0 auto;\n}\n'
+
+        self.assertEqual(minify_css(css), '.a>.b,.c:hover{content:"x  /* y */";margin:0 auto}')
+
+    def test_minify_js_keeps_strings_templates_and_regexes(self):
+        js = (
+            "// comment\n"
+            "    const a = 'it\\'s // not a comment';  /* block */\n"
+            "    const b = `line ${ {x: 1}.x }  //kept\n  too`;\n"
+            "    const c = s.replace(/\\/+/g, '/') / 2;\n"
+        )
+
+        self.assertEqual(minify_js(js), (
+            "const a = 'it\\'s // not a comment';\n"
+            "const b = `line ${ {x: 1}.x }  //kept\n  too`;\n"
+            "const c = s.replace(/\\/+/g, '/') / 2;\n"
+        ))
+
+    def test_collectstatic_builds_hashed_compressed_bundles(self):
+        root = tempfile.mkdtemp(prefix="phoenix-static-")
+        self.addCleanup(shutil.rmtree, root)
+        finders = ["django.contrib.staticfiles.finders.FileSystemFinder"]
+        with override_settings(STATIC_ROOT=root, STATICFILES_FINDERS=finders):
+            call_command("collectstatic", interactive=False, verbosity=0)
+            manifest = json.loads((Path(root) / "staticfiles.json").read_text())["paths"]
+
+        built = Path(root) / manifest["storefront/storefront.js"]
+        self.assertRegex(built.name, r"^storefront\.[0-9a-f]{12}\.js$")
+        self.assertTrue(built.with_name(built.name + ".gz").exists())
+        self.assertTrue(built.with_name(built.name + ".br").exists())
+        source = Path(__file__).resolve().parent.parent / "static/storefront/storefront.js"
+        self.assertLess(built.stat().st_size, source.stat().st_size)
+        self.assertNotIn("// ----", built.read_text())
+
+    def test_storefront_links_bundles_instead_of_inline_assets(self):
+        response = self.client.get(reverse("store:index"))
+
+        self.assertContains(response, "/static/storefront/storefront.css")
+        self.assertContains(response, "/static/storefront/storefront.js")
+        self.assertNotContains(response, "<style>")
+        self.assertNotContains(response, "addEventListener")
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    PAGE_CACHE_TTL=300,
+)
+class CompressionMiddlewareTests(TestCase):
+    def setUp(self):
+        make_variants(2)
+
+    def compress(self, response, accept="br, gzip"):
+        request = RequestFactory().get("/", headers={"accept-encoding": accept})
+        return CompressionMiddleware(lambda request: response)(request)
+
+    def test_anonymous_page_is_brotli_compressed(self):
+        plain = self.client.get(reverse("store:index"))
+        response = self.client.get(reverse("store:index"), headers={"accept-encoding": "gzip, deflate, br"})
+
+        self.assertEqual(response["Content-Encoding"], "br")
+        self.assertIn("Accept-Encoding", response["Vary"])
+        self.assertTrue(response["ETag"].startswith('W/"'))
+        self.assertEqual(brotli.decompress(response.content), plain.content)
+        self.assertLess(len(response.content), len(plain.content) // 4)
+
+    async def test_async_responses_are_compressed_on_the_event_loop(self):
+        body = b"<html>" + b"phoenix " * 500 + b"</html>"
+        threads = []
+        process_response = CompressionMiddleware.process_response
+
+        def record_thread(middleware, request, response):
+            threads.append(threading.get_ident())
+            return process_response(middleware, request, response)
+
+        async def get_response(request):
+            return HttpResponse(body)
+
+        request = RequestFactory().get("/", headers={"accept-encoding": "br"})
+        with mock.patch.object(CompressionMiddleware, "process_response", record_thread):
+            response = await CompressionMiddleware(get_response)(request)
+
+        self.assertEqual(threads, [threading.get_ident()])
+        self.assertEqual(brotli.decompress(response.content), body)
+
+    def test_pages_with_a_csrf_token_are_only_gzipped(self):
+        self.client.force_login(User.objects.create_user("breach@phoenix.test", "pw-12345!"))
+
+        response = self.client.get(reverse("store:index"), headers={"accept-encoding": "br, gzip"})
+
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn(b'name="csrfmiddlewaretoken"', gzip.decompress(response.content))
+
+    def test_small_binary_and_event_stream_responses_are_left_alone(self):
+        cases = [
+            HttpResponse(b"{}", content_type="application/json"),
+            HttpResponse(b"%PDF-1.7" * 1000, content_type="application/pdf"),
+            HttpResponse(b"x" * 5000, content_type="image/png"),
+            StreamingHttpResponse(iter([b"data: {}\n\n"] * 100), content_type="text/event-stream"),
+        ]
+        for response in cases:
+            with self.subTest(response["Content-Type"]):
+                self.assertNotIn("Content-Encoding", self.compress(response))
+
+    def test_streaming_responses_are_compressed_chunk_by_chunk(self):
+        chunks = [f"<p>row {i}</p>".encode() * 50 for i in range(5)]
+        response = self.compress(StreamingHttpResponse(iter(chunks), content_type="text/html"))
+
+        self.assertEqual(response["Content-Encoding"], "br")
+        self.assertNotIn("Content-Length", response)
+        self.assertEqual(brotli.decompress(b"".join(response.streaming_content)), b"".join(chunks))
+
+    def test_gzip_without_brotli_support_and_nothing_without_accept_encoding(self):
+        body = b"<html>" + b"phoenix " * 500 + b"</html>"
+
+        self.assertEqual(self.compress(HttpResponse(body), accept="gzip")["Content-Encoding"], "gzip")
+        self.assertNotIn("Content-Encoding", self.compress(HttpResponse(body), accept=""))
+
+
+class StartupImportTests(TestCase):
+    def test_heavy_modules_are_not_imported_at_worker_boot(self):
+        from perf.management.commands.audit_imports import parse_importtime
+
+        out = StringIO()
+        call_command("audit_imports", "--json", "--limit", "5", stdout=out)
+        results = json.loads(out.getvalue())
+
+        self.assertEqual(results["lazy_loaded_at_boot"], [])
+        self.assertGreater(results["modules"], 100)
+        self.assertEqual(len(results["slowest"]), 5)
+        self.assertEqual(
+            parse_importtime("import time: self [us] | cumulative | imported package\n"
+                             "import time:       120 |        450 |   order.invoices"),
+            [("order.invoices", 120, 450)],
+        )
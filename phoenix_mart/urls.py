@@ -2,6 +2,7 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
+from perf.views import export_metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -9,6 +10,8 @@ urlpatterns = [
     path('cart/', include('cart.urls')),  # Keep store at root
     path('order/', include('order.urls')),  # Keep store at root
     path('users/', include('users.urls')),  # Move users to /users/ path
+    path('perf/', include('perf.urls')),  # staff-only profiling
+    path('metrics', export_metrics, name='metrics'),  # Prometheus scrape target
     path('auth/', include('social_django.urls', namespace='social'))
 ]
 
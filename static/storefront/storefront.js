@@ -0,0 +1,503 @@
+// Storefront page (store/index.html): cart drawer, product cards, checkout modal, live stock.
+// Minified, hashed and compressed by collectstatic (phoenix_mart/staticfiles.py).
+
+document.addEventListener('DOMContentLoaded', function() {
+    // Set by store/index.html
+    const config = JSON.parse(document.getElementById('storefront-config').textContent);
+
+    // Constants for all elements
+    const buyNowButtons = document.querySelectorAll('.buy-now-btn');
+    const addToCartButtons = document.querySelectorAll('.add-to-cart-btn');
+    const checkoutModal = new bootstrap.Modal(document.getElementById('checkoutModal'));
+    const checkoutForm = document.getElementById('checkoutForm');
+    const checkoutSummary = document.getElementById('checkoutSummary');
+    const loginModal = new bootstrap.Modal(document.getElementById('loginModal'));
+
+    // Cart Sidebar elements
+    const cartSidebar = document.getElementById("cartSidebar");
+    const cartBackdrop = document.getElementById("cartBackdrop");
+    const closeCartBtn = document.getElementById("closeCart");
+    const cartItemsWrap = document.querySelector(".cart-items");
+    const cartIcons = document.querySelectorAll(".cart-icon");
+    const sidebarCheckoutBtn = document.getElementById("sidebarCheckoutBtn");
+
+    // NEW: Get references to the hidden fields in the checkout modal (from checkout.html)
+    const checkoutVariantIdInput = document.getElementById('checkout_variant_id');
+    const checkoutQuantityInput = document.getElementById('checkout_quantity');
+
+
+    // CSRF helper function
+    function getCookie(name) {
+        let cookieValue = null;
+        if (document.cookie && document.cookie !== "") {
+            const cookies = document.cookie.split(";");
+            for (let cookie of cookies) {
+                cookie = cookie.trim();
+                if (cookie.startsWith(name + "=")) {
+                    cookieValue = decodeURIComponent(cookie.substring(name.length + 1));
+                    break;
+                }
+            }
+        }
+        return cookieValue;
+    }
+
+    // ---- Refresh Cart UI ----
+    function refreshCart(data) {
+      // Failed batches also carry the cart as it stands, which undoes the rejected edits
+      if (data.cart_html !== undefined) {
+        document.getElementById("cart-count").textContent = data.cart_count;
+        const footerTotal = document.querySelector(".cart-footer p");
+        if (footerTotal) {
+          footerTotal.textContent = `Total: £${data.cart_total}`;
+        }
+        // Temporarily disable listeners to avoid duplicates
+        // We use a different approach now, attaching them after the change
+        cartItemsWrap.innerHTML = data.cart_html;
+      }
+    }
+
+    // ---- Batched cart changes ----
+    // Quantity edits and removals are queued and posted together to cart:batch_update once the
+    // shopper pauses, instead of one request (and one cart re-render) per +/- tap.
+    const CART_BATCH_DELAY = 400;  // ms
+    let queuedCartOperations = new Map();  // one per cart line; the latest edit wins
+    let queuedCartCallbacks = [];
+    let cartBatchTimer = null;
+    let cartBatchInFlight = Promise.resolve();
+
+    function queueCartOperation(operation, callback) {
+        queuedCartOperations.set(String(operation.item_id), operation);
+        if (callback) {
+            queuedCartCallbacks.push(callback);
+        }
+        clearTimeout(cartBatchTimer);
+        cartBatchTimer = setTimeout(sendCartOperations, CART_BATCH_DELAY);
+    }
+
+    function sendCartOperations() {
+        const operations = Array.from(queuedCartOperations.values());
+        const callbacks = queuedCartCallbacks;
+        queuedCartOperations = new Map();
+        queuedCartCallbacks = [];
+        // One batch at a time, so the server applies them in the order they were made
+        cartBatchInFlight = cartBatchInFlight.then(() => fetch(config.urls.batchUpdate, {
+            method: "POST",
+            headers: {
+                "Content-Type": "application/json",
+                "X-CSRFToken": getCookie("csrftoken"),
+            },
+            body: JSON.stringify({ operations: operations }),
+        })
+        .then(res => res.json())
+        .then(data => {
+            if (!data.success) {
+                Swal.fire('Error', data.message || 'Unable to update cart.', 'error');
+            }
+            // Newer edits are already queued: don't overwrite them with this response
+            if (queuedCartOperations.size === 0) {
+                refreshCart(data);
+            }
+            callbacks.forEach(callback => callback(data));
+        })
+        .catch(err => console.error("Error updating cart:", err)));
+    }
+    window.queueCartOperation = queueCartOperation;
+
+    // ---- Handle Quantity Updates in Checkout Modal ----
+    function attachQuantityListeners() {
+        const qtyInputs = checkoutSummary.querySelectorAll('.checkout-quantity-input');
+        qtyInputs.forEach(input => {
+            input.addEventListener('change', function() {
+                const itemId = this.dataset.itemId;
+                const newQty = parseInt(this.value);
+                const isBuyNow = this.classList.contains('buy-now-input');
+
+                if (isBuyNow) {
+                    // FIX: Update the hidden quantity field for final submission
+                    if (checkoutQuantityInput) {
+                        checkoutQuantityInput.value = newQty;
+                    }
+
+                    const lineTotalCell = this.closest('tr').querySelector('.item-line-total');
+                    const unitPriceCell = this.closest('tr').querySelector('td:nth-child(3)');
+                    const unitPrice = parseFloat(unitPriceCell.textContent.replace('£', ''));
+                    const newTotal = (unitPrice * newQty).toFixed(2);
+                    lineTotalCell.textContent = '£' + newTotal;
+
+                    document.getElementById('checkoutTotal').textContent = '£' + newTotal;
+                } else {
+                    // Batched with the drawer's edits; the summary is re-rendered once the batch is applied
+                    queueCartOperation({ op: 'update', item_id: itemId, quantity: newQty || 0 }, function() {
+                        fetch(config.urls.cartSummary)
+                            .then(res => res.json())
+                            .then(summary => {
+                                if (summary.success) {
+                                    checkoutSummary.innerHTML = summary.summary_html;
+                                    document.getElementById('checkout_token').value = summary.checkout_token;
+                                    attachQuantityListeners();
+                                }
+                            });
+                    });
+                }
+            });
+        });
+    }
+
+    // ---- Variant Selection Handler ----
+    const variantSelects = document.querySelectorAll('.variant-select');
+    variantSelects.forEach(select => {
+        select.addEventListener('change', function() {
+            const productId = this.dataset.productId;
+            const selectedOption = this.options[this.selectedIndex];
+            const price = selectedOption.dataset.price;
+            const variantName = selectedOption.dataset.name;
+            const variantDescriptionShort = selectedOption.dataset.descriptionShort;
+            const variantDescriptionFull = selectedOption.dataset.descriptionFull;
+            const variantImage = selectedOption.dataset.image;
+
+            // Update price
+            const priceDisplay = document.getElementById(`price-display-${productId}`);
+            if (priceDisplay) {
+                priceDisplay.textContent = `£${price}`;
+            }
+
+            // Update product name
+            const productNameDisplay = document.getElementById(`product-name-${productId}`);
+            if (productNameDisplay && variantName) {
+                productNameDisplay.textContent = variantName;
+            }
+
+            // Update description
+            const productDescriptionDisplay = document.getElementById(`product-description-${productId}`);
+            if (productDescriptionDisplay) {
+                const shortSpan = productDescriptionDisplay.querySelector('.description-short');
+                const fullSpan = productDescriptionDisplay.querySelector('.description-full');
+                const seeMoreBtn = productDescriptionDisplay.querySelector('.see-more-btn');
+
+                if (shortSpan && fullSpan) {
+                    shortSpan.textContent = variantDescriptionShort || "No description available";
+                    fullSpan.textContent = variantDescriptionFull || "No description available";
+
+                    // Show/hide see more button based on description length
+                    if (seeMoreBtn && variantDescriptionFull && variantDescriptionFull.split(' ').length > 12) {
+                        seeMoreBtn.style.display = 'inline';
+                        seeMoreBtn.textContent = 'See more';
+                    } else if (seeMoreBtn) {
+                        seeMoreBtn.style.display = 'none';
+                    }
+                }
+            }
+
+            // Update image
+            const productImageDisplay = document.getElementById(`product-image-${productId}`);
+            if (productImageDisplay && variantImage) {
+                productImageDisplay.src = variantImage;
+            }
+        });
+    });
+
+    // ---- Live stock (Server-Sent Events from store:stock_events) ----
+    // Each event carries {variant_id: {available, in_stock}} for the variants that changed;
+    // the first one is the state of every variant, so the page catches up on connect.
+    function syncProductActions(select) {
+        const form = select.closest('form');
+        const selectedOption = select.options[select.selectedIndex];
+        const soldOut = !selectedOption || selectedOption.disabled;
+        form.querySelectorAll('.add-to-cart-btn, .buy-now-btn').forEach(btn => {
+            btn.disabled = soldOut;
+        });
+        const quantityInput = form.querySelector('input[name="quantity"]');
+        if (selectedOption && selectedOption.dataset.available !== undefined) {
+            quantityInput.max = selectedOption.dataset.available;
+        }
+    }
+
+    variantSelects.forEach(select => {
+        select.addEventListener('change', () => syncProductActions(select));
+    });
+
+    if (window.EventSource) {
+        const stockEvents = new EventSource(config.urls.stockEvents);
+        stockEvents.addEventListener('stock', function(e) {
+            const changes = JSON.parse(e.data);
+            const touched = new Set();
+            Object.entries(changes).forEach(([variantId, state]) => {
+                document.querySelectorAll(`.variant-select option[value="${variantId}"]`).forEach(option => {
+                    if (option.dataset.label === undefined) {
+                        option.dataset.label = option.textContent.trim();
+                    }
+                    option.dataset.available = state.available;
+                    option.disabled = !state.in_stock;
+                    option.textContent = state.in_stock ? option.dataset.label : `${option.dataset.label} (sold out)`;
+                    touched.add(option.closest('select'));
+                });
+            });
+            touched.forEach(select => {
+                // Move off a variant that just sold out if the product still has one in stock
+                const selectedOption = select.options[select.selectedIndex];
+                if (selectedOption && selectedOption.disabled) {
+                    const next = Array.from(select.options).find(option => !option.disabled);
+                    if (next) {
+                        select.value = next.value;
+                        select.dispatchEvent(new Event('change'));
+                    }
+                }
+                syncProductActions(select);
+            });
+        });
+    }
+
+    // ---- Buy Now Button Click (FIXED LOGIC) ----
+    buyNowButtons.forEach(button => {
+        button.addEventListener('click', function(e) {
+            e.preventDefault();
+            const isAuthenticated = config.isAuthenticated;
+            if (!isAuthenticated) {
+                loginModal.show();
+                return;
+            }
+            const form = this.closest('form');
+            const quantity = form.querySelector('input[name="quantity"]').value;
+            const variantId = form.querySelector('select[name="variant_id"]').value;
+            const productId = this.dataset.productId;
+
+            // FIX 1: Set the hidden fields in the checkout form for POST submission
+            // These values are read by the confirm_order view on form submit.
+            if (checkoutVariantIdInput && checkoutQuantityInput) {
+                checkoutVariantIdInput.value = variantId;
+                checkoutQuantityInput.value = quantity;
+            }
+
+            // FIX 2: Set the action URL to the correct confirmation endpoint, 
+            // removing the unnecessary query parameter.
+            checkoutForm.action = config.urls.confirmOrder;
+
+            // This AJAX call renders the summary HTML inside the modal
+            fetch(`/buy-now/${productId}/`, {
+                method: 'POST',
+                headers: {
+                    'X-CSRFToken': getCookie('csrftoken'),
+                    'Content-Type': 'application/x-www-form-urlencoded',
+                },
+                body: new URLSearchParams({ 
+                    quantity: quantity,
+                    variant_id: variantId
+                })
+            })
+            .then(res => res.json())
+            .then(data => {
+                if (data.success) {
+                    checkoutSummary.innerHTML = data.summary_html;
+                    document.getElementById('checkout_token').value = data.checkout_token;
+                    checkoutModal.show();
+                    attachQuantityListeners();
+                } else {
+                    Swal.fire('Error', data.message || 'Unable to start Buy Now.', 'error');
+                }
+            })
+            .catch(err => console.error('Buy Now error:', err));
+        });
+    });
+
+    // ---- Add to Cart Button Click ----
+    addToCartButtons.forEach(button => {
+        button.addEventListener('click', function(e) {
+            e.preventDefault();
+            const isAuthenticated = config.isAuthenticated;
+            if (!isAuthenticated) {
+                loginModal.show();
+                return;
+            }
+            const form = this.closest('form');
+            const quantity = form.querySelector('input[name="quantity"]').value;
+            const variantId = form.querySelector('select[name="variant_id"]').value;
+            const productId = this.dataset.productId;
+
+            fetch(form.action, {
+                method: 'POST',
+                headers: {
+                    'X-CSRFToken': getCookie('csrftoken'),
+                    'Content-Type': 'application/x-www-form-urlencoded',
+                },
+                body: new URLSearchParams({ 
+                    quantity: quantity,
+                    variant_id: variantId
+                })
+            })
+            .then(res => res.json())
+            .then(data => {
+                if (data.success) {
+                    Swal.fire({
+                        icon: 'success',
+                        title: 'Added to cart!',
+                        text: 'Your product has been added successfully.',
+                        toast: true,
+                        position: 'top-end',
+                        showConfirmButton: false,
+                        showCloseButton: true,
+                        timer: 3000
+                    });
+                    refreshCart(data);
+                } else {
+                    Swal.fire('Error', data.message || 'Unable to add to cart.', 'error');
+                }
+            })
+            .catch(err => console.error('Add to Cart error:', err));
+        });
+    });
+
+    // ---- Cart Sidebar Listeners ----
+    // Delegated on the sidebar container, which refreshCart() keeps, so they are attached once.
+    cartItemsWrap.addEventListener("change", function(e) {
+        if (e.target.classList.contains("quantity-input")) {
+            const itemId = e.target.closest(".cart-item").dataset.itemId;
+            queueCartOperation({ op: "update", item_id: itemId, quantity: parseInt(e.target.value) || 0 });
+        }
+    });
+
+    cartItemsWrap.addEventListener("click", function(e) {
+        const removeBtn = e.target.closest(".remove-item");
+        if (removeBtn) {
+            const cartItem = removeBtn.closest(".cart-item");
+            cartItem.classList.add("d-none");  // gone right away; the batch response confirms it
+            queueCartOperation({ op: "remove", item_id: cartItem.dataset.itemId });
+        }
+    });
+
+    // ---- See More/Show Less Functionality ----
+    document.addEventListener('click', function(e) {
+        if (e.target.classList.contains('see-more-btn')) {
+            e.preventDefault();
+            const productId = e.target.dataset.productId;
+            const shortSpan = document.getElementById(`description-short-${productId}`);
+            const fullSpan = document.getElementById(`description-full-${productId}`);
+            const seeMoreBtn = e.target;
+
+            if (shortSpan && fullSpan && seeMoreBtn) {
+                if (shortSpan.style.display !== 'none') {
+                    // Currently showing short, so show full
+                    shortSpan.style.display = 'none';
+                    fullSpan.style.display = 'inline';
+                    seeMoreBtn.textContent = 'Show less';
+                } else {
+                    // Currently showing full, so show short
+                    shortSpan.style.display = 'inline';
+                    fullSpan.style.display = 'none';
+                    seeMoreBtn.textContent = 'See more';
+                }
+            }
+        }
+    });
+
+    // ---- Sidebar Toggle Listeners ----
+    cartIcons.forEach(icon => {
+        icon.addEventListener("click", () => {
+            cartSidebar.classList.add("open");
+            cartBackdrop.style.display = "block";
+        });
+    });
+    closeCartBtn.addEventListener("click", () => {
+        cartSidebar.classList.remove("open");
+        cartBackdrop.style.display = "none";
+    });
+    cartBackdrop.addEventListener("click", () => {
+        cartSidebar.classList.remove("open");
+        cartBackdrop.style.display = "none";
+    });
+
+    // ---- Checkout Button in Sidebar Click ----
+    if (sidebarCheckoutBtn) {
+        sidebarCheckoutBtn.addEventListener('click', function() {
+            // Close the sidebar first
+            cartSidebar.classList.remove("open");
+            cartBackdrop.style.display = "none";
+
+            // Ensure Buy Now fields are cleared for cart checkout
+            if (checkoutVariantIdInput && checkoutQuantityInput) {
+                checkoutVariantIdInput.value = "";
+                checkoutQuantityInput.value = "";
+            }
+
+            checkoutForm.action = config.urls.confirmOrder;
+            fetch('/cart/summary/')
+                .then(res => res.json())
+                .then(data => {
+                    if (data.success) {
+                        checkoutSummary.innerHTML = data.summary_html;
+                        document.getElementById('checkout_token').value = data.checkout_token;
+                        checkoutModal.show();
+                        attachQuantityListeners();
+                    }
+                })
+                .catch(err => console.error('Error fetching cart summary:', err));
+        });
+    }
+
+    if (config.hydrateCart) {
+        // ---- Cart hydration ----
+        // This page came from the shared anonymous page cache: fetch this visitor's cart and CSRF token.
+        fetch(config.urls.cartState, { credentials: "same-origin" })
+            .then(res => res.json())
+            .then(data => {
+                refreshCart(data);
+                document.querySelectorAll('form[method="post" i]').forEach(form => {
+                    let input = form.querySelector('input[name="csrfmiddlewaretoken"]');
+                    if (!input) {
+                        input = document.createElement("input");
+                        input.type = "hidden";
+                        input.name = "csrfmiddlewaretoken";
+                        form.prepend(input);
+                    }
+                    input.value = data.csrf_token;
+                });
+            })
+            .catch(err => console.error('Cart hydration error:', err));
+    }
+});
+
+// ---- Checkout modal (modal/checkout.html) ----
+document.addEventListener("DOMContentLoaded", function () {
+    const checkoutSummary = document.getElementById("checkoutSummary");
+    const checkoutForm = document.getElementById("checkoutForm");
+
+    // --- Access the new hidden fields ---
+    const checkoutVariantIdInput = document.getElementById('checkout_variant_id');
+    const checkoutQuantityInput = document.getElementById('checkout_quantity');
+
+    // --- 1. Cart/Quantity Update Listener ---
+    checkoutSummary.addEventListener("change", function (e) {
+        const input = e.target;
+
+        if (input.classList.contains("checkout-quantity-input")) {
+            const newQuantity = parseInt(input.value);
+
+            // Check if this is a Buy Now item
+            if (input.classList.contains("buy-now-input")) {
+
+                // Update the hidden quantity field for final submission
+                checkoutQuantityInput.value = newQuantity;
+
+                // Get the row elements
+                const row = input.closest('tr');
+                const unitPriceElement = row.querySelector('td:nth-child(3)');
+                const lineTotalElement = row.querySelector('.item-line-total');
+                const totalElement = document.getElementById('checkoutTotal');
+
+                // Extract unit price (e.g., "£10.00")
+                const unitPriceString = unitPriceElement.textContent.replace('£', '');
+                const unitPrice = parseFloat(unitPriceString);
+
+                // Calculate new line total
+                const newLineTotal = newQuantity * unitPrice;
+
+                // Update the visible total
+                lineTotalElement.textContent = '£' + newLineTotal.toFixed(2);
+                totalElement.textContent = '£' + newLineTotal.toFixed(2);
+
+            }
+            // Cart lines are queued by the page's attachQuantityListeners() and sent with the
+            // drawer's edits in one cart:batch_update request
+        }
+    });
+});
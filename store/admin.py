@@ -1,13 +1,23 @@
 from django.utils.safestring import mark_safe
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from django.db import transaction
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.core.validators import validate_email
+from django.db import connections, transaction
+from django.db.models import Sum
+from django.db.models.functions import Upper
+from django.utils.functional import cached_property
 from django.urls import reverse
 from django.utils.html import format_html
 from .models import (
     Category, SubCategory, Product, ProductVariant,
     Order, CustomUser, OrderItem, Address
 )
+from order.exports import export_response
+from order.notifications import status_changed
+from order.tasks import sync_sales_rollup
+from store.stock import restock
 
 # --- User Admin ---
 class CustomUserAdmin(UserAdmin):
@@ -82,7 +92,7 @@ class ProductAdmin(admin.ModelAdmin):
 
 @admin.register(ProductVariant)
 class ProductVariantAdmin(admin.ModelAdmin):
-    list_display = ("product", "subcategory", "price", "stock", "in_stock", "is_active", "preview_image")
+    list_display = ("product", "subcategory", "price", "stock", "reserved", "in_stock", "is_active", "preview_image")
     list_editable = ("price", "stock", "in_stock", "is_active")
     list_filter = ("subcategory", "in_stock", "is_active")
     search_fields = ("product__name", "subcategory__name")
@@ -124,6 +134,28 @@ class OrderItemInline(admin.TabularInline):
     readonly_fields = ['product', 'quantity', 'price']
 
 
+class EstimatedCountPaginator(Paginator):
+    """
+    On PostgreSQL, an unfiltered changelist of a huge table uses the planner's
+    row estimate (pg_class.reltuples) instead of a full COUNT(*).
+    """
+    exact_below = 100_000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [queryset.model._meta.db_table]
+                )
+                row = cursor.fetchone()
+            if row and row[0] >= self.exact_below:
+                return row[0]
+        return super().count
+
+
 # --- 3. Order Admin ---
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
@@ -143,10 +175,21 @@ class OrderAdmin(admin.ModelAdmin):
     list_filter = ['status', 'COD', 'created_at']
     list_editable = ('status',)
     search_fields = ['user__email'] # Removed delivery_address from search if it's unused text field
+    search_help_text = 'Order number, customer email, or the start of an email.'
     readonly_fields = ('invoice_download_link',)
+
+    # Changelist cost stays flat as orders grow: user and address are joined (not
+    # fetched per row), the unfiltered total is not counted a second time, and rows
+    # are ordered and sortable only by indexed columns (see Order.Meta.indexes).
+    list_select_related = ('user', 'address')
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+    ordering = ('-id',)
+    sortable_by = ('id', 'created_at', 'status')
     
     # Use both Inlines
     inlines = [OrderItemInline, AddressInline]
+    actions = ['export_csv', 'export_xlsx']
     
     # Fieldsets: REMOVE the generic 'delivery_address' field
     fieldsets = (
@@ -164,6 +207,15 @@ class OrderAdmin(admin.ModelAdmin):
     
     invoice_download_link.short_description = 'Invoice'
 
+    # Export actions: streamed in chunks (order/exports.py), safe for "select all" on huge tables
+    @admin.action(description='Export selected orders as CSV')
+    def export_csv(self, request, queryset):
+        return export_response(request, queryset, 'csv')
+
+    @admin.action(description='Export selected orders as Excel (XLSX)')
+    def export_xlsx(self, request, queryset):
+        return export_response(request, queryset, 'xlsx')
+
     # Custom column method for the Order LIST view (Change List)
     def full_address(self, obj):
         """Displays formatted address for the list view."""
@@ -178,21 +230,42 @@ class OrderAdmin(admin.ModelAdmin):
     # Custom column method for the Order LIST view (Change List)
     def user_phone(self, obj):
         """Displays phone number from the linked Address model."""
-        return getattr(obj.address, "phone", "—")
+        return getattr(getattr(obj, "address", None), "phone", "—")
     user_phone.short_description = "Phone"
 
+    def get_search_results(self, request, queryset, search_term):
+        # Order numbers and whole emails are index lookups (pk, then UPPER(email) and
+        # order.user_id) instead of the default '%term%' LIKE across every order;
+        # anything else is matched against emails (a prefix, or anywhere for partial
+        # ones like "@gmail.com"), scanning users rather than orders
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        if term.lstrip('#').isdigit():
+            return queryset.filter(pk=int(term.lstrip('#'))), False
+        users = CustomUser.objects.alias(email_upper=Upper('email'))
+        try:
+            validate_email(term)
+        except ValidationError:
+            lookup = 'email_upper__contains' if '@' in term else 'email_upper__startswith'
+        else:
+            lookup = 'email_upper'
+        users = users.filter(**{lookup: term.upper()})
+        return queryset.filter(user__in=users.values('pk')), False
+
     # Override save_model to manage stock when status changes to 'cancelled'
     def save_model(self, request, obj, form, change):
         if change:
             original_obj = Order.objects.get(pk=obj.pk)
             if original_obj.status != 'cancelled' and obj.status == 'cancelled':
                 with transaction.atomic():
-                    for item in obj.items.all():
-                        # Assumes item.product points to the ProductVariant model
-                        variant = item.product 
-                        variant.stock += item.quantity
-                        variant.save(update_fields=['stock'])
+                    # One F() update for the whole order, and live shoppers see the units come back
+                    restock(dict(obj.items.values_list('product_id').annotate(Sum('quantity')).order_by()))
         super().save_model(request, obj, form, change)
+        if change and original_obj.status != obj.status:
+            # Queued, throttled and coalesced per order (order/notifications.py)
+            status_changed(obj)
+            sync_sales_rollup.enqueue(order_id=obj.pk)
 
 
 
@@ -1,35 +1,14 @@
 # in store/context_processors.py
-from cart.models import Cart, CartItem
+from cart.storage import get_cart_storage
 
 def cart_context(request):
-    cart_count = 0
-    cart_items = []
-    cart_total = 0
-    
-    if request.user.is_authenticated and not request.user.is_guest:
-        # For authenticated users
-        try:
-            cart = Cart.objects.get(user=request.user)
-            # Corrected logic: sum the quantities of all items
-            cart_count = sum(item.quantity for item in cart.items.all())
-            cart_items = cart.items.all()
-            cart_total = sum(item.product.price * item.quantity for item in cart_items)
-        except Cart.DoesNotExist:
-            pass
-    else:
-        # For guest users
-        if request.session.session_key:
-            try:
-                cart = Cart.objects.get(session_key=request.session.session_key, is_guest=True)
-                # Corrected logic: sum the quantities of all items
-                cart_count = sum(item.quantity for item in cart.items.all())
-                cart_items = cart.items.all()
-                cart_total = sum(item.product.price * item.quantity for item in cart_items)
-            except Cart.DoesNotExist:
-                pass
-    
+    # Shares the per-request storage with the views, so the cart is only loaded once.
+    # Callables, which templates call on use: pages that don't show the cart (and the
+    # anonymous page of store/pagecache.py, which must not) never load it.
+    storage = get_cart_storage(request)
+
     return {
-        'cart_count': cart_count,
-        'cart_items': cart_items,
-        'cart_total': cart_total
-    }
\ No newline at end of file
+        'cart_count': lambda: sum(item.quantity for item in storage.lines()),
+        'cart_items': storage.lines,
+        'cart_total': storage.total,
+    }
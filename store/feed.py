@@ -0,0 +1,168 @@
+# store/feed.py
+"""
+Live stock for shoppers: an in-process change feed of ``ProductVariant``
+availability, streamed to browsers as Server-Sent Events by
+``store.views.stock_events``.
+
+Code that changes stock calls ``publish(variant_ids)``. That includes
+``take_stock`` at checkout, reservations, order cancellations and admin
+saves (through ``post_save``). The ids are handed to the feed once the
+transaction commits. One hub task on the worker's event loop serves every
+open connection:
+
+* It waits ``COALESCE_WINDOW`` after a change so that a burst (a big order,
+  a bulk admin edit) becomes one read of the affected variants.
+* It sends each connection only the variants whose state changed.
+* Each connection keeps the latest state per variant until it is written
+  out, so a slow client never queues more than one entry per variant.
+* An idle connection is just a waiting coroutine: it costs no thread and
+  no query. A new connection is sent the hub's current state, again
+  without a query.
+
+The feed only hears about changes published in this process. While
+anyone is listening, the hub also re-reads every variant each
+``RESYNC_INTERVAL`` seconds. That picks up changes made by the other
+workers and by ``manage.py release_stock_reservations``.
+"""
+import asyncio
+import contextlib
+import json
+import threading
+
+from django.db import transaction
+
+from store.models import ProductVariant
+
+COALESCE_WINDOW = 0.5
+RESYNC_INTERVAL = 30
+KEEPALIVE_INTERVAL = 15  # comment lines keep proxies from closing idle streams
+RECONNECT_DELAY = 5000  # ms, the EventSource ``retry``
+
+
+def _state(stock, reserved, in_stock, is_active):
+    available = max(stock - reserved, 0) if in_stock and is_active else 0
+    return {"available": available, "in_stock": available > 0}
+
+
+async def _load(variant_ids=None):
+    """``{variant_id: state}`` for ``variant_ids`` (every variant when None)."""
+    variants = ProductVariant.objects.all()
+    if variant_ids is not None:
+        variants = variants.filter(pk__in=variant_ids)
+    rows = variants.values_list("pk", "stock", "reserved", "in_stock", "is_active")
+    return {pk: _state(*row) async for pk, *row in rows}
+
+
+class Subscription:
+    """One open stream: the changes not yet sent to it, latest state per variant."""
+
+    def __init__(self):
+        self._changes = {}
+        self._ready = asyncio.Event()
+
+    def offer(self, changes):
+        self._changes.update(changes)
+        self._ready.set()
+
+    async def changes(self, timeout):
+        """The changes since the last call, or ``{}`` when none came within ``timeout``."""
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return {}
+        self._ready.clear()
+        changes, self._changes = self._changes, {}
+        return changes
+
+
+class StockFeed:
+    def __init__(self):
+        self._lock = threading.Lock()  # guards _pending, which publishing threads add to
+        self._reset(None)
+
+    def _reset(self, loop):
+        self._loop = loop
+        self._subscribers = set()
+        self._pending = set()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._state = None
+
+    def push(self, variant_ids):
+        """Queue a re-read of ``variant_ids``; callable from any thread."""
+        loop = self._loop
+        if loop is None or not self._subscribers:
+            return
+        with self._lock:
+            self._pending.update(variant_ids)
+        try:
+            loop.call_soon_threadsafe(self._wakeup.set)
+        except RuntimeError:  # the loop has closed
+            pass
+
+    @contextlib.asynccontextmanager
+    async def subscribe(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._reset(loop)
+        subscription = Subscription()
+        if self._state is not None:
+            subscription.offer(dict(self._state))
+        self._subscribers.add(subscription)
+        if self._task is None:
+            self._task = loop.create_task(self._run())
+        try:
+            yield subscription
+        finally:
+            self._subscribers.discard(subscription)
+            if not self._subscribers and self._task is not None:
+                self._task.cancel()
+                self._task = None
+                self._state = None
+
+    async def _run(self):
+        variant_ids = None  # start from every variant; that is also the first snapshot
+        while True:
+            state = await _load(variant_ids)
+            known = self._state or {}
+            changed = {pk: row for pk, row in state.items() if known.get(pk) != row}
+            self._state = {**known, **state}
+            if changed:
+                for subscription in self._subscribers:
+                    subscription.offer(changed)
+            variant_ids = await self._next_batch()
+
+    async def _next_batch(self):
+        """The ids published during a coalescing window, or None when it's time to resync."""
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), RESYNC_INTERVAL)
+        except asyncio.TimeoutError:
+            return None
+        await asyncio.sleep(COALESCE_WINDOW)
+        self._wakeup.clear()
+        with self._lock:
+            variant_ids, self._pending = self._pending, set()
+        return variant_ids
+
+
+feed = StockFeed()
+
+
+def publish(variant_ids):
+    """Tell live shoppers that these variants' stock changed, once the transaction commits."""
+    variant_ids = set(variant_ids)
+    if variant_ids:
+        transaction.on_commit(lambda: feed.push(variant_ids))
+
+
+def _event(name, data):
+    return f"event: {name}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+async def event_stream():
+    """The ``text/event-stream`` body: the current state, then changes as they happen."""
+    async with feed.subscribe() as subscription:
+        yield f"retry: {RECONNECT_DELAY}\n\n"
+        while True:
+            changes = await subscription.changes(KEEPALIVE_INTERVAL)
+            yield _event("stock", changes) if changes else ": keep-alive\n\n"
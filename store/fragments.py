@@ -0,0 +1,81 @@
+# store/fragments.py
+"""
+Cached product cards for the storefront.
+
+A card (``store/partials/product_card.html``) looks the same to every
+visitor. It has the variant picker with each variant's price, name,
+description and image, and the add-to-cart and buy-now buttons. So each
+card is rendered once and kept in the default cache under its product's
+*version*. Saving or deleting a product or one of its variants gives that
+product a new version (``store.signals``), and only its card is
+rendered again. Every other card is still served from the cache.
+
+``product_cards`` looks up a whole page of cards in two cache round trips.
+It loads variants only for the cards it has to render. Lookups are
+counted in ``render_cache_lookups_total{cache="product_card"}``.
+"""
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from perf import metrics
+from store.models import ProductVariant
+
+TEMPLATE = "store/partials/product_card.html"
+VERSION_KEY = "fragment:product-version:{}"
+CARD_KEY = "fragment:product-card:{}:{}"
+
+
+def fragment_ttl():
+    return getattr(settings, "FRAGMENT_CACHE_TTL", 24 * 60 * 60)
+
+
+def card_variants():
+    # The card reads product.variants.first / .all and variant.subcategory
+    return Prefetch("variants", queryset=ProductVariant.objects.select_related("subcategory").order_by("id"))
+
+
+def invalidate(product_ids):
+    """Give these products new versions, so their cards are rendered again."""
+    cache.set_many({VERSION_KEY.format(pk): uuid.uuid4().hex for pk in product_ids}, None)
+
+
+def invalidate_on_commit(product_ids):
+    product_ids = set(product_ids)
+    invalidate(product_ids)
+    # Again once committed, or a card rendered from the old rows meanwhile would be kept
+    transaction.on_commit(lambda: invalidate(product_ids))
+
+
+def _versions(product_ids):
+    keys = {pk: VERSION_KEY.format(pk) for pk in product_ids}
+    found = cache.get_many(keys.values())
+    new = {keys[pk]: uuid.uuid4().hex for pk in product_ids if keys[pk] not in found}
+    if new:
+        cache.set_many(new, None)
+    return {pk: found.get(key) or new[key] for pk, key in keys.items()}
+
+
+def product_cards(products):
+    """``{product_id: card HTML}`` for ``products``, rendering only the cards not in the cache."""
+    products = {product.pk: product for product in products}
+    if not products:
+        return {}
+    keys = {pk: CARD_KEY.format(pk, version) for pk, version in _versions(products).items()}
+    cards = cache.get_many(keys.values())
+
+    missing = [product for pk, product in products.items() if keys[pk] not in cards]
+    if missing:
+        prefetch_related_objects(missing, card_variants())
+        rendered = {keys[product.pk]: render_to_string(TEMPLATE, {"product": product}) for product in missing}
+        cache.set_many(rendered, fragment_ttl())
+        cards.update(rendered)
+
+    metrics.CACHE_LOOKUPS.inc(len(products) - len(missing), cache="product_card", result="hit")
+    metrics.CACHE_LOOKUPS.inc(len(missing), cache="product_card", result="miss")
+    return {pk: mark_safe(cards[key]) for pk, key in keys.items()}
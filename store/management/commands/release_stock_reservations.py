@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.stock import SWEEP_BATCH_SIZE, release_expired
+
+
+class Command(BaseCommand):
+    help = "Give the stock held by expired cart reservations back, in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=SWEEP_BATCH_SIZE)
+        parser.add_argument("--every", type=float, default=0,
+                            help="Keep running, sweeping every this many seconds.")
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            released = release_expired(batch_size=options["batch_size"])
+            self.stdout.write(f"Released {released} expired reservations in {time.perf_counter() - started:.2f}s")
+            if not options["every"]:
+                return
+            time.sleep(options["every"])
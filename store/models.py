@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models.functions import Upper
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.utils.translation import gettext_lazy as _
 from order.models import Order, OrderItem
@@ -56,6 +57,10 @@ class CustomUser(AbstractUser):
     class Meta:
         verbose_name = _('User')
         verbose_name_plural = _('Users')
+        indexes = [
+            # Case-insensitive email lookups (email__iexact, OrderAdmin search)
+            models.Index(Upper('email'), name='customuser_email_upper_idx'),
+        ]
     
     def __str__(self):
         return self.email
@@ -107,6 +112,9 @@ class ProductVariant(models.Model):
     image = models.ImageField(upload_to='product_variants/', blank=True, null=True)
     in_stock = models.BooleanField(default=True)
     is_active = models.BooleanField(default=True, help_text="Uncheck to hide this variant from the frontend")
+    # Units held by carts (the sum of this variant's StockReservation rows), kept
+    # current with F() updates by store.stock; never written by save()
+    reserved = models.PositiveIntegerField(default=0, editable=False)
 
     class Meta:
         unique_together = ('product', 'subcategory')  # one variant per subcategory
@@ -114,14 +122,48 @@ class ProductVariant(models.Model):
     def __str__(self):
         return f"{self.product.name} - {self.subcategory.name}"
 
+    @property
+    def available(self):
+        """Available to sell: stock not held by anyone's cart."""
+        return max(self.stock - self.reserved, 0)
+
     def save(self, *args, **kwargs):
         # Check if this is a manual admin save (when in_stock is being explicitly changed)
         # If not, auto-update in_stock based on stock quantity
         if not hasattr(self, '_manual_in_stock_override'):
             self.in_stock = self.stock > 0
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # A stale ``reserved`` would undo reservations made since this row was read
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'reserved'
+            ]
         super().save(*args, **kwargs)
 
 
+class StockReservation(models.Model):
+    """
+    Stock held for one cart line until ``expires_at`` (see ``store.stock``).
+    ``holder`` identifies the cart: ``user:<id>`` or a guest session's token.
+    """
+    holder = models.CharField(max_length=64)
+    variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['holder', 'variant'], name='reservation_holder_variant_uniq'),
+        ]
+        indexes = [
+            # store.stock.release_expired sweeps by expiry
+            models.Index(fields=['expires_at'], name='reservation_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity}x variant #{self.variant_id} for {self.holder}"
+
+
 # Get the custom user model
 User = get_user_model()
 
@@ -0,0 +1,103 @@
+# store/pagecache.py
+"""
+Full-page cache of the storefront for anonymous visitors.
+
+Leave out the cart and the index page is the same for every visitor
+without a logged-in user. Such visitors get a page with an empty cart
+badge and drawer. The browser fills those in after load from
+``cart:cart_state``, which also hands out a CSRF token of the visitor's
+own (the cached HTML carries the one of whoever rendered it). The
+rendered page is kept in the default cache under the current *catalog
+version* and served to the next anonymous visitors without touching the
+database.
+
+Saving or deleting a category, subcategory, product or variant starts a
+new catalog version (``store.signals``), which retires every cached page.
+Pages also expire after ``PAGE_CACHE_TTL`` seconds. That bounds how long
+a product that sold out at checkout (a queryset update, not a save) stays
+listed; live stock (``store.feed``) shows it as sold out in the meantime.
+
+Cached responses carry an ``ETag``, so browsers and an nginx
+``proxy_cache`` that revalidate get a 304. ``X-Accel-Expires`` lets nginx
+keep them for ``PAGE_CACHE_TTL``, while browsers revalidate every time.
+They vary on ``Cookie``, so a shared cache only hands them to other
+cookieless visitors. Visitors with a query string, a logged-in session or
+pending messages always get a fresh render.
+"""
+import uuid
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.contrib.messages.storage.session import SessionStorage
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, set_response_etag
+
+from perf import metrics
+
+VERSION_KEY = "pagecache:catalog-version"
+# Session keys of alerts that the next page shows once (sweetify, django.contrib.messages)
+PENDING_MESSAGE_KEYS = ("sweetify", SessionStorage.session_key)
+
+
+def page_ttl():
+    return getattr(settings, "PAGE_CACHE_TTL", 300)
+
+
+def invalidate():
+    """Start a new catalog version, retiring every cached page."""
+    cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def invalidate_on_commit():
+    invalidate()
+    # Again once committed, or a page rendered from the old rows meanwhile would be kept
+    transaction.on_commit(invalidate)
+
+
+async def _acatalog_version():
+    version = await cache.aget(VERSION_KEY)
+    if version is None:
+        await cache.aadd(VERSION_KEY, uuid.uuid4().hex, None)
+        version = await cache.aget(VERSION_KEY)
+    return version
+
+
+async def acacheable(request):
+    """Whether ``request`` may be answered with the page shared by anonymous visitors."""
+    if page_ttl() <= 0 or request.method != "GET" or request.GET:
+        return False
+    if CookieStorage.cookie_name in request.COOKIES:
+        return False
+    session = request.session
+    for key in (SESSION_KEY, *PENDING_MESSAGE_KEYS):
+        if await session.aget(key) is not None:
+            return False
+    return True
+
+
+async def aserve(request, render):
+    """The cached page for ``request``; on a miss ``await render()`` builds it and it is stored."""
+    ttl = page_ttl()
+    key = f"pagecache:{await _acatalog_version()}:{request.path}"
+    cached = await cache.aget(key)
+    if cached is not None:
+        content, etag = cached
+        response = HttpResponse(content)
+        response["ETag"] = etag
+        response["X-Page-Cache"] = "hit"
+        metrics.CACHE_LOOKUPS.inc(cache="page", result="hit")
+    else:
+        response = await render()
+        if response.status_code != 200:
+            return response
+        set_response_etag(response)
+        await cache.aset(key, (response.content, response["ETag"]), ttl)
+        response["X-Page-Cache"] = "miss"
+        metrics.CACHE_LOOKUPS.inc(cache="page", result="miss")
+
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Expires"] = str(ttl)
+    return get_conditional_response(request, etag=response["ETag"], response=response)
@@ -1,30 +1,64 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.contrib.auth.signals import user_logged_in
 from django.dispatch import receiver
-from cart.models import Cart, CartItem
+from cart.models import Cart
+from cart.storage import DatabaseCartStorage, materialize_guest_cart
+from store import fragments, pagecache
+from store.feed import publish
+from store.models import Category, Product, ProductVariant, SubCategory
+from store.stock import claim_guest_holds
 
 @receiver(user_logged_in)
 def merge_carts(sender, request, user, **kwargs):
-    if request.session.session_key:
-        # Get anonymous cart if exists
-        anonymous_cart = Cart.objects.filter(
-            session_key=request.session.session_key,
-            user__isnull=True
-        ).first()
-        
-        if anonymous_cart:
-            # Get or create user cart
-            user_cart, created = Cart.objects.get_or_create(user=user)
-            
-            # Move items from anonymous to user cart
-            for item in anonymous_cart.items.all():
-                user_item, created = user_cart.items.get_or_create(
-                    product=item.product,
-                    defaults={'quantity': item.quantity}
-                )
-                if not created:
-                    user_item.quantity += item.quantity
-                    user_item.save()
-            
-            # Delete anonymous cart
-            anonymous_cart.delete()
\ No newline at end of file
+    # Session-stored guest carts (cart.storage.SessionCartStorage) become real rows now
+    if not user.is_guest:
+        materialize_guest_cart(request, user)
+        # ...and the stock the guest cart held is now held for the customer's cart
+        claim_guest_holds(request, user)
+
+    # Database guest carts: the session key has already been cycled by login()
+    cart_id = request.session.pop(DatabaseCartStorage.guest_cart_session_key, None)
+    anonymous_cart = Cart.objects.filter(pk=cart_id, user__isnull=True).first() if cart_id else None
+
+    if anonymous_cart:
+        user_cart, created = Cart.objects.get_or_create(user=user)
+        user_cart.merge_with(anonymous_cart)
+
+
+@receiver(post_save, sender=ProductVariant)
+def publish_variant_change(sender, instance, **kwargs):
+    # Admin edits (the variant page, list_editable, product inlines) reach live shoppers too
+    publish([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=SubCategory)
+@receiver(post_delete, sender=SubCategory)
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def retire_cached_pages(sender, **kwargs):
+    # The anonymous storefront page (store/pagecache.py) lists the catalog as it was
+    pagecache.invalidate_on_commit()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def rerender_product_card(sender, instance, **kwargs):
+    fragments.invalidate_on_commit([instance.pk])
+
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def rerender_variant_card(sender, instance, **kwargs):
+    fragments.invalidate_on_commit([instance.product_id])
+
+
+@receiver(post_save, sender=SubCategory)
+def rerender_subcategory_cards(sender, instance, **kwargs):
+    # Cards name each variant by its subcategory
+    fragments.invalidate_on_commit(
+        ProductVariant.objects.filter(subcategory=instance).values_list("product_id", flat=True).distinct()
+    )
@@ -0,0 +1,305 @@
+# store/stock.py
+"""
+Stock reservations and available-to-sell.
+
+Adding to the cart holds stock for that line for ``STOCK_RESERVATION_TTL``
+seconds, so shoppers find out about a stock-out when they add the item
+rather than at the end of checkout. A hold is a ``StockReservation`` row
+per cart (``holder``) and variant. ``ProductVariant.reserved`` is the
+running total of a variant's holds, so ``ProductVariant.available``
+(``stock - reserved``) never sums reservations per request.
+
+Every change to ``reserved`` is a single ``F()`` UPDATE, and a hold only
+grows when ``stock >= reserved + extra`` holds in that same statement.
+Concurrent carts therefore can't reserve more than is in stock. Holds are
+renewed whenever their line changes. ``release_expired`` (run by
+``manage.py release_stock_reservations``) gives expired holds back in bulk,
+and a reservation that finds too little stock first releases that
+variant's expired holds. At checkout ``take_stock`` consumes the
+customer's holds in the same UPDATE that takes the stock, and
+``restock`` puts a cancelled order's units back. All of them publish the
+variants they touched to the live stock feed (``store.feed``).
+"""
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import BooleanField, Case, ExpressionWrapper, F, IntegerField, Q, Value, When
+from django.utils import timezone
+
+from store.feed import publish
+from store.models import ProductVariant, StockReservation
+
+HOLDER_SESSION_KEY = "stock_holder"
+SWEEP_BATCH_SIZE = 1000
+
+
+class NotEnoughStock(Exception):
+    def __init__(self, variant_id, available):
+        super().__init__(f"Only {available} of variant #{variant_id} available")
+        self.variant_id = variant_id
+        self.available = available
+
+
+def reservation_ttl():
+    return timedelta(seconds=getattr(settings, "STOCK_RESERVATION_TTL", 15 * 60))
+
+
+def user_holder(user):
+    return f"user:{user.pk}"
+
+
+def holder(request):
+    """The holder key of this request's cart."""
+    user = request.user
+    if user.is_authenticated and not user.is_guest:
+        return user_holder(user)
+    # Guests get a token in the session; login() keeps session data when it cycles the key
+    token = request.session.get(HOLDER_SESSION_KEY)
+    if token is None:
+        token = request.session[HOLDER_SESSION_KEY] = f"guest:{uuid.uuid4().hex}"
+    return token
+
+
+def _per_variant(quantities):
+    """``Case`` mapping variant ids to ``quantities``, grouped by value so big carts stay cheap to build."""
+    groups = defaultdict(list)
+    for pk, quantity in quantities.items():
+        groups[quantity].append(pk)
+    return Case(
+        *(When(pk__in=pks, then=Value(quantity)) for quantity, pks in groups.items()),
+        default=Value(0), output_field=IntegerField(),
+    )
+
+
+def held(holder, variant_ids):
+    """``{variant_id: quantity}`` held by ``holder``."""
+    return dict(
+        StockReservation.objects.filter(holder=holder, variant_id__in=variant_ids).values_list("variant_id", "quantity")
+    )
+
+
+def available_to(holder, variant_id):
+    """What ``holder`` could have in their cart: the free stock plus their own hold."""
+    stock, reserved = ProductVariant.objects.filter(pk=variant_id).values_list("stock", "reserved").get()
+    own = held(holder, [variant_id]).get(variant_id, 0) if holder is not None else 0
+    return max(stock - reserved, 0) + own
+
+
+def reserve(holder, variant_id, quantity):
+    """
+    Hold ``quantity`` units of the variant for ``holder`` (the whole line, not
+    an increment; 0 releases the hold) and renew it. Raises ``NotEnoughStock``
+    and leaves any existing hold as it was when the stock isn't there.
+    """
+    try:
+        _reserve(holder, variant_id, quantity)
+    except NotEnoughStock:
+        if not release_expired(variant_ids=[variant_id]):
+            raise
+        _reserve(holder, variant_id, quantity)
+    except IntegrityError:
+        # The same cart created this hold concurrently; apply ours on top of it
+        _reserve(holder, variant_id, quantity)
+
+
+def release(holder, variant_id):
+    _reserve(holder, variant_id, 0)
+
+
+def _reserve(holder, variant_id, quantity):
+    with transaction.atomic():
+        hold = StockReservation.objects.select_for_update().filter(holder=holder, variant_id=variant_id).first()
+        extra = quantity - (hold.quantity if hold else 0)
+        counter = ProductVariant.objects.filter(pk=variant_id)
+        if extra > 0:
+            if not counter.filter(stock__gte=F("reserved") + extra).update(reserved=F("reserved") + extra):
+                raise NotEnoughStock(variant_id, available_to(holder, variant_id))
+        elif extra < 0:
+            counter.update(reserved=F("reserved") + extra)
+
+        expires_at = timezone.now() + reservation_ttl()
+        if quantity <= 0:
+            if hold is not None:
+                hold.delete()
+        elif hold is not None:
+            StockReservation.objects.filter(pk=hold.pk).update(quantity=quantity, expires_at=expires_at)
+        else:
+            StockReservation.objects.create(
+                holder=holder, variant_id=variant_id, quantity=quantity, expires_at=expires_at
+            )
+        if extra:
+            publish([variant_id])
+
+
+def reserve_many(holder, quantities):
+    """
+    ``reserve`` for several lines (``{variant_id: quantity}``) in a fixed
+    number of statements. Either every line is held or ``NotEnoughStock``
+    is raised and no hold changes.
+    """
+    try:
+        _reserve_many(holder, quantities)
+    except NotEnoughStock:
+        if not release_expired(variant_ids=list(quantities)):
+            raise
+        _reserve_many(holder, quantities)
+
+
+def _reserve_many(holder, quantities):
+    if not quantities:
+        return
+    with transaction.atomic():
+        current = dict(
+            StockReservation.objects.select_for_update()
+            .filter(holder=holder, variant_id__in=quantities).values_list("variant_id", "quantity")
+        )
+        extra = {pk: quantity - current.get(pk, 0) for pk, quantity in quantities.items()}
+        extra = {pk: delta for pk, delta in extra.items() if delta}
+        if extra:
+            # Shrinking holds always apply; growing ones need the stock, as in _reserve
+            groups = defaultdict(list)
+            for pk, delta in extra.items():
+                groups[max(delta, 0)].append(pk)
+            enough = Q()
+            for delta, pks in groups.items():
+                enough |= Q(pk__in=pks) if not delta else Q(pk__in=pks, stock__gte=F("reserved") + delta)
+            if ProductVariant.objects.filter(enough).update(reserved=F("reserved") + _per_variant(extra)) != len(extra):
+                short = ProductVariant.objects.filter(pk__in=extra).exclude(enough).values_list("pk", flat=True).first()
+                raise NotEnoughStock(short, available_to(holder, short))
+
+        expires_at = timezone.now() + reservation_ttl()
+        StockReservation.objects.bulk_create(
+            [
+                StockReservation(holder=holder, variant_id=pk, quantity=quantity, expires_at=expires_at)
+                for pk, quantity in quantities.items() if quantity > 0
+            ],
+            update_conflicts=True,
+            unique_fields=["holder", "variant"],
+            update_fields=["quantity", "expires_at"],
+        )
+        dropped = [pk for pk, quantity in quantities.items() if quantity <= 0 and pk in current]
+        if dropped:
+            StockReservation.objects.filter(holder=holder, variant_id__in=dropped).delete()
+        publish(extra)
+
+
+async def areserve(request, variant_id, quantity):
+    # holder() may load the session, so it runs in the thread too
+    await sync_to_async(lambda: reserve(holder(request), variant_id, quantity))()
+
+
+async def arelease(request, variant_id):
+    await sync_to_async(lambda: release(holder(request), variant_id))()
+
+
+def transfer(from_holder, to_holder):
+    """Move ``from_holder``'s holds to ``to_holder`` (carts merged at login), adding up shared lines."""
+    with transaction.atomic():
+        moving = dict(
+            StockReservation.objects.select_for_update().filter(holder=from_holder).values_list("variant_id", "quantity")
+        )
+        if not moving:
+            return
+        existing = held(to_holder, moving)
+        expires_at = timezone.now() + reservation_ttl()
+        StockReservation.objects.filter(holder=from_holder).delete()
+        # ``reserved`` is unchanged: the same units are held, by another cart
+        StockReservation.objects.bulk_create(
+            [
+                StockReservation(
+                    holder=to_holder, variant_id=variant_id,
+                    quantity=existing.get(variant_id, 0) + quantity, expires_at=expires_at,
+                )
+                for variant_id, quantity in moving.items()
+            ],
+            update_conflicts=True,
+            unique_fields=["holder", "variant"],
+            update_fields=["quantity", "expires_at"],
+        )
+
+
+def claim_guest_holds(request, user):
+    """At login: the guest cart's holds now belong to the customer's cart."""
+    token = request.session.pop(HOLDER_SESSION_KEY, None)
+    if token is not None:
+        transfer(token, user_holder(user))
+
+
+def release_expired(variant_ids=None, batch_size=SWEEP_BATCH_SIZE):
+    """Give expired holds back to stock in batches; returns the number released."""
+    expired = StockReservation.objects.filter(expires_at__lte=timezone.now())
+    if variant_ids is not None:
+        expired = expired.filter(variant_id__in=variant_ids)
+
+    released = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                expired.select_for_update().order_by("expires_at").values_list("pk", "variant_id", "quantity")[:batch_size]
+            )
+            if not rows:
+                return released
+            per_variant = defaultdict(int)
+            for _, variant_id, quantity in rows:
+                per_variant[variant_id] += quantity
+            ProductVariant.objects.filter(pk__in=per_variant).update(reserved=F("reserved") - _per_variant(per_variant))
+            StockReservation.objects.filter(pk__in=[pk for pk, _, _ in rows]).delete()
+            publish(per_variant)
+        released += len(rows)
+
+
+def take_stock(quantities, holder=None):
+    """
+    Subtract ``{variant_id: quantity}`` from stock with a single UPDATE,
+    consuming ``holder``'s holds on those variants.
+
+    Applied only if every line is covered by stock no other cart holds;
+    otherwise nothing changes and the id of a variant that ran short is
+    returned.
+    """
+    with transaction.atomic():
+        own = held(holder, quantities) if holder is not None else {}
+        groups = defaultdict(list)
+        for pk, quantity in quantities.items():
+            groups[quantity, own.get(pk, 0)].append(pk)
+        enough = Q()
+        for (quantity, own_hold), pks in groups.items():
+            enough |= Q(pk__in=pks, stock__gte=F("reserved") - own_hold + quantity)
+
+        taken = _per_variant(quantities)
+        changes = {
+            "stock": F("stock") - taken,
+            "in_stock": ExpressionWrapper(Q(stock__gt=taken), output_field=BooleanField()),
+        }
+        if own:
+            changes["reserved"] = F("reserved") - _per_variant(own)
+        updated = ProductVariant.objects.filter(enough).update(**changes)
+        if updated == len(quantities):
+            if own:
+                StockReservation.objects.filter(holder=holder, variant_id__in=own).delete()
+            publish(quantities)
+            return None
+        transaction.set_rollback(True)
+    short = ProductVariant.objects.filter(pk__in=quantities).exclude(enough).values_list("pk", flat=True).first()
+    return short if short is not None else next(iter(quantities))
+
+
+def restock(quantities):
+    """
+    Put ``{variant_id: quantity}`` back into stock (a cancelled order) with a
+    single UPDATE.
+
+    ``in_stock`` is only turned back on where selling out cleared it (stock
+    was 0); a variant an admin took off sale by hand stays off.
+    """
+    if not quantities:
+        return
+    ProductVariant.objects.filter(pk__in=quantities).update(
+        stock=F("stock") + _per_variant(quantities),
+        in_stock=Case(When(stock=0, then=Value(True)), default=F("in_stock"), output_field=BooleanField()),
+    )
+    publish(quantities)
@@ -1,3 +1,436 @@
-from django.test import TestCase
+import json
+import random
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.db.models import Sum
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from cart.models import CartItem
+from cart.tests import make_variants
+from order.models import Order
+from perf.loadtest import ADDRESS
+from perf.query_budget import QueryBudgetMixin, seed_order, seed_storefront
+from store import feed, fragments, pagecache, stock
+from store.models import Product, ProductVariant, StockReservation, SubCategory
+
+User = get_user_model()
+
+
+class StoreQueryBudgetTests(QueryBudgetMixin, TestCase):
+    def test_index_for_anonymous_visitor(self):
+        def scenario(size):
+            seed_storefront(size)
+            return lambda: self.client.get(reverse("store:index"))
+
+        self.assertQueriesConstant("store:index", scenario)
+
+    def test_index_for_customer_with_cart(self):
+        def scenario(size):
+            user = User.objects.create_user(f"index-{size}@phoenix.test", "pw-12345!")
+            seed_storefront(size, user=user)
+            self.client.force_login(user)
+            return lambda: self.client.get(reverse("store:index"))
+
+        self.assertQueriesConstant("store:index", scenario)
+
+    def test_buy_now(self):
+        def scenario(size):
+            variant = seed_storefront(size)[-1]
+            url = reverse("store:buy_now", args=[variant.product_id])
+            return lambda: self.client.post(url, {"variant_id": variant.id, "quantity": 1})
+
+        self.assertQueriesConstant("store:buy_now", scenario)
+
+
+class OrderAdminChangelistTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser("admin@phoenix.test", "pw-12345!")
+        self.client.force_login(self.admin)
+
+    def seed_orders(self, size):
+        variants = seed_storefront(1)
+        orders = []
+        for n in range(size):
+            customer = User.objects.create_user(f"customer-{size}-{n}@phoenix.test", "pw-12345!")
+            orders.append(seed_order(customer, variants[:1]))
+        return orders
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        def scenario(size):
+            self.seed_orders(size)
+            return lambda: self.client.get(reverse("admin:order_order_changelist"))
+
+        self.assertQueriesConstant("admin:order_order_changelist", scenario)
+
+    def test_search_by_order_number_email_and_prefix(self):
+        first, second = self.seed_orders(2)
+        url = reverse("admin:order_order_changelist")
+
+        def found(term):
+            return [order.id for order in self.client.get(url, {"q": term}).context["cl"].result_list]
+
+        self.assertEqual(found(f"#{second.id}"), [second.id])
+        self.assertEqual(found("CUSTOMER-2-0@PHOENIX.TEST"), [first.id])
+        self.assertEqual(found("customer-2"), [second.id, first.id])
+        self.assertEqual(found("@phoenix.test"), [second.id, first.id])
+        self.assertEqual(found("2-1@phoenix"), [second.id])
+
+
+@override_settings(CART_GUEST_STORAGE="cart.storage.SessionCartStorage")
+class StockReservationTests(TestCase):
+    def setUp(self):
+        self.variant, self.other = make_variants(2, stock=10)
+        self.customer = User.objects.create_user("holds@phoenix.test", "pw-12345!")
+
+    def add_to_cart(self, quantity, client=None):
+        return (client or self.client).post(
+            reverse("cart:add_to_cart", args=[self.variant.product_id]),
+            {"variant_id": self.variant.id, "quantity": quantity},
+        ).json()
+
+    def assertHeld(self, reserved):
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.reserved, reserved)
+        rows = StockReservation.objects.filter(variant=self.variant).aggregate(total=Sum("quantity"))["total"]
+        self.assertEqual(rows or 0, reserved)
+
+    def test_add_to_cart_holds_stock_and_refuses_more_than_is_available(self):
+        self.assertTrue(self.add_to_cart(6)["success"])
+        self.assertHeld(6)
+
+        shopper = self.client_class()
+        refused = self.add_to_cart(5, client=shopper)
+        self.assertFalse(refused["success"])
+        self.assertEqual(refused["message"], "Sorry, only 4 available.")
+        self.assertTrue(self.add_to_cart(4, client=shopper)["success"])
+        self.assertHeld(10)
+        self.assertEqual(ProductVariant.objects.get(pk=self.variant.pk).available, 0)
+
+    def test_restock_keeps_a_manual_out_of_stock_flag(self):
+        ProductVariant.objects.filter(pk=self.variant.pk).update(in_stock=False)  # taken off sale by an admin
+        ProductVariant.objects.filter(pk=self.other.pk).update(stock=0, in_stock=False)  # sold out
+
+        stock.restock({self.variant.pk: 2, self.other.pk: 3})
+
+        self.assertEqual(ProductVariant.objects.get(pk=self.variant.pk).stock, 12)
+        self.assertFalse(ProductVariant.objects.get(pk=self.variant.pk).in_stock)
+        other = ProductVariant.objects.get(pk=self.other.pk)
+        self.assertEqual((other.stock, other.in_stock), (3, True))
+
+    def test_update_and_remove_adjust_the_hold(self):
+        self.client.force_login(self.customer)
+        self.add_to_cart(2)
+        item = CartItem.objects.get(cart__user=self.customer)
+        update = reverse("cart:update_cart_item", args=[item.id])
+
+        self.client.post(update, json.dumps({"quantity": 7}), content_type="application/json")
+        self.assertHeld(7)
+        refused = self.client.post(update, json.dumps({"quantity": 11}), content_type="application/json").json()
+        self.assertEqual(refused["message"], "Sorry, only 10 available.")
+        self.assertEqual(CartItem.objects.get(pk=item.pk).quantity, 7)
+
+        self.client.post(reverse("cart:remove_cart_item", args=[item.id]))
+        self.assertHeld(0)
+
+    def test_expired_holds_are_released_in_bulk(self):
+        stock.reserve("guest:a", self.variant.id, 4)
+        stock.reserve("guest:b", self.variant.id, 3)
+        stock.reserve("guest:b", self.other.id, 5)
+        stock.reserve("guest:c", self.variant.id, 2)
+        StockReservation.objects.exclude(holder="guest:c").update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        out = StringIO()
+        call_command("release_stock_reservations", "--batch-size", "2", stdout=out)
+        self.assertIn("Released 3 expired reservations", out.getvalue())
+        self.assertHeld(2)
+        self.assertEqual(ProductVariant.objects.get(pk=self.other.pk).reserved, 0)
+
+    def test_expired_holds_give_way_to_new_shoppers(self):
+        stock.reserve("guest:a", self.variant.id, 10)
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertTrue(self.add_to_cart(3)["success"])
+        self.assertHeld(3)
+
+    def test_login_moves_guest_holds_to_the_customer(self):
+        self.add_to_cart(3)
+        stock.reserve(stock.user_holder(self.customer), self.variant.id, 2)
+        self.client.login(username="holds@phoenix.test", password="pw-12345!")
+
+        self.assertEqual(
+            list(StockReservation.objects.values_list("holder", "quantity")),
+            [(stock.user_holder(self.customer), 5)],
+        )
+        self.assertHeld(5)
+
+    def test_checkout_turns_holds_into_a_sale(self):
+        self.client.force_login(self.customer)
+        self.add_to_cart(4)
+        stock.reserve("guest:other", self.variant.id, 6)
+
+        response = self.client.post(reverse("order:confirm_order"), ADDRESS)
+
+        self.assertIn("success", response.url)
+        self.variant.refresh_from_db()
+        self.assertEqual((self.variant.stock, self.variant.reserved), (6, 6))
+        self.assertFalse(StockReservation.objects.filter(holder=stock.user_holder(self.customer)).exists())
+
+    def test_checkout_cannot_take_stock_held_by_other_carts(self):
+        self.client.force_login(self.customer)
+        CartItem.objects.create(cart=self.customer.carts.create(), product=self.variant, quantity=3)
+        stock.reserve("guest:other", self.variant.id, 8)
+
+        self.client.post(reverse("order:confirm_order"), ADDRESS)
+
+        self.variant.refresh_from_db()
+        self.assertEqual((self.variant.stock, self.variant.reserved), (10, 8))
+
+    def test_admin_save_keeps_the_reserved_count(self):
+        stale = ProductVariant.objects.get(pk=self.variant.pk)
+        stock.reserve("guest:a", self.variant.id, 4)
+        stale.stock = 20
+        stale.save()
+        self.variant.refresh_from_db()
+        self.assertEqual((self.variant.stock, self.variant.reserved), (20, 4))
+
+
+class StockReservationConcurrencyTests(TransactionTestCase):
+    def test_concurrent_reservations_never_exceed_stock(self):
+        variant, = make_variants(1, stock=7)
+        shoppers = 16
+        start = threading.Barrier(shoppers)
+        outcomes = []
+
+        def shop(n):
+            start.wait()
+            try:
+                while True:
+                    try:
+                        stock.reserve(f"guest:{n}", variant.id, 2)
+                        outcomes.append(True)
+                        return
+                    except stock.NotEnoughStock:
+                        outcomes.append(False)
+                        return
+                    except OperationalError:  # SQLite: table locked by another writer, try again
+                        time.sleep(random.uniform(0, 0.01))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=shop, args=(n,)) for n in range(shoppers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        variant.refresh_from_db()
+        self.assertEqual(len(outcomes), shoppers)
+        self.assertEqual(outcomes.count(True), 3)  # 3 x 2 of 7 units
+        self.assertEqual(variant.reserved, 6)
+        self.assertEqual(StockReservation.objects.aggregate(total=Sum("quantity"))["total"], 6)
+
+
+class LiveStockFeedTests(TestCase):
+    def setUp(self):
+        self.variant, self.other = make_variants(2, stock=5)
+
+    def changes(self, chunk):
+        name, data = chunk.rstrip("\n").split("\n")
+        self.assertEqual(name, "event: stock")
+        return json.loads(data.removeprefix("data: "))
+
+    def test_streams_over_asgi_only(self):
+        self.assertEqual(self.client.get(reverse("store:stock_events")).status_code, 204)
+
+    async def test_event_stream_response(self):
+        response = await self.async_client.get(reverse("store:stock_events"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        self.assertEqual(response["Cache-Control"], "no-cache")
+
+    @mock.patch("store.feed.COALESCE_WINDOW", 0)
+    async def test_stream_sends_current_stock_then_coalesced_changes(self):
+        stream = feed.event_stream()
+        try:
+            self.assertEqual(await anext(stream), "retry: 5000\n\n")
+            snapshot = self.changes(await anext(stream))
+            self.assertEqual(snapshot[str(self.variant.pk)], {"available": 5, "in_stock": True})
+            self.assertEqual(set(snapshot), {str(self.variant.pk), str(self.other.pk)})
+
+            await ProductVariant.objects.filter(pk=self.variant.pk).aupdate(reserved=2)
+            feed.feed.push([self.variant.pk])
+            await ProductVariant.objects.filter(pk=self.variant.pk).aupdate(stock=2)
+            feed.feed.push([self.variant.pk, self.other.pk])
+
+            # One event, with only the variant whose availability changed, as it is now
+            self.assertEqual(
+                self.changes(await anext(stream)), {str(self.variant.pk): {"available": 0, "in_stock": False}}
+            )
+        finally:
+            await stream.aclose()
+        self.assertIsNone(feed.feed._task)
+
+    def test_stock_changes_are_published_once_committed(self):
+        customer = User.objects.create_user("feed@phoenix.test", "pw-12345!")
+        order = seed_order(customer, [self.variant, self.other])
+
+        def published(change):
+            with mock.patch.object(feed.feed, "push") as push, self.captureOnCommitCallbacks(execute=True):
+                change()
+            return [set(call.args[0]) for call in push.call_args_list]
+
+        self.assertEqual(published(lambda: stock.reserve("guest:a", self.variant.pk, 2)), [{self.variant.pk}])
+        self.assertEqual(published(lambda: stock.take_stock({self.other.pk: 1})), [{self.other.pk}])
+
+        def cancel():
+            order.status = "cancelled"
+            request = RequestFactory().post("/")
+            request.user = customer
+            admin.site._registry[Order].save_model(request, order, None, True)
+        self.assertIn({self.variant.pk, self.other.pk}, published(cancel))
+        self.assertEqual(
+            list(ProductVariant.objects.filter(pk__in=[self.variant.pk, self.other.pk]).order_by("pk").values_list("stock", flat=True)),
+            [6, 5],
+        )
+
+        def edit():
+            self.variant.stock = 0
+            self.variant.save()
+        self.assertEqual(published(edit), [{self.variant.pk}])
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    PAGE_CACHE_TTL=300,
+)
+class AnonymousPageCacheTests(TestCase):
+    def setUp(self):
+        self.variant, _ = make_variants(2)
+        pagecache.invalidate()
+
+    def get(self, **headers):
+        return self.client.get(reverse("store:index"), headers=headers)
+
+    def test_anonymous_visitors_share_one_render(self):
+        first = self.get()
+        with self.assertNumQueries(0):
+            second = self.get()
+
+        self.assertEqual((first["X-Page-Cache"], second["X-Page-Cache"]), ("miss", "hit"))
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first["ETag"], second["ETag"])
+        self.assertEqual(second["Cache-Control"], "no-cache")
+        self.assertEqual(second["X-Accel-Expires"], "300")
+        # Nobody's cart or CSRF token in the shared page; the visitor's come from cart:cart_state
+        self.assertNotContains(first, 'name="csrfmiddlewaretoken" value=')
+        self.assertContains(first, reverse("cart:cart_state"))
+
+    def test_revalidation_with_etag(self):
+        etag = self.get()["ETag"]
+
+        self.assertEqual(self.get(if_none_match=etag).status_code, 304)
+
+    def test_catalog_changes_retire_the_page(self):
+        self.get()
+        Product.objects.filter(pk=self.variant.product_id).update(name="Renamed")
+        self.assertEqual(self.get()["X-Page-Cache"], "hit")
+
+        product = Product.objects.get(pk=self.variant.product_id)
+        product.save()
+        response = self.get()
+
+        self.assertEqual(response["X-Page-Cache"], "miss")
+        self.assertContains(response, "Renamed")
+
+    def test_logged_in_and_query_string_requests_bypass_the_cache(self):
+        self.assertNotIn("X-Page-Cache", self.client.get(reverse("store:index"), {"q": "x"}))
+        self.client.force_login(User.objects.create_user("cached@phoenix.test", "pw-12345!"))
+
+        response = self.get()
+
+        self.assertNotIn("X-Page-Cache", response)
+        self.assertContains(response, 'name="csrfmiddlewaretoken" value=')
+
+    @override_settings(PAGE_CACHE_TTL=0)
+    def test_disabled_with_zero_ttl(self):
+        self.assertNotIn("X-Page-Cache", self.get())
+
+    def test_cart_state_hydrates_the_cached_page(self):
+        self.get()
+        self.client.post(reverse("cart:add_to_cart", args=[self.variant.product_id]), {"variant_id": self.variant.id})
+        self.assertEqual(self.get()["X-Page-Cache"], "hit")
+
+        response = self.client.get(reverse("cart:cart_state"))
+
+        data = response.json()
+        self.assertEqual(data["cart_count"], 1)
+        self.assertIn('data-item-id="', data["cart_html"])
+        self.assertTrue(data["csrf_token"])
+        self.assertIn("csrftoken", response.cookies)
+        self.assertIn("no-cache", response["Cache-Control"])
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class ProductCardCacheTests(TestCase):
+    def setUp(self):
+        self.variants = make_variants(3)
+
+    def cards(self):
+        products = list(Product.objects.order_by("pk"))
+        with mock.patch("store.fragments.render_to_string", wraps=fragments.render_to_string) as render:
+            cards = fragments.product_cards(products)
+        return cards, sorted(call.args[1]["product"].pk for call in render.call_args_list)
+
+    def test_cards_are_rendered_once(self):
+        cards, rendered = self.cards()
+        self.assertEqual(len(rendered), 3)
+        self.assertIn('data-price="4.50"', cards[rendered[0]])
+
+        products = list(Product.objects.all())
+        with self.assertNumQueries(0):
+            again = fragments.product_cards(products)
+        self.assertEqual(again, cards)
+
+    def test_editing_a_variant_rerenders_only_its_card(self):
+        self.cards()
+        variant = self.variants[1]
+        variant.price = "9.99"
+        variant.save()
+
+        cards, rendered = self.cards()
+
+        self.assertEqual(rendered, [variant.product_id])
+        self.assertIn('data-price="9.99"', cards[variant.product_id])
+
+    def test_renaming_a_subcategory_rerenders_its_cards(self):
+        self.cards()
+        subcategory = SubCategory.objects.get()
+        subcategory.name = "Filleted"
+        subcategory.save()
+
+        cards, rendered = self.cards()
+
+        self.assertEqual(len(rendered), 3)
+        self.assertIn("Filleted", cards[rendered[0]])
+
+    def test_lookups_are_counted(self):
+        from perf.metrics import CACHE_LOOKUPS
+
+        with mock.patch.object(CACHE_LOOKUPS, "inc") as inc:
+            self.cards()
+            self.cards()
+
+        self.assertEqual(
+            [(call.args[0], call.kwargs["result"]) for call in inc.call_args_list],
+            [(0, "hit"), (3, "miss"), (3, "hit"), (0, "miss")],
+        )
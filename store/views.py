@@ -1,13 +1,18 @@
 import json
+from asgiref.sync import sync_to_async
 from django.db import models, transaction
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, logout, authenticate
-from django.http import JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.http import require_POST
 from django.views.generic.edit import CreateView
 from django.urls import reverse_lazy
 from store.models import Product, CustomUser, Address, Category, ProductVariant
-from cart.models import Cart, CartItem
+from cart.storage import aget_cart_storage
+from order.idempotency import issue_token
+from store import fragments, pagecache
+from store.feed import event_stream
 from .forms import CustomAuthenticationForm, CustomUserCreationForm
 from django.template.loader import render_to_string
 from django.contrib.auth.decorators import login_required
@@ -20,74 +25,65 @@ from django.db.models import Prefetch, Q
 from store.models import Product, CustomUser, Address, Category # Make sure to import Category
 # ... (Other imports) ...
 
-def index(request):
-    # --- 1. Prefetch only active products that have at least one active in-stock variant ---
-    products_qs = Product.objects.filter(is_active=True).prefetch_related(
-        Prefetch(
-            'variants',
-            queryset=ProductVariant.objects.filter(in_stock=True, is_active=True),
-            to_attr='available_variants'  # each product will now have this attr
-        )
-    ).filter(
+async def index(request):
+    # Async so ASGI workers keep serving while the catalog queries run; the
+    # template is rendered in a thread because the header and profile modal
+    # read the user's orders and session synchronously.
+    if await pagecache.acacheable(request):
+        # One page for every anonymous visitor; their cart is filled in after load (cart:cart_state)
+        return await pagecache.aserve(request, lambda: _render_index(request, anonymous=True))
+    return await _render_index(request)
+
+
+async def _render_index(request, anonymous=False):
+
+    # --- 1. Only active products that have at least one active in-stock variant ---
+    # Their variants are loaded by store.fragments, and only for cards it has to render.
+    products_qs = Product.objects.filter(is_active=True).filter(
         variants__in_stock=True, variants__is_active=True  # only include products with at least one active in-stock variant
     ).distinct().order_by('name')
 
     # --- 2. Prefetch products for each category ---
-    categories = Category.objects.prefetch_related(
-        Prefetch('products', queryset=products_qs)
-    ).distinct()
-
-    # --- 3. Cart Logic (Remains the same) ---
-    cart = None
-    cart_count = 0
-    cart_total = 0
-
-    if request.user.is_authenticated and not getattr(request.user, "is_guest", False):
-        try:
-            cart = Cart.objects.prefetch_related(
-                Prefetch('items', queryset=CartItem.objects.select_related('product'))
-            ).get(user=request.user)
-        except Cart.DoesNotExist:
-            pass
-    else:
-        if request.session.session_key:
-            try:
-                cart = Cart.objects.prefetch_related(
-                    Prefetch('items', queryset=CartItem.objects.select_related('product'))
-                ).get(session_key=request.session.session_key, is_guest=True)
-            except Cart.DoesNotExist:
-                pass
-
-    cart_items = []
-    if cart:
-        cart_items_with_totals = []
-        for item in cart.items.all():
-            item_data = {
-                "id": item.id,
-                "product": item.product,
-                "quantity": item.quantity,
-                "line_total": item.line_total,
-            }
-            cart_items_with_totals.append(item_data)
-
-        cart_count = len(cart_items_with_totals)
-        cart_total = sum(item["line_total"] for item in cart_items_with_totals)
-        cart_items = cart_items_with_totals
+    categories = [
+        category
+        async for category in Category.objects.prefetch_related(
+            Prefetch('products', queryset=products_qs)
+        ).distinct()
+    ]
+
+    products = [product for category in categories for product in category.products.all()]
+    cards = await sync_to_async(fragments.product_cards)(products)
+    for product in products:
+        product.card = cards[product.pk]
+
+    # --- 3. Cart Logic (guest carts may live in the session, see cart.storage) ---
+    cart_items = [] if anonymous else [
+        {
+            "id": item.id,
+            "product": item.product,
+            "quantity": item.quantity,
+            "line_total": item.line_total,
+        }
+        for item in await (await aget_cart_storage(request)).alines()
+    ]
+    cart_count = len(cart_items)
+    cart_total = sum(item["line_total"] for item in cart_items)
 
     request.cart_count = cart_count
     request.cart_items = cart_items
     request.cart_total = cart_total
 
+    context = {
+        "categories": categories,
+        "cart_items": cart_items,
+        "cart_total": cart_total,
+    }
+    if anonymous:
+        # Shared page: no visitor's CSRF token in it; the hydration script adds one
+        context.update(hydrate_cart=True, csrf_token="")
+
     # --- 4. Render template ---
-    return render(
-        request,
-        "store/index.html",
-        {
-            "categories": categories,
-            "cart_items": cart_items,
-            "cart_total": cart_total,
-        },
-    )
+    return await sync_to_async(render)(request, "store/index.html", context)
 
 
 
@@ -124,10 +120,17 @@ def buy_now(request, product_id):
             return JsonResponse({"success": False, "message": "Invalid quantity or variant."}, status=400)
             
         product = get_object_or_404(Product, id=product_id)
-        variant = get_object_or_404(ProductVariant, id=variant_id, product=product, is_active=True)
+        variant = get_object_or_404(
+            ProductVariant.objects.select_related('subcategory'), id=variant_id, product=product, is_active=True
+        )
         
         if not variant.in_stock:
             return JsonResponse({"success": False, "message": "This variant is out of stock."}, status=400)
+        if quantity > variant.available:
+            # Stock held by other shoppers' carts isn't for sale (store/stock.py)
+            return JsonResponse(
+                {"success": False, "message": f"Sorry, only {variant.available} available."}, status=400
+            )
 
         # Store the Buy Now item data in the session
         # This is a temporary "cart" for the checkout process
@@ -159,6 +162,18 @@ def buy_now(request, product_id):
         return JsonResponse({
             "success": True,
             "summary_html": summary_html,
+            "checkout_token": issue_token(),
         })
 
     return JsonResponse({"success": False, "message": "Invalid request"}, status=400)
+
+
+async def stock_events(request):
+    """Server-Sent Events with live variant availability (store/feed.py), for the index page."""
+    if not isinstance(request, ASGIRequest):
+        # The feed lives on the ASGI event loop; 204 tells EventSource not to reconnect
+        return HttpResponse(status=204)
+    response = StreamingHttpResponse(event_stream(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # nginx would hold events back otherwise
+    return response
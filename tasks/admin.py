@@ -0,0 +1,10 @@
+from django.contrib import admin
+from tasks.models import Task
+
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ("id", "name", "status", "attempts", "run_at", "created_at", "finished_at")
+    list_filter = ("status", "name")
+    search_fields = ("idempotency_key",)
+    readonly_fields = ("created_at", "finished_at", "locked_by", "locked_at", "heartbeat_at", "last_error")
@@ -0,0 +1,31 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from tasks.queue import Worker, run_due
+
+
+class Command(BaseCommand):
+    help = "Run queued background tasks (email, invoice PDFs) until stopped."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=4,
+                            help="Tasks run at once, each on its own thread.")
+        parser.add_argument("--poll-interval", type=float, default=1.0,
+                            help="Seconds to wait between polls when the queue is empty.")
+        parser.add_argument("--once", action="store_true",
+                            help="Run every task that is due now in this thread, then exit.")
+
+    def handle(self, *args, **options):
+        if options["once"]:
+            succeeded, failed = run_due()
+            self.stdout.write(self.style.SUCCESS(f"Ran {succeeded + failed} tasks ({failed} failed)"))
+            return
+
+        worker = Worker(concurrency=options["concurrency"], poll_interval=options["poll_interval"])
+        # Finish the tasks in flight on SIGTERM (docker stop) or Ctrl-C, then exit
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: worker.stop())
+        self.stdout.write(f"Worker {worker.worker_id} running {options['concurrency']} threads")
+        worker.run()
+        self.stdout.write("Worker stopped")
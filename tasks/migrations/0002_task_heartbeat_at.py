@@ -0,0 +1,26 @@
+# Generated by Django 5.2.5 on 2026-10-19 02:33
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def start_heartbeats(apps, schema_editor):
+    # Tasks already running count from their claim, as they did before
+    Task = apps.get_model("tasks", "Task")
+    Task.objects.filter(status="running").update(heartbeat_at=F("locked_at"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(start_heartbeats, migrations.RunPython.noop),
+    ]
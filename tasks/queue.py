@@ -0,0 +1,270 @@
+# tasks/queue.py
+"""
+A small database-backed task queue for slow side effects (email, PDFs).
+
+Declare a task in an app's ``tasks.py`` and enqueue it from a view::
+
+    @task(max_attempts=3)
+    def send_welcome(email):
+        ...
+
+    send_welcome.enqueue(email=user.email, idempotency_key=f"welcome:{user.pk}")
+
+``enqueue`` defers the write with ``transaction.on_commit``, so a task is
+never queued for a transaction that rolls back, and a worker never picks
+one up before the rows it refers to are visible. Arguments are stored as
+JSON, so pass ids and strings rather than model instances.
+
+``manage.py run_tasks`` claims due rows and runs them on a thread pool. A
+failure is retried ``max_attempts`` times with exponential backoff. While
+a worker is alive it refreshes ``heartbeat_at`` on the rows it is running
+every ``HEARTBEAT_INTERVAL``, however long a task takes; a row whose
+heartbeat is older than ``STALE_AFTER`` belonged to a worker that died
+mid-run. It is handed out again, or marked failed once it has used up its
+``max_attempts``, so a task that kills its worker doesn't loop forever. An
+``idempotency_key`` makes repeat enqueues of the same job a no-op, and
+tasks should also tolerate running twice after a crash.
+
+With ``TASKS_EAGER = True`` (tests, one-process development) the task runs
+in-process as soon as the transaction commits, through the same code path
+a worker uses.
+"""
+import logging
+import os
+import socket
+import threading
+import traceback
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from tasks.models import Task
+
+logger = logging.getLogger(__name__)
+
+REGISTRY = {}
+MAX_BACKOFF = 60 * 60
+STALE_AFTER = timedelta(minutes=10)
+HEARTBEAT_INTERVAL = STALE_AFTER / 5
+
+
+def eager():
+    return getattr(settings, "TASKS_EAGER", False)
+
+
+def task(func=None, *, name=None, max_attempts=5, backoff=30):
+    """
+    Register ``func`` as a task. The function stays directly callable and
+    gains ``func.enqueue(**kwargs)``. ``backoff`` is the first retry delay in
+    seconds; it doubles per attempt up to ``MAX_BACKOFF``.
+    """
+    def decorate(func):
+        func.task_name = name or f"{func.__module__}.{func.__name__}"
+        func.max_attempts = max_attempts
+        func.backoff = backoff
+        func.enqueue = lambda idempotency_key=None, delay=0, **kwargs: enqueue(
+            func, kwargs, idempotency_key=idempotency_key, delay=delay
+        )
+        REGISTRY[func.task_name] = func
+        return func
+
+    return decorate(func) if func is not None else decorate
+
+
+def enqueue(func, kwargs=None, idempotency_key=None, delay=0):
+    """Queue ``func(**kwargs)`` once the current transaction commits."""
+    kwargs = kwargs or {}
+    transaction.on_commit(lambda: _dispatch(func, kwargs, idempotency_key, delay))
+
+
+def _dispatch(func, kwargs, idempotency_key, delay):
+    row = Task(
+        name=func.task_name,
+        kwargs=kwargs,
+        idempotency_key=idempotency_key,
+        max_attempts=func.max_attempts,
+        run_at=timezone.now() + timedelta(seconds=delay),
+    )
+    try:
+        with transaction.atomic():
+            row.save()
+    except IntegrityError:
+        if idempotency_key is None:
+            raise
+        logger.debug("Task %s with key %s already queued", func.task_name, idempotency_key)
+        return None
+
+    if eager() and not delay:
+        if Task.objects.filter(pk=row.pk, status=Task.PENDING).update(
+            status=Task.RUNNING, attempts=F("attempts") + 1, locked_by="eager",
+            locked_at=timezone.now(), heartbeat_at=timezone.now(),
+        ):
+            row.refresh_from_db()
+            run_task(row)
+    return row
+
+
+def backoff_delay(func, attempts):
+    """Seconds to wait before retrying after the ``attempts``-th failure."""
+    return min(func.backoff * 2 ** (attempts - 1), MAX_BACKOFF)
+
+
+def run_task(row):
+    """Run one claimed task and record the outcome; never raises."""
+    func = REGISTRY.get(row.name)
+    try:
+        if func is None:
+            raise LookupError(f"No task registered as {row.name!r}")
+        func(**row.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        if func is None or row.attempts >= row.max_attempts:
+            logger.error("Task %s #%s failed for good after %s attempts:\n%s", row.name, row.pk, row.attempts, error)
+            Task.objects.filter(pk=row.pk).update(status=Task.FAILED, last_error=error, finished_at=timezone.now())
+        else:
+            retry_at = timezone.now() + timedelta(seconds=backoff_delay(func, row.attempts))
+            logger.warning("Task %s #%s failed (attempt %s), retrying at %s", row.name, row.pk, row.attempts, retry_at)
+            Task.objects.filter(pk=row.pk).update(status=Task.PENDING, last_error=error, run_at=retry_at)
+        return False
+    Task.objects.filter(pk=row.pk).update(status=Task.DONE, finished_at=timezone.now())
+    return True
+
+
+def claim(worker_id, limit):
+    """Mark up to ``limit`` due tasks as running for ``worker_id`` and return them."""
+    now = timezone.now()
+    due = Task.objects.filter(status=Task.PENDING, run_at__lte=now).order_by("run_at", "id")
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(due.select_for_update(skip_locked=True).values_list("id", flat=True)[:limit])
+            Task.objects.filter(pk__in=ids).update(
+                status=Task.RUNNING, attempts=F("attempts") + 1, locked_by=worker_id, locked_at=now, heartbeat_at=now
+            )
+    else:
+        # No SKIP LOCKED (SQLite): a conditional update claims each row at most once
+        ids = []
+        for pk in due.values_list("id", flat=True)[:limit * 2]:
+            if Task.objects.filter(pk=pk, status=Task.PENDING).update(
+                status=Task.RUNNING, attempts=F("attempts") + 1, locked_by=worker_id, locked_at=now, heartbeat_at=now
+            ):
+                ids.append(pk)
+            if len(ids) == limit:
+                break
+    return list(Task.objects.filter(pk__in=ids).order_by("run_at", "id"))
+
+
+def heartbeat(worker_id):
+    """Mark ``worker_id``'s running tasks as still in progress."""
+    return Task.objects.filter(status=Task.RUNNING, locked_by=worker_id).update(heartbeat_at=timezone.now())
+
+
+def requeue_stale(older_than=STALE_AFTER):
+    """
+    Hand tasks whose worker stopped heartbeating back to the queue, or fail
+    them if that was their last attempt. Returns ``(requeued, failed)``.
+    """
+    now = timezone.now()
+    stale = Task.objects.filter(status=Task.RUNNING, heartbeat_at__lt=now - older_than)
+    failed = stale.filter(attempts__gte=F("max_attempts")).update(
+        status=Task.FAILED, locked_by="", finished_at=now,
+        last_error="The worker stopped heartbeating on the last attempt (it crashed or was killed).",
+    )
+    requeued = stale.update(status=Task.PENDING, locked_by="")
+    return requeued, failed
+
+
+class Heartbeat(threading.Thread):
+    """Calls ``heartbeat(worker_id)`` every ``HEARTBEAT_INTERVAL`` until stopped."""
+
+    def __init__(self, worker_id):
+        super().__init__(daemon=True, name="task-heartbeat")
+        self.worker_id = worker_id
+        self.stopping = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopping.wait(HEARTBEAT_INTERVAL.total_seconds()):
+                close_old_connections()
+                heartbeat(self.worker_id)
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopping.set()
+        self.join()
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+def run_due(worker_id=None, limit=100):
+    """Run every task due now in this thread; returns ``(succeeded, failed)``."""
+    worker_id = worker_id or worker_name()
+    succeeded = failed = 0
+    beat = Heartbeat(worker_id)
+    beat.start()
+    try:
+        while True:
+            batch = claim(worker_id, limit)
+            if not batch:
+                return succeeded, failed
+            for row in batch:
+                if run_task(row):
+                    succeeded += 1
+                else:
+                    failed += 1
+    finally:
+        beat.stop()
+
+
+class Worker:
+    """Polls for due tasks and runs up to ``concurrency`` of them at once."""
+
+    def __init__(self, concurrency=4, poll_interval=1.0):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.worker_id = worker_name()
+        self.stopping = threading.Event()
+
+    def stop(self):
+        self.stopping.set()
+
+    def _execute(self, row):
+        close_old_connections()
+        try:
+            return run_task(row)
+        finally:
+            close_old_connections()
+
+    def run(self):
+        running = set()
+        last_stale_check = None
+        beat = Heartbeat(self.worker_id)
+        beat.start()
+        try:
+            with ThreadPoolExecutor(self.concurrency, thread_name_prefix="task") as pool:
+                while not self.stopping.is_set():
+                    close_old_connections()
+                    if last_stale_check is None or timezone.now() - last_stale_check > HEARTBEAT_INTERVAL:
+                        requeued, failed = requeue_stale()
+                        if requeued or failed:
+                            logger.warning("Stale tasks: %s requeued, %s failed for good", requeued, failed)
+                        last_stale_check = timezone.now()
+
+                    free = self.concurrency - len(running)
+                    claimed = claim(self.worker_id, free) if free else []
+                    running.update(pool.submit(self._execute, row) for row in claimed)
+                    if running and (len(running) == self.concurrency or not claimed):
+                        _, running = wait(running, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                    elif not claimed:
+                        self.stopping.wait(self.poll_interval)
+                # Let in-flight tasks finish; unclaimed ones stay queued for the next worker
+                wait(running)
+        finally:
+            beat.stop()
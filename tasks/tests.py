@@ -0,0 +1,138 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from tasks.models import Task
+from tasks.queue import claim, heartbeat, requeue_stale, run_task, task
+
+calls = []
+
+
+@task
+def record(value):
+    calls.append(value)
+
+
+@task(max_attempts=2, backoff=10)
+def explode():
+    raise RuntimeError("boom")
+
+
+class TaskQueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_enqueue_waits_for_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            record.enqueue(value=1)
+            self.assertFalse(Task.objects.exists())
+
+        row = Task.objects.get()
+        self.assertEqual((row.name, row.kwargs, row.status), ("tasks.tests.record", {"value": 1}, Task.PENDING))
+        self.assertEqual(calls, [])
+
+    def test_rolled_back_transaction_queues_nothing(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                record.enqueue(value=1)
+                transaction.set_rollback(True)
+
+        self.assertFalse(Task.objects.exists())
+
+    def test_idempotency_key_deduplicates(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            record.enqueue(value=1, idempotency_key="once")
+            record.enqueue(value=2, idempotency_key="once")
+
+        self.assertEqual(Task.objects.get().kwargs, {"value": 1})
+
+    @override_settings(TASKS_EAGER=True)
+    def test_eager_mode_runs_in_process_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            record.enqueue(value=3)
+            self.assertEqual(calls, [])
+
+        self.assertEqual(calls, [3])
+        row = Task.objects.get()
+        self.assertEqual((row.status, row.attempts), (Task.DONE, 1))
+
+    def test_failures_back_off_then_fail(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            explode.enqueue()
+
+        row, = claim("test", 10)
+        with self.assertLogs("tasks", "WARNING"):
+            self.assertFalse(run_task(row))
+        row.refresh_from_db()
+        self.assertEqual((row.status, row.attempts), (Task.PENDING, 1))
+        self.assertIn("RuntimeError: boom", row.last_error)
+        self.assertGreater(row.run_at, timezone.now() + timedelta(seconds=9))
+        self.assertEqual(claim("test", 10), [])  # not due yet
+
+        Task.objects.update(run_at=timezone.now())
+        row, = claim("test", 10)
+        with self.assertLogs("tasks", "ERROR"):
+            run_task(row)
+        row.refresh_from_db()
+        self.assertEqual((row.status, row.attempts), (Task.FAILED, 2))
+
+    def test_claimed_tasks_are_not_handed_out_twice(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for value in range(3):
+                record.enqueue(value=value)
+
+        first = claim("a", 2)
+        second = claim("b", 2)
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 1)
+        self.assertFalse({row.pk for row in first} & {row.pk for row in second})
+
+    def test_stale_running_tasks_are_requeued(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            record.enqueue(value=1)
+        claim("crashed", 1)
+        Task.objects.update(heartbeat_at=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual(requeue_stale(), (1, 0))
+        self.assertEqual(len(claim("next", 1)), 1)
+
+    def test_slow_tasks_that_still_heartbeat_are_left_running(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            record.enqueue(value=1)
+        claim("slow", 1)
+        Task.objects.update(locked_at=timezone.now() - timedelta(hours=1),
+                            heartbeat_at=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual(heartbeat("slow"), 1)
+        self.assertEqual(requeue_stale(), (0, 0))
+        self.assertEqual(Task.objects.get().status, Task.RUNNING)
+
+    def test_stale_tasks_on_their_last_attempt_fail_instead_of_looping(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            explode.enqueue()
+        for worker in ("crashed-1", "crashed-2"):
+            self.assertEqual(len(claim(worker, 1)), 1)
+            Task.objects.update(heartbeat_at=timezone.now() - timedelta(hours=1))
+            requeue_stale()
+
+        row = Task.objects.get()
+        self.assertEqual((row.status, row.attempts), (Task.FAILED, 2))
+        self.assertIn("stopped heartbeating", row.last_error)
+        self.assertEqual(claim("next", 1), [])
+
+    def test_run_tasks_once(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            record.enqueue(value=1)
+            record.enqueue(value=2)
+            explode.enqueue()
+        out = StringIO()
+
+        with self.assertLogs("tasks", "WARNING"):
+            call_command("run_tasks", "--once", stdout=out)
+
+        self.assertEqual(sorted(calls), [1, 2])
+        self.assertIn("Ran 3 tasks (1 failed)", out.getvalue())
@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.core.mail import send_mail
+
+from tasks.queue import task
+
+
+@task(max_attempts=5, backoff=60)
+def send_guest_welcome(email, site_url):
+    send_mail(
+        'Complete your registration',
+        f'Set your password here: {site_url}/accounts/password_reset/',
+        settings.DEFAULT_FROM_EMAIL,
+        [email]
+    )
@@ -1,3 +1,35 @@
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.test import TestCase, override_settings
+from django.urls import reverse
 
-# Create your tests here.
+from tasks.models import Task
+
+User = get_user_model()
+
+
+class GuestCheckoutTests(TestCase):
+    def guest(self, email="shopper@phoenix.test"):
+        return self.client.post(
+            reverse("users:handle_auth_modal"),
+            {"action": "guest", "email": email},
+            headers={"x-requested-with": "XMLHttpRequest"},
+        )
+
+    def test_guest_email_is_queued_not_sent(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.guest()
+
+        self.assertEqual(response.json(), {"success": True})
+        self.assertTrue(User.objects.get(email="shopper@phoenix.test").is_guest)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(Task.objects.get().name, "users.tasks.send_guest_welcome")
+
+    @override_settings(TASKS_EAGER=True)
+    def test_guest_email_sent_in_eager_mode(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.guest()
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["shopper@phoenix.test"])
+        self.assertIn("http://testserver/accounts/password_reset/", mail.outbox[0].body)
@@ -1,14 +1,15 @@
-from django.contrib.auth import login, authenticate
+from django.contrib.auth import get_user_model, login, authenticate
 from django.contrib.auth.forms import AuthenticationForm, UserCreationForm
-from django.contrib.auth.models import User
-from django.core.mail import send_mail
-from django.conf import settings
 from django.http import JsonResponse
 from django.shortcuts import redirect, render
-import uuid
+import logging
 import re
 from django.core.validators import validate_email
 from django.core.exceptions import ValidationError
+from django.db import transaction
+from .tasks import send_guest_welcome
+
+logger = logging.getLogger(__name__)
 
 def validate_user_email(email):
     try:
@@ -21,8 +22,8 @@ def validate_user_email(email):
 
 
 def handle_auth_modal(request):
-    print(f"Auth request method: {request.method}")
-    print(f"Is AJAX: {request.headers.get('X-Requested-With') == 'XMLHttpRequest'}")
+    logger.debug("Auth request method=%s ajax=%s", request.method,
+                 request.headers.get('X-Requested-With') == 'XMLHttpRequest')
     
     if request.method == 'POST':
         # Check if it's an AJAX request
@@ -30,7 +31,7 @@ def handle_auth_modal(request):
         
         # Get action from POST data
         action = request.POST.get('action')
-        print(f"Auth action: {action}")
+        logger.debug("Auth action: %s", action)
         
         if not action:
             if is_ajax:
@@ -91,18 +92,17 @@ def handle_auth_modal(request):
                 return redirect('store:index')
             
             try:
-                username = f"guest_{uuid.uuid4().hex[:10]}"
-                password = User.objects.make_random_password()
-                user = User.objects.create_user(username, email, password)
-                
-                send_mail(
-                    'Complete your registration',
-                    f'Set your password here: {settings.SITE_URL}/accounts/password_reset/',
-                    settings.DEFAULT_FROM_EMAIL,
-                    [email]
-                )
+                with transaction.atomic():
+                    # No password until they complete registration from the email
+                    user = get_user_model().objects.create_user(email, is_guest=True)
+                    # Sent by the task worker once the account is committed
+                    send_guest_welcome.enqueue(
+                        email=email,
+                        site_url=request.build_absolute_uri('/').rstrip('/'),
+                        idempotency_key=f"guest-welcome:{user.pk}",
+                    )
                 
-                login(request, user)
+                login(request, user, backend='django.contrib.auth.backends.ModelBackend')
                 if is_ajax:
                     return JsonResponse({'success': True})
                 return redirect('store:index')